@@ -0,0 +1,71 @@
+"""Helpers shared by the benchmark suites."""
+from __future__ import annotations
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from typing import Dict, List, Sequence
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100.0 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, rank))]
+
+
+def summarize_latencies(latencies_ms: List[float]) -> Dict[str, float]:
+    """Mean and p50/p95/p99 of a list of latencies in milliseconds."""
+    values = sorted(latencies_ms)
+    return {
+        'mean_ms': round(sum(values) / len(values), 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+    }
+
+
+def run_metadata(**extra) -> dict:
+    """Describe the environment a benchmark ran in."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    meta = {
+        'git_commit': commit,
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+    meta.update(extra)
+    return meta
+
+
+def write_results(path: str, results: dict) -> None:
+    """Write results as stable, diff-friendly JSON."""
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare_metric(name: str, current: float, baseline: float, higher_is_better: bool,
+                   max_regression: float) -> tuple[str, bool]:
+    """Format a metric change and report whether it regressed past the limit."""
+    if not baseline:
+        return f"{name}: {current:.2f} (no baseline)", False
+    change = (current - baseline) / baseline
+    regressed = -change > max_regression if higher_is_better else change > max_regression
+    marker = '  REGRESSION' if regressed else ''
+    return f"{name}: {baseline:.2f} -> {current:.2f} ({change:+.1%}){marker}", regressed
@@ -0,0 +1,43 @@
+"""Seed benchmark databases of a given size."""
+from __future__ import annotations
+import os
+import sys
+from datetime import datetime
+from typing import Dict, List
+
+from common import REPO_ROOT
+from sqlalchemy import insert, select
+from shared.models import init_db, Message, InviteLink
+
+sys.path.insert(0, os.path.join(REPO_ROOT, 'scripts'))
+from populate_test_db import populate  # noqa: E402
+
+
+def seed_database(database_url: str, messages: int, invite_links: int = None,
+                  media_ratio: float = 0.4, seed: int = 1234) -> Dict[str, List]:
+    """
+    Fill a fresh database with ``messages`` generated messages.
+
+    Rows come from ``scripts/populate_test_db.py`` so benchmarks run against
+    the same distributions as manual testing. On top of those, a set of
+    unlimited, active ``bench…`` invite links is added for the submit routes.
+
+    Returns:
+        Dict with the invite ``tokens`` and ``pending_ids`` for driving
+        submission and moderation routes.
+    """
+    invite_links = invite_links if invite_links is not None else max(10, messages // 10)
+    populate(database_url, messages, invite_links, seed=seed, media_ratio=media_ratio)
+
+    Session, engine = init_db(database_url)
+    now = datetime.utcnow()
+    tokens = [f"bench{i:08d}" for i in range(invite_links)]
+    with engine.begin() as conn:
+        conn.execute(insert(InviteLink.__table__), [
+            {'token': token, 'created_at': now, 'uses_count': 0, 'is_active': True, 'note': 'benchmark'}
+            for token in tokens
+        ])
+        pending_ids = conn.execute(
+            select(Message.id).where(Message.status == 'pending')
+        ).scalars().all()
+    return {'tokens': tokens, 'pending_ids': pending_ids}
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""HTTP load benchmark for the dashboard, submit and card services.
+
+For every dataset size a fresh SQLite database is seeded, the three services
+are started under gunicorn with their production configs, and each endpoint
+is driven by concurrent keep-alive clients. Throughput and latency
+percentiles are reported per endpoint and written as JSON that can be
+diffed or compared between commits.
+
+Usage:
+  python benchmarks/http_load.py --sizes 1000,10000 --output bench.json
+  python benchmarks/http_load.py --sizes 10000 --baseline bench.json --max-regression 0.2
+"""
+from __future__ import annotations
+import argparse
+import http.client
+import itertools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from common import REPO_ROOT, compare_metric, run_metadata, summarize_latencies, write_results
+from dataset import seed_database
+
+SERVICES = ('dashboard', 'submit', 'card')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class ServiceCluster:
+    """Run the three services under gunicorn against one database."""
+
+    def __init__(self, database_url: str, media_path: str, workers: int):
+        self.env = dict(
+            os.environ,
+            DATABASE_URL=database_url,
+            MEDIA_PATH=media_path,
+            RATELIMIT_ENABLED='false',
+            GUNICORN_WORKERS=str(workers),
+        )
+        self.ports = {name: free_port() for name in SERVICES}
+        self.processes = []
+
+    def __enter__(self):
+        for name in SERVICES:
+            self.processes.append(subprocess.Popen(
+                ['gunicorn', '-c', 'gunicorn.conf.py', '-b', f"127.0.0.1:{self.ports[name]}",
+                 '--log-level', 'warning', 'app:create_app()'],
+                cwd=os.path.join(REPO_ROOT, 'services', name),
+                env=self.env,
+            ))
+        for name in SERVICES:
+            self._wait_until_ready(self.ports[name])
+        return self
+
+    def __exit__(self, *exc):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait(timeout=30)
+
+    def _wait_until_ready(self, port: int, timeout: float = 30.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                    return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError(f"Service on port {port} did not start")
+
+
+class Endpoint:
+    """A named request pattern against one service."""
+
+    def __init__(self, name: str, service: str, method: str, paths, body_factory=None):
+        self.name = name
+        self.service = service
+        self.method = method
+        self.paths = paths
+        self.body_factory = body_factory
+
+
+def build_endpoints(dataset: dict) -> list:
+    """Describe the hot routes of each service."""
+    tokens = itertools.cycle(dataset['tokens'])
+    token_lock = threading.Lock()
+    pending = iter(dataset['pending_ids'])
+    pending_lock = threading.Lock()
+    counter = itertools.count()
+
+    def next_token():
+        with token_lock:
+            return next(tokens)
+
+    def next_pending():
+        with pending_lock:
+            return next(pending, None)
+
+    def submission_body():
+        n = next(counter)
+        return urlencode({'name': f"Load Tester {n}", 'content': f"<p>Load test message {n}</p>"})
+
+    return [
+        Endpoint('GET /', 'card', 'GET', lambda: '/'),
+        Endpoint('GET /api/messages', 'card', 'GET', lambda: '/api/messages'),
+        Endpoint('GET /submit/<token>', 'submit', 'GET', lambda: f"/submit/{next_token()}"),
+        Endpoint('POST /submit/<token>', 'submit', 'POST', lambda: f"/submit/{next_token()}", submission_body),
+        Endpoint('GET dashboard /', 'dashboard', 'GET', lambda: '/'),
+        Endpoint('GET /messages/pending', 'dashboard', 'GET', lambda: '/messages/pending'),
+        Endpoint('GET /messages/approved', 'dashboard', 'GET', lambda: '/messages/approved'),
+        Endpoint('GET /invite-links', 'dashboard', 'GET', lambda: '/invite-links'),
+        Endpoint('POST /messages/<id>/approve', 'dashboard', 'POST',
+                 lambda: (lambda mid: f"/messages/{mid}/approve" if mid else None)(next_pending())),
+    ]
+
+
+def drive(endpoint: Endpoint, port: int, requests: int, concurrency: int) -> dict:
+    """Send ``requests`` requests from ``concurrency`` keep-alive clients.
+
+    Throughput and latencies cover successful responses only; failed
+    requests (errors and statuses >= 400) are counted in ``errors``.
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = itertools.count()
+
+    def client():
+        nonlocal errors
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        local_latencies = []
+        local_errors = 0
+        while next(remaining) < requests:
+            path = endpoint.paths()
+            if path is None:
+                break
+            body = endpoint.body_factory() if endpoint.body_factory else None
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body else {}
+            start = time.perf_counter()
+            try:
+                conn.request(endpoint.method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+            except (OSError, http.client.HTTPException):
+                local_errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+                continue
+            if response.status >= 400:
+                local_errors += 1
+                continue
+            local_latencies.append((time.perf_counter() - start) * 1000)
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            errors += local_errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(client) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    result = {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+    result.update(summarize_latencies(latencies))
+    return result
+
+
+def run_size(size: int, args) -> dict:
+    """Seed a database of ``size`` messages and benchmark every endpoint."""
+    work_dir = tempfile.mkdtemp(prefix=f"bench-{size}-")
+    try:
+        database_url = f"sqlite:///{work_dir}/virtual_card.db"
+        print(f"Seeding {size} messages...", flush=True)
+        dataset = seed_database(database_url, size, media_ratio=args.media_ratio, seed=args.seed)
+        results = {}
+        with ServiceCluster(database_url, f"{work_dir}/media", args.workers) as cluster:
+            for endpoint in build_endpoints(dataset):
+                port = cluster.ports[endpoint.service]
+                drive(endpoint, port, args.warmup, args.concurrency)
+                result = drive(endpoint, port, args.requests, args.concurrency)
+                results[endpoint.name] = result
+                print(f"  {endpoint.name:32s} {result['rps']:9.1f} req/s  "
+                      f"p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms  "
+                      f"p99 {result['p99_ms']:8.2f} ms  errors {result['errors']}", flush=True)
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    """Print changes against a baseline run; return True if anything regressed."""
+    regressed = False
+    for size, endpoints in results['results'].items():
+        for name, current in endpoints.items():
+            previous = baseline.get('results', {}).get(size, {}).get(name)
+            if not previous:
+                continue
+            for metric, higher_is_better in (('rps', True), ('p95_ms', False)):
+                line, bad = compare_metric(metric, current[metric], previous[metric],
+                                           higher_is_better, max_regression)
+                print(f"[{size}] {name:32s} {line}")
+                regressed = regressed or bad
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000', help='Comma-separated message counts (e.g. 1000,10000,100000)')
+    parser.add_argument('--requests', type=int, default=500, help='Measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--workers', type=int, default=4, help='Gunicorn workers per service')
+    parser.add_argument('--media-ratio', type=float, default=0.4, help='Share of messages with media')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', '-o', help='Write results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against a previous JSON result')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='Exit non-zero when rps drops or p95 grows by more than this fraction')
+    args = parser.parse_args()
+
+    results = {
+        'meta': run_metadata(concurrency=args.concurrency, requests=args.requests,
+                             workers=args.workers, media_ratio=args.media_ratio, seed=args.seed),
+        'results': {},
+    }
+    for size in (int(s) for s in args.sizes.split(',')):
+        print(f"Dataset: {size} messages")
+        results['results'][str(size)] = run_size(size, args)
+
+    if args.output:
+        write_results(args.output, results)
+        print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
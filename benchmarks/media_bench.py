@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks for the media and content pipeline.
+
+Covers ``ImageProcessor.save_image``, ``VideoProcessor.save_video``,
+``ContentSanitizer.sanitize`` and the ``NameFormatter`` helpers against
+generated fixtures. Every case runs in its own Python process so wall time,
+CPU time (including ffmpeg child processes) and peak RSS are attributed to
+that operation alone.
+
+Per-case ceilings live in ``media_thresholds.json``; the run exits non-zero
+when a case exceeds them, or when ``--baseline`` is given and a metric
+regresses by more than ``--max-regression``. The ceilings are measured
+values plus ``THRESHOLD_MARGINS``, written with ``--write-thresholds``.
+
+Usage:
+  python benchmarks/media_bench.py --output media.json
+  python benchmarks/media_bench.py --cases 'image/*' --baseline media.json
+  python benchmarks/media_bench.py --write-thresholds benchmarks/media_thresholds.json
+"""
+from __future__ import annotations
+import argparse
+import fnmatch
+import json
+import math
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import REPO_ROOT, compare_metric, run_metadata, summarize_latencies, write_results
+
+sys.path.insert(0, os.path.join(REPO_ROOT, 'scripts'))
+from populate_test_db import TestDataGenerator, synthesize_image, synthesize_video  # noqa: E402
+
+DEFAULT_THRESHOLDS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media_thresholds.json')
+
+# metric -> (factor, added): a ceiling is measured * factor + added, so
+# every case gets the same relative headroom plus room for timer noise
+THRESHOLD_MARGINS = {'p95_ms': (1.5, 5), 'peak_rss_mb': (1.0, 32)}
+
+# name -> (kind, fixture spec, default iterations)
+CASES = {
+    'image/jpeg-640x480': ('image', ('JPEG', (640, 480), False), 20),
+    'image/jpeg-1920x1080': ('image', ('JPEG', (1920, 1080), False), 10),
+    'image/jpeg-4000x3000': ('image', ('JPEG', (4000, 3000), False), 5),
+    'image/png-rgba-1600x1200': ('image', ('PNG', (1600, 1200), True), 10),
+    'image/webp-1280x720': ('image', ('WEBP', (1280, 720), False), 10),
+    'video/mp4-3s-640x360': ('video', ('.mp4', 3.0, '640x360'), 3),
+    'video/mov-3s-1280x720': ('video', ('.mov', 3.0, '1280x720'), 3),
+    'sanitize/short': ('sanitize', 1, 500),
+    'sanitize/long': ('sanitize', 300, 20),
+    'sanitize/hostile': ('sanitize', 'hostile', 200),
+    'sanitize/cached': ('sanitize-cached', 100, 500),
+    'names/format-initials-color': ('names', 1000, 20),
+}
+
+HOSTILE_HTML = (
+    '<p onclick="steal()">Hi <script>alert(1)</script><img src=x onerror=alert(2)></p>'
+    '<a href="javascript:alert(3)" title="x">link</a>'
+    '<span style="color: red; background-image: url(javascript:alert(4)); position: fixed">styled</span>'
+    '<iframe src="https://example.com"></iframe><svg><g onload="alert(5)"/></svg>'
+    '<p>' + '<strong><em><u>' * 50 + 'nested' + '</u></em></strong>' * 50 + '</p>'
+)
+
+
+def create_fixture(name: str, fixtures_dir: str) -> str | None:
+    """Write the input for a case to disk; None if it cannot be generated."""
+    kind, spec, _ = CASES[name]
+    path = os.path.join(fixtures_dir, name.replace('/', '_'))
+    generator = TestDataGenerator(seed=42)
+    if kind == 'image':
+        image_format, size, rgba = spec
+        data = synthesize_image(42, size, image_format, rgba)
+    elif kind == 'video':
+        if not shutil.which('ffmpeg'):
+            return None
+        ext, duration, size = spec
+        path += ext
+        synthesize_video(path, duration=duration, size=size)
+        return path
+    elif kind in ('sanitize', 'sanitize-cached'):
+        html = HOSTILE_HTML if spec == 'hostile' else ''.join(generator.content() for _ in range(spec))
+        data = html.encode()
+    else:
+        data = '\n'.join(generator.names() for _ in range(spec)).encode()
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB.
+
+    ``VmHWM`` is per address space, so unlike ``ru_maxrss`` it does not carry
+    over the parent's peak across exec and can be reset by ``_reset_peak_rss``.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 2)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+
+
+def _reset_peak_rss() -> None:
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _cpu_seconds() -> float:
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def run_case(name: str, fixture: str, media_dir: str, iterations: int) -> dict:
+    """Measure one case in the current process (called in a fresh interpreter)."""
+    kind, spec, _ = CASES[name]
+    with open(fixture, 'rb') as f:
+        data = f.read()
+
+    if kind == 'image':
+        from shared.utils import ImageProcessor
+        processor = ImageProcessor(media_dir)
+        filename = 'fixture.' + spec[0].lower().replace('jpeg', 'jpg')
+        op = lambda: processor.save_image(data, filename)  # noqa: E731
+    elif kind == 'video':
+        from shared.utils import VideoProcessor
+        processor = VideoProcessor(media_dir)
+        filename = os.path.basename(fixture)
+        op = lambda: processor.save_video(data, filename)  # noqa: E731
+    elif kind == 'sanitize':
+        from shared.utils import ContentSanitizer
+        html = data.decode()
+
+        def op():
+            # Measure cleaning, not the result cache
+            ContentSanitizer.clear_cache()
+            ContentSanitizer.sanitize(html)
+    elif kind == 'sanitize-cached':
+        from shared.utils import ContentSanitizer
+        html = data.decode()
+        op = lambda: ContentSanitizer.sanitize(html)  # noqa: E731
+    else:
+        from shared.utils import NameFormatter
+        names = data.decode().splitlines()
+
+        def op():
+            for n in names:
+                NameFormatter.format_names(n)
+                NameFormatter.generate_initials(n)
+                NameFormatter.generate_color_hint(n)
+
+    # The first call pays for lazy imports and codec setup; report it apart.
+    start = time.perf_counter()
+    op()
+    first_ms = (time.perf_counter() - start) * 1000
+
+    baseline_rss = _peak_rss_mb()
+    _reset_peak_rss()
+    latencies = []
+    cpu_start = _cpu_seconds()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        op()
+        latencies.append((time.perf_counter() - start) * 1000)
+    cpu_ms = (_cpu_seconds() - cpu_start) * 1000 / iterations
+
+    result = {
+        'iterations': iterations,
+        'input_bytes': len(data),
+        'first_call_ms': round(first_ms, 3),
+        'cpu_ms': round(cpu_ms, 3),
+        'baseline_rss_mb': baseline_rss,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+    if kind == 'video':
+        result['ffmpeg_peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 2)
+    result.update(summarize_latencies(latencies))
+    return result
+
+
+def measure(name: str, fixture: str, work_dir: str, iterations: int) -> dict:
+    """Run a case in a fresh interpreter and collect its JSON result."""
+    media_dir = tempfile.mkdtemp(prefix='media-', dir=work_dir)
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--run-case', name,
+         '--fixture', fixture, '--media-dir', media_dir, '--iterations', str(iterations)],
+        capture_output=True, text=True
+    )
+    shutil.rmtree(media_dir, ignore_errors=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{name} failed:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def check_thresholds(results: dict, thresholds: dict) -> bool:
+    """Print cases exceeding their ceilings; return True if any did."""
+    exceeded = False
+    for name, limits in thresholds.items():
+        result = results.get(name)
+        if not result or 'skipped' in result:
+            continue
+        for metric, ceiling in limits.items():
+            if result[metric] > ceiling:
+                print(f"THRESHOLD {name:30s} {metric}: {result[metric]:.2f} > {ceiling}")
+                exceeded = True
+    return exceeded
+
+
+def derive_thresholds(results: dict, previous: dict) -> dict:
+    """Ceilings from measured results; skipped cases keep their previous ones."""
+    thresholds = {}
+    for name in CASES:
+        result = results.get(name)
+        if not result or 'skipped' in result:
+            if name in previous:
+                thresholds[name] = previous[name]
+            continue
+        thresholds[name] = {
+            metric: math.ceil(result[metric] * factor + added)
+            for metric, (factor, added) in THRESHOLD_MARGINS.items()
+        }
+    return thresholds
+
+
+def write_thresholds(path: str, thresholds: dict) -> None:
+    """Write thresholds one case per line, like the checked-in file."""
+    lines = [f'  {json.dumps(name)}: {json.dumps(limits)}' for name, limits in thresholds.items()]
+    with open(path, 'w') as f:
+        f.write('{\n' + ',\n'.join(lines) + '\n}\n')
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    """Print changes against a baseline run; return True if anything regressed."""
+    regressed = False
+    for name, current in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or 'skipped' in current or 'skipped' in previous:
+            continue
+        for metric in ('p50_ms', 'cpu_ms', 'peak_rss_mb'):
+            line, bad = compare_metric(metric, current[metric], previous[metric], False, max_regression)
+            print(f"{name:30s} {line}")
+            regressed = regressed or bad
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', default='*', help='Comma-separated glob patterns of cases to run')
+    parser.add_argument('--iterations', type=int, help='Override the per-case iteration count')
+    parser.add_argument('--thresholds', default=DEFAULT_THRESHOLDS, help='JSON file of per-case metric ceilings')
+    parser.add_argument('--output', '-o', help='Write results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against a previous JSON result')
+    parser.add_argument('--max-regression', type=float, default=0.25,
+                        help='Exit non-zero when a metric grows by more than this fraction')
+    parser.add_argument('--write-thresholds', metavar='PATH',
+                        help='Write ceilings derived from this run (plus THRESHOLD_MARGINS) to PATH')
+    parser.add_argument('--list', action='store_true', help='List cases and exit')
+    # Internal: measure a single case in this process
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--fixture', help=argparse.SUPPRESS)
+    parser.add_argument('--media-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.fixture, args.media_dir, args.iterations)))
+        return
+    if args.list:
+        print('\n'.join(CASES))
+        return
+
+    patterns = args.cases.split(',')
+    names = [n for n in CASES if any(fnmatch.fnmatch(n, p) for p in patterns)]
+    results = {}
+    work_dir = tempfile.mkdtemp(prefix='media-bench-')
+    try:
+        for name in names:
+            fixture = create_fixture(name, work_dir)
+            if fixture is None:
+                results[name] = {'skipped': 'ffmpeg not found'}
+                print(f"{name:30s} skipped (ffmpeg not found)")
+                continue
+            result = measure(name, fixture, work_dir, args.iterations or CASES[name][2])
+            results[name] = result
+            print(f"{name:30s} p50 {result['p50_ms']:9.2f} ms  p95 {result['p95_ms']:9.2f} ms  "
+                  f"cpu {result['cpu_ms']:9.2f} ms  peak rss {result['peak_rss_mb']:7.1f} MB", flush=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {'meta': run_metadata(ffmpeg=bool(shutil.which('ffmpeg'))), 'results': results}
+    if args.output:
+        write_results(args.output, output)
+        print(f"Results written to {args.output}")
+
+    if args.write_thresholds:
+        previous = {}
+        if os.path.exists(args.write_thresholds):
+            with open(args.write_thresholds) as f:
+                previous = json.load(f)
+        write_thresholds(args.write_thresholds, derive_thresholds(results, previous))
+        print(f"Thresholds written to {args.write_thresholds}")
+        return
+
+    failed = False
+    if args.thresholds and os.path.exists(args.thresholds):
+        with open(args.thresholds) as f:
+            failed = check_thresholds(results, json.load(f))
+    if args.baseline:
+        with open(args.baseline) as f:
+            failed = compare(results, json.load(f), args.max_regression) or failed
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
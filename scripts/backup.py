@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Back up and restore the database and media library while services run.
+
+``backup`` takes a consistent snapshot without stopping anything:
+
+- The SQLite database is copied with SQLite's online backup API a few
+  hundred pages per step, pausing between steps so writers are only ever
+  blocked briefly, then checked with ``PRAGMA integrity_check`` and gzipped.
+- Media is synced incrementally. Uploads live in date directories
+  (``YYYY/MM/DD``), so each day becomes one archive, named after the day
+  and a digest of its file list (``media/YYYY-MM-DD-<digest>.tar.gz``).
+  A day whose files are unchanged reuses the archive of the previous run,
+  so after the first run a backup only archives the days with new or
+  deleted uploads. Files outside date directories go to ``other-<digest>``.
+
+The database is copied first: media files are written before the rows that
+refer to them are committed, so every file the snapshot refers to is on
+disk by the time media is synced.
+
+Layout of the backup directory::
+
+    snapshots/<timestamp>/database.sqlite3.gz
+    snapshots/<timestamp>/manifest.json   # media archives of this snapshot
+    media/<YYYY-MM-DD>-<digest>.tar.gz
+
+A changed day gets a new archive instead of overwriting the old one, so
+every snapshot restores exactly the media it was taken with. ``--keep N``
+deletes all but the newest N snapshots; archives are deleted once no
+remaining snapshot refers to them. Do not run two backups into the same
+directory at once.
+
+Only local media (``MEDIA_STORAGE=local``) is backed up. With object
+storage, back up the bucket with its own versioning or replication and
+pass ``--database-only``.
+
+``restore`` unpacks a snapshot (the latest by default) into a database file
+and media directory; stop the services first.
+
+Usage:
+  python scripts/backup.py backup /backups --keep 14
+  python scripts/backup.py restore /backups --snapshot 20240501T020000000000Z --force
+Or set the `DATABASE_URL` and `MEDIA_PATH` environment variables.
+"""
+from __future__ import annotations
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tarfile
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Ensure repo root is on sys.path so `shared` package can be imported when
+# running this script from any CWD.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from sqlalchemy.engine import make_url
+
+DATABASE_NAME = 'database.sqlite3.gz'
+MANIFEST_NAME = 'manifest.json'
+OTHER_ARCHIVE = 'other'
+DAY_PATTERN = re.compile(r'^\d{4}/\d{2}/\d{2}$')
+
+
+def sqlite_path(database_url: str) -> Path:
+    """File path of a ``sqlite:///`` database URL."""
+    url = make_url(database_url)
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        raise ValueError(f"Not a SQLite database file: {database_url}")
+    return Path(url.database)
+
+
+def backup_database(db_path: Path, dest: Path, pages: int = 256, pause: float = 0.01) -> int:
+    """Copy a live SQLite database to ``dest`` (gzipped); returns its page count.
+
+    Each step copies ``pages`` pages under a short read lock; between steps
+    writers get ``pause`` seconds. Writes made during the copy restart it
+    from SQLite's side, so the result is always one consistent state.
+    """
+    with tempfile.TemporaryDirectory(dir=dest.parent) as tmp:
+        copy_path = Path(tmp) / 'database.sqlite3'
+        source = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=30)
+        target = sqlite3.connect(copy_path)
+        try:
+            source.backup(target, pages=pages, progress=lambda status, remaining, total: time.sleep(pause))
+            check = target.execute('PRAGMA integrity_check').fetchone()[0]
+            if check != 'ok':
+                raise RuntimeError(f"Backup copy failed integrity check: {check}")
+            page_count = target.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+            source.close()
+        with open(copy_path, 'rb') as f, gzip.open(dest, 'wb', compresslevel=6) as out:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+    return page_count
+
+
+def media_groups(media_path: Path) -> dict:
+    """Group media files by archive name: one per day directory, plus ``other``.
+
+    Returns ``{name: {'files': [rel paths], 'signature': [count, bytes, mtime]}}``;
+    the signature changes whenever a file of the group is added, removed or
+    replaced.
+    """
+    groups = {}
+    for path in sorted(media_path.rglob('*')):
+        if not path.is_file() or path.name.startswith('.'):
+            continue
+        rel = path.relative_to(media_path).as_posix()
+        day = rel.rsplit('/', 1)[0]
+        name = day.replace('/', '-') if DAY_PATTERN.match(day) else OTHER_ARCHIVE
+        stat = path.stat()
+        group = groups.setdefault(name, {'files': [], 'signature': [0, 0, 0]})
+        group['files'].append(rel)
+        group['signature'][0] += 1
+        group['signature'][1] += stat.st_size
+        group['signature'][2] = max(group['signature'][2], int(stat.st_mtime))
+    return groups
+
+
+def archive_name(name: str, group: dict) -> str:
+    """File name of a media group's archive, unique to the group's contents."""
+    digest = hashlib.sha256(json.dumps([group['files'], group['signature']]).encode()).hexdigest()
+    return f'{name}-{digest[:16]}.tar.gz'
+
+
+def manifest_archives(manifest: dict) -> dict:
+    """Archive file of each media group of a snapshot manifest."""
+    # Manifests written before archives were named by digest list signatures
+    return {name: entry['archive'] if isinstance(entry, dict) else f'{name}.tar.gz'
+            for name, entry in manifest['media'].items()}
+
+
+def snapshots(backup_dir: Path) -> list:
+    """Complete snapshots, oldest first."""
+    return [p.parent for p in sorted((backup_dir / 'snapshots').glob('*/' + MANIFEST_NAME))]
+
+
+def latest_snapshot(backup_dir: Path) -> Path | None:
+    """Newest complete snapshot."""
+    complete = snapshots(backup_dir)
+    return complete[-1] if complete else None
+
+
+def prune(backup_dir: Path, keep: int = 0) -> dict:
+    """Delete all but the newest ``keep`` snapshots (0 keeps all), then every
+    media archive no remaining snapshot refers to; returns what was deleted."""
+    complete = snapshots(backup_dir)
+    removed = complete[:-keep] if keep else []
+    for snapshot in removed:
+        shutil.rmtree(snapshot)
+    referenced = set()
+    for snapshot in complete[len(removed):]:
+        referenced.update(manifest_archives(json.loads((snapshot / MANIFEST_NAME).read_text())).values())
+    archives = 0
+    for archive in (backup_dir / 'media').glob('*.tar.gz*'):
+        if archive.name not in referenced:
+            archive.unlink()
+            archives += 1
+    return {'snapshots': len(removed), 'archives': archives}
+
+
+def backup(database_url: str, media_path: str | None, backup_dir: str, pages: int = 256,
+           pause: float = 0.01, keep: int = 0) -> dict:
+    """Write a new snapshot and prune old ones; returns its path and archive counts.
+
+    With ``media_path`` None only the database is backed up.
+    """
+    backup_root = Path(backup_dir)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+    snapshot = backup_root / 'snapshots' / stamp
+    archive_dir = backup_root / 'media'
+    snapshot.mkdir(parents=True)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+
+    page_count = backup_database(sqlite_path(database_url), snapshot / DATABASE_NAME, pages, pause)
+
+    media_root = Path(media_path) if media_path else None
+    groups = media_groups(media_root) if media_root and media_root.is_dir() else {}
+    written = 0
+    for name, group in groups.items():
+        group['archive'] = archive_name(name, group)
+        archive = archive_dir / group['archive']
+        if archive.is_file():
+            continue
+        tmp = archive.with_name(archive.name + '.tmp')
+        with tarfile.open(tmp, 'w:gz') as tar:
+            for rel in group['files']:
+                try:
+                    tar.add(media_root / rel, arcname=rel)
+                except FileNotFoundError:
+                    pass  # deleted since the scan; the next run records it
+        os.replace(tmp, archive)
+        written += 1
+
+    manifest = {
+        'created_at': stamp,
+        'database': {'file': DATABASE_NAME, 'pages': page_count},
+        'media': {name: {'archive': group['archive'], 'signature': group['signature']}
+                  for name, group in groups.items()},
+    }
+    # The manifest is written last: a snapshot without one is incomplete
+    (snapshot / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+    pruned = prune(backup_root, keep)
+    return {'snapshot': str(snapshot), 'archives_written': written, 'archives': len(groups),
+            'snapshots_pruned': pruned['snapshots'], 'archives_pruned': pruned['archives']}
+
+
+def restore(backup_dir: str, database_url: str, media_path: str, snapshot: str | None = None,
+            force: bool = False) -> dict:
+    """Restore a snapshot's database and media; returns what was restored."""
+    backup_root = Path(backup_dir)
+    source = backup_root / 'snapshots' / snapshot if snapshot else latest_snapshot(backup_root)
+    if source is None or not (source / MANIFEST_NAME).is_file():
+        raise FileNotFoundError(f"No complete snapshot in {backup_root}")
+    manifest = json.loads((source / MANIFEST_NAME).read_text())
+    db_path = sqlite_path(database_url)
+    if db_path.exists() and not force:
+        raise FileExistsError(f"{db_path} exists; pass --force to overwrite it")
+
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = db_path.with_name(db_path.name + '.restore')
+    with gzip.open(source / manifest['database']['file'], 'rb') as f, open(tmp, 'wb') as out:
+        shutil.copyfileobj(f, out, 1024 * 1024)
+    # Stale WAL/journal files would be replayed onto the restored database
+    for suffix in ('-wal', '-shm', '-journal'):
+        Path(f'{db_path}{suffix}').unlink(missing_ok=True)
+    os.replace(tmp, db_path)
+
+    media_root = Path(media_path)
+    media_root.mkdir(parents=True, exist_ok=True)
+    archives = manifest_archives(manifest)
+    for archive in archives.values():
+        with tarfile.open(backup_root / 'media' / archive, 'r:gz') as tar:
+            for member in tar.getmembers():
+                target = (media_root / member.name).resolve()
+                if not member.isfile() or not target.is_relative_to(media_root.resolve()):
+                    raise ValueError(f"Unsafe archive member {member.name!r} in {archive}")
+            tar.extractall(media_root)
+    return {'snapshot': source.name, 'archives': len(archives)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', '-d', help='Database URL (SQLAlchemy)', default=os.environ.get('DATABASE_URL', 'sqlite:////data/virtual_card.db'))
+    parser.add_argument('--media-path', help='Media root', default=os.environ.get('MEDIA_PATH', '/data/media'))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = sub.add_parser('backup', help='Write a new snapshot')
+    backup_parser.add_argument('backup_dir', help='Backup directory')
+    backup_parser.add_argument('--pages', type=int, default=256, help='Database pages copied per step')
+    backup_parser.add_argument('--pause', type=float, default=0.01, help='Seconds writers get between steps')
+    backup_parser.add_argument('--keep', type=int, default=0, help='Keep only the newest N snapshots (0: all)')
+    backup_parser.add_argument('--database-only', action='store_true', help='Skip media (for MEDIA_STORAGE=s3)')
+
+    restore_parser = sub.add_parser('restore', help='Restore a snapshot')
+    restore_parser.add_argument('backup_dir', help='Backup directory')
+    restore_parser.add_argument('--snapshot', help='Snapshot name (default: latest)')
+    restore_parser.add_argument('--force', action='store_true', help='Overwrite an existing database')
+    args = parser.parse_args()
+    if (args.command == 'backup' and not args.database_only
+            and os.environ.get('MEDIA_STORAGE', 'local') != 'local'):
+        parser.error("media is not in MEDIA_PATH (MEDIA_STORAGE is not 'local'); back up the "
+                     "bucket separately and pass --database-only")
+
+    print(f"Using database: {args.database}")
+    print(f"Media path: {args.media_path}")
+    if args.command == 'backup':
+        result = backup(args.database, None if args.database_only else args.media_path,
+                        args.backup_dir, args.pages, args.pause, args.keep)
+        print(f"Snapshot {result['snapshot']}: {result['archives_written']} of "
+              f"{result['archives']} media archives written; {result['snapshots_pruned']} "
+              f"snapshots and {result['archives_pruned']} archives pruned")
+    else:
+        result = restore(args.backup_dir, args.database, args.media_path, args.snapshot, args.force)
+        print(f"Restored snapshot {result['snapshot']} ({result['archives']} media archives)")
+
+
+if __name__ == '__main__':
+    main()
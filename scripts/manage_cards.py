@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Manage the cards (tenants) hosted by a multi-tenant deployment.
+
+Usage:
+  python scripts/manage_cards.py add bob --host card.bob.example.com --name "Bob"
+  python scripts/manage_cards.py add kun --adopt-default
+  python scripts/manage_cards.py list
+  python scripts/manage_cards.py deactivate bob
+
+Cards are resolved by host (TENANT_MODE=host) or by their slug as the first
+path segment (TENANT_MODE=path). ``--adopt-default`` moves every row of the
+default card (single-tenant data) to the new card.
+
+A new card is served at once; running services stop serving a deactivated
+card within TENANT_CACHE_TTL seconds (10 by default), when their cached
+lookup expires.
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+
+# Ensure repo root is on sys.path so `shared` package can be imported when
+# running this script from any CWD.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from shared.models import (
+    init_db, Card, Message, MessageAttachment, InviteLink, CardCover, Settings,
+    ArchivedMessage, ArchivedInviteLink, DEFAULT_CARD_ID,
+)
+
+
+def add_card(session, args):
+    card = Card(slug=args.slug, host=args.host, name=args.name)
+    session.add(card)
+    session.flush()
+    if args.adopt_default:
+        for model in (Message, MessageAttachment, InviteLink, CardCover, Settings,
+                      ArchivedMessage, ArchivedInviteLink):
+            moved = session.query(model).filter(
+                model.card_id == DEFAULT_CARD_ID
+            ).update({'card_id': card.id}, synchronize_session=False)
+            print(f"Moved {moved} {model.__tablename__} rows to card '{card.slug}'")
+    session.commit()
+    print(f"Created card {card.id}: {card.slug} host={card.host or '-'}")
+
+
+def list_cards(session, args):
+    for card in session.query(Card).order_by(Card.id).all():
+        messages = session.query(Message).filter(Message.card_id == card.id).count()
+        state = 'active' if card.is_active else 'inactive'
+        print(f"{card.id}: {card.slug} host={card.host or '-'} [{state}] messages={messages}")
+
+
+def deactivate_card(session, args):
+    card = session.query(Card).filter(Card.slug == args.slug).first()
+    if not card:
+        sys.exit(f"No card with slug '{args.slug}'")
+    card.is_active = False
+    session.commit()
+    print(f"Deactivated card '{card.slug}'")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database', '-d', help='Database URL (SQLAlchemy)', default=os.environ.get('DATABASE_URL', 'sqlite:////data/virtual_card.db'))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='Create a card')
+    add.add_argument('slug', help='URL slug used in path mode')
+    add.add_argument('--host', help='Host name used in host mode')
+    add.add_argument('--name', help='Display name')
+    add.add_argument('--adopt-default', action='store_true', help='Move existing single-card data to this card')
+    add.set_defaults(func=add_card)
+
+    commands.add_parser('list', help='List cards').set_defaults(func=list_cards)
+
+    deactivate = commands.add_parser('deactivate', help='Stop serving a card')
+    deactivate.add_argument('slug')
+    deactivate.set_defaults(func=deactivate_card)
+
+    args = parser.parse_args()
+    Session, engine = init_db(args.database)
+    session = Session()
+    try:
+        args.func(session, args)
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,81 +1,348 @@
 #!/usr/bin/env python3
-"""Populate the project's SQLite database with test Message records.
+"""Populate the project's database with large, reproducible test data.
+
+Messages and invite links are generated deterministically from ``--seed``
+and written with Core bulk inserts in batched transactions, so hundreds of
+thousands of rows load in seconds. Statuses, submission and approval times,
+names and HTML content follow realistic distributions.
+
+With ``--media-fixtures N``, N real images (and a share of short videos when
+ffmpeg is installed) are synthesized and run through ``ImageProcessor`` /
+``VideoProcessor`` in a process pool; messages with media then point at
+those files under ``MEDIA_PATH``.
 
 Usage:
   python scripts/populate_test_db.py --database sqlite:////tmp/virtual_card.db
-Or set the `DATABASE_URL` environment variable and run without args.
+  python scripts/populate_test_db.py -d sqlite:////tmp/big.db --messages 200000 --invite-links 20000
+  python scripts/populate_test_db.py --messages 5000 --media-fixtures 50 --media-path /tmp/virtual_card_media
+Or set the `DATABASE_URL` / `MEDIA_PATH` environment variables and run without args.
 """
 from __future__ import annotations
 import argparse
+import io
+import math
 import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
 import uuid
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
 
-import sys
-import os
 # Ensure repo root is on sys.path so `shared` package can be imported when
 # running this script from any CWD.
 REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if REPO_ROOT not in sys.path:
     sys.path.insert(0, REPO_ROOT)
 
-from shared.models import init_db, Message
-
-
-def make_sample_messages():
-    now = datetime.utcnow()
-    msgs = []
-    for i in range(1, 80):
-        m = Message(
-            uuid=str(uuid.uuid4()),
-            name=f"Test User {i}",
-            initials=(f"TU{i}" if i < 10 else f"T{i}")[:5],
-            content=f"This is a sample message number {i}. Greetings from test data!",
-            image_path=None if i % 3 != 0 else f"/tmp/media/image_{i}.jpg",
-            thumb_path=None if i % 3 != 0 else f"/tmp/media/thumb_{i}.jpg",
-            status="approved" if i % 2 == 0 else "pending",
-            created_at=now - timedelta(days=i),
-            approved_at=now - timedelta(days=i-1),
-            ip_address=f"192.0.2.{i}",
-            color_hint=None,
-            order_index=i
-        )
-        msgs.append(m)
-    return msgs
+from sqlalchemy import func, insert, select
+from shared.models import init_db, Message, InviteLink
+from shared.utils import NameFormatter, OrderKey
 
+FIRST_NAMES = [
+    'Ada', 'Alan', 'Amara', 'Bea', 'Carlos', 'Chen', 'Dana', 'Elif', 'Fatima', 'Grace',
+    'Hiro', 'Ines', 'Jonas', 'Kemi', 'Lars', 'Maya', 'Nikhil', 'Olga', 'Priya', 'Quinn',
+    'Rosa', 'Sam', 'Tariq', 'Uma', 'Vera', 'Wei', 'Xavier', 'Yara', 'Zoe',
+]
+LAST_NAMES = [
+    'Abbott', 'Baker', 'Costa', 'Dubois', 'Eriksen', 'Fischer', 'Garcia', 'Hughes', 'Ito',
+    'Jensen', 'Khan', 'Lopez', 'Murphy', 'Nakamura', 'Okafor', 'Patel', 'Rossi', 'Smith',
+    'Tanaka', 'Walsh', 'Young',
+]
+WORDS = (
+    'happy birthday congratulations thank you for everything team always remember '
+    'wonderful journey best wishes cheers amazing years together good luck future '
+    'adventure proud support kindness laughter coffee meetings deadlines celebrate '
+    'miss you colleague friend mentor inspiring onwards upwards retirement welcome'
+).split()
+COLORS = ['#e11d48', '#2563eb', '#16a34a', '#9333ea', '#ea580c']
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--database', '-d', help='Database URL (SQLAlchemy)', default=os.environ.get('DATABASE_URL', 'sqlite:////srv/coll-card/kun/data/virtual_card.db'))
-    parser.add_argument('--drop', action='store_true', help='Drop and recreate tables before inserting (WARNING: destructive)')
-    args = parser.parse_args()
+IMAGE_SIZES = [(640, 480), (1280, 720), (1600, 1200), (2400, 1600), (4000, 3000)]
+IMAGE_FORMATS = [('JPEG', '.jpg'), ('PNG', '.png'), ('WEBP', '.webp')]
+
+
+class TestDataGenerator:
+    """Deterministic generator of message and invite link rows."""
+
+    STATUS_WEIGHTS = {'approved': 70, 'pending': 20, 'rejected': 10}
+
+    def __init__(self, seed: int = 1234, now: Optional[datetime] = None, days: int = 21,
+                 media_ratio: float = 0.35, video_ratio: float = 0.15):
+        self.rng = random.Random(seed)
+        self.now = now or datetime(2025, 1, 1, 12, 0, 0)
+        self.days = days
+        self.media_ratio = media_ratio
+        self.video_ratio = video_ratio
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def person(self) -> str:
+        return f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}"
+
+    def names(self) -> str:
+        """One contributor most of the time, sometimes a small group."""
+        count = self.rng.choices((1, 2, 3, 4), weights=(80, 12, 6, 2))[0]
+        return NameFormatter.format_names(', '.join(self.person() for _ in range(count)))
+
+    def sentence(self) -> str:
+        words = [self.rng.choice(WORDS) for _ in range(self.rng.randint(5, 16))]
+        return ' '.join(words).capitalize() + self.rng.choice('.!.')
+
+    def content(self) -> str:
+        """HTML as produced by the Quill editor, from a one-liner to an essay."""
+        paragraphs = []
+        for _ in range(max(1, int(self.rng.lognormvariate(0.3, 0.7)))):
+            text = ' '.join(self.sentence() for _ in range(self.rng.randint(1, 4)))
+            roll = self.rng.random()
+            if roll < 0.15:
+                text = f"<strong>{text}</strong>"
+            elif roll < 0.25:
+                text = f"<em>{text}</em>"
+            elif roll < 0.3:
+                text = f'<span style="color: {self.rng.choice(COLORS)};">{text}</span>'
+            paragraphs.append(f"<p>{text}</p>")
+        if self.rng.random() < 0.08:
+            items = ''.join(f"<li>{self.sentence()}</li>" for _ in range(self.rng.randint(2, 5)))
+            paragraphs.append(f"<ul>{items}</ul>")
+        return ''.join(paragraphs)
+
+    def created_at(self) -> datetime:
+        """Submissions cluster towards the reveal date (``now``)."""
+        age = self.days * 86400 * self.rng.betavariate(1.0, 2.5)
+        return self.now - timedelta(seconds=age)
+
+    def status(self, created_at: datetime) -> str:
+        """Recent messages are more likely to still await moderation."""
+        weights = dict(self.STATUS_WEIGHTS)
+        if self.now - created_at > timedelta(days=2):
+            weights['pending'] = 3
+        return self.rng.choices(list(weights), weights=list(weights.values()))[0]
+
+    def approved_at(self, created_at: datetime) -> datetime:
+        """Moderation delay is log-normal with a median of about three hours."""
+        delay = timedelta(hours=self.rng.lognormvariate(math.log(3), 1.0))
+        return min(created_at + delay, self.now)
 
-    db_url = args.database
-    print(f"Using database: {db_url}")
+    def ip_address(self) -> str:
+        prefix = self.rng.choice(('192.0.2', '198.51.100', '203.0.113'))
+        return f"{prefix}.{self.rng.randint(1, 254)}"
 
-    Session, engine = init_db(db_url)
+    def message_rows(self, count: int, images: List[Tuple[str, str]] = (),
+                     videos: List[Tuple[str, str]] = ()) -> Iterator[dict]:
+        """Yield message rows; media rows reference the given fixture paths.
 
-    if args.drop:
-        print("Dropping and recreating tables...")
-        from shared.models import Base
+        Approved rows are placed on the card in the order they are yielded.
+        """
+        order_keys = OrderKey.spread(count)
+        for i in range(count):
+            name = self.names()
+            created_at = self.created_at()
+            status = self.status(created_at)
+            image_path = video_path = thumb_path = media_type = None
+            if self.rng.random() < self.media_ratio:
+                if videos and self.rng.random() < self.video_ratio:
+                    media_type = 'video'
+                    video_path, thumb_path = self.rng.choice(videos)
+                else:
+                    media_type = 'image'
+                    if images:
+                        image_path, thumb_path = self.rng.choice(images)
+                    else:
+                        stem = f"{created_at:%Y/%m/%d}/{self.uuid()}"
+                        image_path, thumb_path = f"{stem}.jpg", f"{stem}_thumb.jpg"
+            yield {
+                'uuid': self.uuid(),
+                'name': name,
+                'initials': NameFormatter.generate_initials(name),
+                'content': self.content(),
+                'image_path': image_path,
+                'video_path': video_path,
+                'thumb_path': thumb_path,
+                'media_type': media_type,
+                'status': status,
+                'created_at': created_at,
+                'approved_at': self.approved_at(created_at) if status == 'approved' else None,
+                'order_key': order_keys[i] if status == 'approved' else None,
+                'ip_address': self.ip_address(),
+                'color_hint': NameFormatter.generate_color_hint(name),
+            }
+
+    def invite_link_rows(self, count: int) -> Iterator[dict]:
+        """Yield invite links: mostly open-ended, some capped, expired or revoked."""
+        for i in range(count):
+            created_at = self.created_at()
+            max_uses = self.rng.choice((None, None, None, 1, 5, 20))
+            expires_at = None
+            if self.rng.random() < 0.3:
+                expires_at = created_at + timedelta(days=self.rng.randint(1, 14))
+            uses = self.rng.randint(0, max_uses if max_uses else 30)
+            yield {
+                'token': f"{i:06d}{self.uuid().replace('-', '')[:10]}",
+                'created_at': created_at,
+                'expires_at': expires_at,
+                'max_uses': max_uses,
+                'uses_count': uses,
+                'is_active': self.rng.random() > 0.1,
+                'note': f"Invite {i} for {self.person()}",
+            }
+
+
+def bulk_insert(engine, table, rows: Iterator[dict], batch_size: int) -> int:
+    """Insert rows in batches, one transaction per batch."""
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            with engine.begin() as conn:
+                conn.execute(insert(table), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        with engine.begin() as conn:
+            conn.execute(insert(table), batch)
+        total += len(batch)
+    return total
+
+
+def synthesize_image(seed: int, size: Tuple[int, int], image_format: str, rgba: bool = False) -> bytes:
+    """Render a deterministic gradient-and-noise image and encode it."""
+    from PIL import Image, ImageDraw
+    rng = random.Random(seed)
+    mode = 'RGBA' if rgba else 'RGB'
+    small = Image.new(mode, (64, 64))
+    draw = ImageDraw.Draw(small)
+    base = [rng.randrange(256) for _ in range(3)]
+    for y in range(64):
+        color = tuple((c + y * 3) % 256 for c in base)
+        draw.line([(0, y), (63, y)], fill=color + ((255 - y * 2,) if rgba else ()))
+    for _ in range(40):
+        x, y = rng.randrange(64), rng.randrange(64)
+        r = rng.randrange(2, 12)
+        fill = tuple(rng.randrange(256) for _ in range(3)) + ((rng.randrange(128, 256),) if rgba else ())
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=fill)
+    image = small.resize(size, Image.Resampling.BICUBIC)
+    out = io.BytesIO()
+    image.save(out, format=image_format, quality=90)
+    return out.getvalue()
+
+
+def synthesize_video(path: str, duration: float = 2.0, size: str = '640x360', seed: int = 0) -> None:
+    """Render a short test-pattern clip with ffmpeg (format from the extension)."""
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate=25:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency={220 + seed % 660}:duration={duration}",
+        '-pix_fmt', 'yuv420p', '-shortest', path
+    ], check=True, capture_output=True)
+
+
+def _process_image_fixture(args) -> Tuple[str, str]:
+    media_path, seed = args
+    from shared.utils import ImageProcessor
+    rng = random.Random(seed)
+    image_format, ext = rng.choice(IMAGE_FORMATS)
+    size = rng.choice(IMAGE_SIZES)
+    data = synthesize_image(seed, size, image_format, rgba=(image_format == 'PNG' and rng.random() < 0.5))
+    if len(data) > ImageProcessor.MAX_IMAGE_SIZE:
+        data = synthesize_image(seed, IMAGE_SIZES[1], 'JPEG')
+        ext = '.jpg'
+    return ImageProcessor(media_path).save_image(data, f"fixture{ext}")
+
+
+def _process_video_fixture(args) -> Tuple[str, str]:
+    media_path, seed = args
+    from shared.utils import VideoProcessor
+    ext = random.Random(seed).choice(('.mp4', '.mov'))
+    with tempfile.TemporaryDirectory() as tmp:
+        clip = os.path.join(tmp, f"clip{ext}")
+        synthesize_video(clip, seed=seed)
+        with open(clip, 'rb') as f:
+            data = f.read()
+    return VideoProcessor(media_path).save_video(data, f"clip{ext}")
+
+
+def create_media_fixtures(media_path: str, count: int, video_ratio: float, seed: int,
+                          workers: Optional[int]) -> Tuple[List, List]:
+    """Synthesize media fixtures through the real processors in a process pool."""
+    video_count = int(round(count * video_ratio))
+    if video_count and not shutil.which('ffmpeg'):
+        print("ffmpeg not found; generating image fixtures only")
+        video_count = 0
+    image_count = count - video_count
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        images = list(pool.map(_process_image_fixture,
+                               [(media_path, seed + i) for i in range(image_count)]))
+        videos = list(pool.map(_process_video_fixture,
+                               [(media_path, seed + image_count + i) for i in range(video_count)]))
+    return images, videos
+
+
+def populate(database_url: str, messages: int, invite_links: int, seed: int = 1234,
+             batch_size: int = 5000, media_path: Optional[str] = None, media_fixtures: int = 0,
+             media_ratio: float = 0.35, video_ratio: float = 0.15, workers: Optional[int] = None,
+             drop: bool = False) -> Dict[str, int]:
+    """Generate and insert test data; returns the number of rows inserted."""
+    Session, engine = init_db(database_url)
+    if drop:
+        from shared.models import Base, ensure_schema
         Base.metadata.drop_all(engine)
-        Base.metadata.create_all(engine)
+        ensure_schema(engine)
+
+    images, videos = [], []
+    if media_fixtures:
+        images, videos = create_media_fixtures(media_path, media_fixtures, video_ratio, seed, workers)
 
-    session = Session()
-    samples = make_sample_messages()
+    generator = TestDataGenerator(seed=seed, media_ratio=media_ratio, video_ratio=video_ratio)
+    return {
+        'invite_links': bulk_insert(engine, InviteLink.__table__,
+                                    generator.invite_link_rows(invite_links), batch_size),
+        'messages': bulk_insert(engine, Message.__table__,
+                                generator.message_rows(messages, images, videos), batch_size),
+        'image_fixtures': len(images),
+        'video_fixtures': len(videos),
+    }
 
-    print(f"Inserting {len(samples)} sample messages...")
-    session.add_all(samples)
-    session.commit()
 
-    # Print inserted ids and a count
-    count = session.query(Message).count()
-    print(f"Total messages in DB: {count}")
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', '-d', help='Database URL (SQLAlchemy)', default=os.environ.get('DATABASE_URL', 'sqlite:////srv/coll-card/kun/data/virtual_card.db'))
+    parser.add_argument('--drop', action='store_true', help='Drop and recreate tables before inserting (WARNING: destructive)')
+    parser.add_argument('--messages', '-n', type=int, default=1000, help='Number of messages to insert')
+    parser.add_argument('--invite-links', type=int, default=None, help='Number of invite links (default: messages / 10)')
+    parser.add_argument('--seed', type=int, default=1234, help='Random seed; the same seed gives the same data')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Rows per insert transaction')
+    parser.add_argument('--media-ratio', type=float, default=0.35, help='Share of messages with media')
+    parser.add_argument('--video-ratio', type=float, default=0.15, help='Share of media that is video')
+    parser.add_argument('--media-fixtures', type=int, default=0, help='Synthesize this many real media files')
+    parser.add_argument('--media-path', default=os.environ.get('MEDIA_PATH', '/tmp/virtual_card_media'), help='Where media fixtures are written')
+    parser.add_argument('--workers', type=int, default=None, help='Processes for fixture generation (default: CPU count)')
+    args = parser.parse_args()
+
+    invite_links = args.invite_links if args.invite_links is not None else max(1, args.messages // 10)
+    print(f"Using database: {args.database}")
 
-    for m in session.query(Message).order_by(Message.id).all():
-        print(f"{m.id}: {m.uuid[:8]}.. {m.name} [{m.status}] created={m.created_at.isoformat()} image={bool(m.image_path)}")
+    started = time.perf_counter()
+    counts = populate(
+        args.database, args.messages, invite_links, seed=args.seed, batch_size=args.batch_size,
+        media_path=args.media_path, media_fixtures=args.media_fixtures, media_ratio=args.media_ratio,
+        video_ratio=args.video_ratio, workers=args.workers, drop=args.drop,
+    )
+    elapsed = time.perf_counter() - started
+    print(f"Inserted {counts['messages']} messages and {counts['invite_links']} invite links "
+          f"({counts['image_fixtures']} image / {counts['video_fixtures']} video fixtures) in {elapsed:.1f}s")
 
-    session.close()
+    Session, engine = init_db(args.database)
+    with engine.connect() as conn:
+        for status, count in conn.execute(
+            select(Message.status, func.count()).group_by(Message.status).order_by(Message.status)
+        ):
+            print(f"  {status}: {count}")
 
 
 if __name__ == '__main__':
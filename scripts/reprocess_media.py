@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""Regenerate derived media files (thumbnails, video previews and posters,
+re-encoded images) in bulk.
+
+Run after changing ``ImageProcessor``/``VideoProcessor`` settings, or to
+repair a media library with missing thumbnails. Media dimensions and
+BlurHash placeholders are recomputed on the way, which also backfills
+media uploaded before they were recorded, and videos uploaded before
+previews get their preview clip and poster. Messages, their attachments and
+covers are walked in primary-key chunks and each chunk is processed by a pool of
+worker processes. New files are written next to the old ones and moved in
+place atomically; database paths are then updated in one transaction per
+chunk, and only after that are replaced files removed.
+
+Media in object storage (``MEDIA_STORAGE=s3``) is fetched into MEDIA_PATH
+to be processed; the new files are uploaded and replaced ones deleted from
+the storage.
+
+Progress is stored in a checkpoint file after every chunk, so an
+interrupted run continues where it stopped (use --restart to start over).
+
+Usage:
+  python scripts/reprocess_media.py --media-path /data/media --missing-only
+  python scripts/reprocess_media.py --kind image --full --workers 4 --max-mb-per-sec 20
+Or set the `DATABASE_URL` and `MEDIA_PATH` environment variables and run without args.
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Ensure repo root is on sys.path so `shared` package can be imported when
+# running this script from any CWD.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from sqlalchemy import bindparam, exists, select, update
+from shared.models import init_db, Message, MessageAttachment, CardCover
+from shared.utils import ImageProcessor, VideoProcessor
+from shared.utils.storage import CHUNK_SIZE, LocalStorage, MediaStorage
+from retention import storage_from_env
+
+CHECKPOINT_NAME = '.reprocess-checkpoint.json'
+
+# Per-process state, set up by _init_worker
+_worker = {}
+
+
+def _init_worker(storage: MediaStorage, max_bytes_per_sec: float, nice: int) -> None:
+    if nice:
+        try:
+            os.nice(nice)
+        except OSError:
+            pass
+    _worker['storage'] = storage
+    _worker['images'] = ImageProcessor(str(storage.staging_path))
+    _worker['videos'] = VideoProcessor(str(storage.staging_path))
+    _worker['rate'] = max_bytes_per_sec
+
+
+def _throttle(started: float, nbytes: int) -> None:
+    """Sleep so this worker reads at most ``rate`` bytes per second."""
+    rate = _worker['rate']
+    if rate:
+        delay = nbytes / rate - (time.monotonic() - started)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def process_item(item: dict) -> dict:
+    """Regenerate the derived files of one message, attachment or cover.
+
+    ``item`` has ``table``, ``id``, ``media_type``, ``source`` and ``thumb``
+    (all media paths relative to the media root), plus ``full``. Returns the
+    item with ``new_thumb``, ``previews`` and ``info`` set, or ``error`` on
+    failure.
+
+    Sources not in the staging directory are fetched from the storage, and
+    the files written are stored.
+    """
+    storage = _worker['storage']
+    media_path = _worker['images'].media_path
+    started = time.monotonic()
+    source = media_path / item['source']
+    fetched = False
+    try:
+        if not source.is_file():
+            source.parent.mkdir(parents=True, exist_ok=True)
+            with storage.open(item['source']) as src, open(source, 'wb') as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            fetched = True
+        nbytes = source.stat().st_size
+        previews = (None, None)
+        if item['media_type'] == 'video':
+            new_thumb = _worker['videos'].regenerate_thumbnail(item['source'])
+            info = _worker['videos'].video_info(item['source'], new_thumb)
+            previews = _worker['videos'].generate_previews(item['source'])
+        else:
+            if item['full']:
+                _worker['images'].reencode_full(item['source'])
+            new_thumb = (_worker['images'].regenerate_thumbnail(item['source'])
+                         if item['table'] != 'card_covers' else None)
+            info = _worker['images'].image_info(item['source'])
+        if new_thumb:
+            nbytes += (media_path / new_thumb).stat().st_size
+        written = [new_thumb, *previews]
+        if item['full'] and item['media_type'] == 'image':
+            written.append(item['source'])
+        for path in filter(None, written):
+            storage.store(path)
+    except Exception as e:
+        return {**item, 'error': f"{type(e).__name__}: {e}"}
+    finally:
+        # A fetched source that was not stored back is only a local copy
+        if fetched:
+            source.unlink(missing_ok=True)
+    _throttle(started, nbytes)
+    return {**item, 'new_thumb': new_thumb, 'previews': tuple(previews), 'info': tuple(info)}
+
+
+def _complete(row, storage: MediaStorage) -> bool:
+    """Whether a message or attachment row has all its derived files and info."""
+    return bool(row.placeholder and row.thumb_path
+                and (row.media_type != 'video' or row.preview_path)
+                and storage.exists(row.thumb_path))
+
+
+def _message_items(conn, after: int, limit: int, kind: str, missing_only: bool,
+                   full: bool, storage: MediaStorage) -> tuple[list, int | None]:
+    """Next chunk of message work items and the last id scanned."""
+    table = Message.__table__
+    # The first attachment shares the message's files; it is re-encoded
+    # (once) as an attachment
+    has_attachments = exists().where(MessageAttachment.__table__.c.message_id == table.c.id)
+    query = select(table.c.id, table.c.media_type, table.c.image_path,
+                   table.c.video_path, table.c.thumb_path, table.c.preview_path,
+                   table.c.placeholder, has_attachments.label('has_attachments')).where(
+        table.c.id > after, table.c.media_type.isnot(None)
+    ).order_by(table.c.id).limit(limit)
+    if kind != 'all':
+        query = query.where(table.c.media_type == kind)
+    rows = conn.execute(query).all()
+    items = []
+    for row in rows:
+        source = row.video_path if row.media_type == 'video' else row.image_path
+        if not source:
+            continue
+        if missing_only and not full and _complete(row, storage):
+            continue
+        items.append({'table': 'messages', 'id': row.id, 'media_type': row.media_type,
+                      'source': source, 'thumb': row.thumb_path,
+                      'full': full and not row.has_attachments})
+    return items, (rows[-1].id if rows else None)
+
+
+def _attachment_items(conn, after: int, limit: int, kind: str, missing_only: bool,
+                      full: bool, storage: MediaStorage) -> tuple[list, int | None]:
+    """Next chunk of attachment work items and the last id scanned."""
+    table = MessageAttachment.__table__
+    query = select(table.c.id, table.c.media_type, table.c.path, table.c.thumb_path,
+                   table.c.preview_path, table.c.placeholder
+                   ).where(table.c.id > after).order_by(table.c.id).limit(limit)
+    if kind != 'all':
+        query = query.where(table.c.media_type == kind)
+    rows = conn.execute(query).all()
+    items = [
+        {'table': 'message_attachments', 'id': row.id, 'media_type': row.media_type,
+         'source': row.path, 'thumb': row.thumb_path, 'full': full}
+        for row in rows
+        if not (missing_only and not full and _complete(row, storage))
+    ]
+    return items, (rows[-1].id if rows else None)
+
+
+def _cover_items(conn, after: int, limit: int, full: bool) -> tuple[list, int | None]:
+    """Next chunk of cover work items; covers have no thumbnail to rebuild,
+    so only re-encoding (``full``) or a missing placeholder makes work."""
+    table = CardCover.__table__
+    rows = conn.execute(
+        select(table.c.id, table.c.image_path, table.c.placeholder)
+        .where(table.c.id > after)
+        .order_by(table.c.id)
+        .limit(limit)
+    ).all()
+    items = [{'table': 'card_covers', 'id': row.id, 'media_type': 'image',
+              'source': row.image_path, 'thumb': None, 'full': full}
+             for row in rows if full or not row.placeholder]
+    return items, (rows[-1].id if rows else None)
+
+
+def load_checkpoint(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_checkpoint(path: Path, state: dict) -> None:
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps(state))
+    os.replace(tmp, path)
+
+
+def reprocess(engine, media_path: str, kind: str = 'all', missing_only: bool = False,
+              full: bool = False, workers: int | None = None, batch_size: int = 200,
+              max_mb_per_sec: float = 0, checkpoint: str | None = None,
+              restart: bool = False, nice: int = 10, storage: MediaStorage | None = None) -> dict:
+    """Reprocess the media library; returns processed/updated/error counts.
+
+    ``media_path`` is the local media root, or the staging directory of
+    ``storage`` when media lives elsewhere.
+    """
+    media_root = Path(media_path)
+    storage = storage or LocalStorage(media_path)
+    checkpoint_path = Path(checkpoint) if checkpoint else media_root / CHECKPOINT_NAME
+    state = {} if restart else load_checkpoint(checkpoint_path)
+    counts = {'processed': 0, 'updated': 0, 'errors': 0}
+
+    updates = {
+        'messages': update(Message.__table__).where(
+            Message.__table__.c.id == bindparam('row_id')
+        ).values(thumb_path=bindparam('new_thumb'), preview_path=bindparam('preview'),
+                 poster_path=bindparam('poster'), media_width=bindparam('width'),
+                 media_height=bindparam('height'), placeholder=bindparam('hash')),
+        'message_attachments': update(MessageAttachment.__table__).where(
+            MessageAttachment.__table__.c.id == bindparam('row_id')
+        ).values(thumb_path=bindparam('new_thumb'), preview_path=bindparam('preview'),
+                 poster_path=bindparam('poster'), width=bindparam('width'),
+                 height=bindparam('height'), placeholder=bindparam('hash')),
+        'card_covers': update(CardCover.__table__).where(
+            CardCover.__table__.c.id == bindparam('row_id')
+        ).values(width=bindparam('width'), height=bindparam('height'),
+                 placeholder=bindparam('hash')),
+    }
+
+    def chunks():
+        tables = [
+            ('messages', lambda conn, after: _message_items(
+                conn, after, batch_size, kind, missing_only, full, storage)),
+            ('message_attachments', lambda conn, after: _attachment_items(
+                conn, after, batch_size, kind, missing_only, full, storage)),
+        ]
+        if kind in ('image', 'all'):
+            tables.append(('card_covers', lambda conn, after: _cover_items(
+                conn, after, batch_size, full)))
+        for name, fetch in tables:
+            while True:
+                with engine.connect() as conn:
+                    items, last_id = fetch(conn, state.get(name, 0))
+                if last_id is None:
+                    break
+                yield name, items, last_id
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(storage, max_mb_per_sec * 1024 * 1024, nice)) as pool:
+        for name, items, last_id in chunks():
+            results = list(pool.map(process_item, items))
+            done = [r for r in results if 'error' not in r]
+            changed = [r for r in done if r['new_thumb'] and r['new_thumb'] != r['thumb']]
+            for r in results:
+                if 'error' in r:
+                    print(f"  {r['table']} #{r['id']}: {r['error']}", file=sys.stderr)
+            if done:
+                with engine.begin() as conn:
+                    conn.execute(updates[name], [
+                        {'row_id': r['id'], 'new_thumb': r['new_thumb'], 'preview': r['previews'][0],
+                         'poster': r['previews'][1], 'width': r['info'][0],
+                         'height': r['info'][1], 'hash': r['info'][2]}
+                        for r in done
+                    ])
+                # Old files are only removed once nothing refers to them
+                for r in changed:
+                    if r['thumb']:
+                        storage.delete(r['thumb'])
+            counts['processed'] += len(results)
+            counts['updated'] += len(changed)
+            counts['errors'] += sum('error' in r for r in results)
+            state[name] = last_id
+            save_checkpoint(checkpoint_path, state)
+            print(f"  {name} up to #{last_id}: {counts['processed']} processed, "
+                  f"{counts['updated']} updated, {counts['errors']} errors", flush=True)
+
+    checkpoint_path.unlink(missing_ok=True)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', '-d', help='Database URL (SQLAlchemy)', default=os.environ.get('DATABASE_URL', 'sqlite:////data/virtual_card.db'))
+    parser.add_argument('--media-path', help='Media root (staging directory with MEDIA_STORAGE=s3)', default=os.environ.get('MEDIA_PATH', '/data/media'))
+    parser.add_argument('--kind', choices=('image', 'video', 'all'), default='all', help='Which media to reprocess')
+    parser.add_argument('--missing-only', action='store_true', help='Only process media missing a thumbnail, video preview or placeholder')
+    parser.add_argument('--full', action='store_true', help='Also re-encode full-size images, including covers')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=200, help='Rows per chunk and database transaction')
+    parser.add_argument('--max-mb-per-sec', type=float, default=0, help='Per-worker read limit, 0 for none')
+    parser.add_argument('--checkpoint', help=f'Checkpoint file (default: <media-path>/{CHECKPOINT_NAME})')
+    parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint')
+    args = parser.parse_args()
+
+    print(f"Using database: {args.database}")
+    print(f"Media path: {args.media_path}")
+    Session, engine = init_db(args.database)
+    counts = reprocess(
+        engine, args.media_path, kind=args.kind, missing_only=args.missing_only,
+        full=args.full, workers=args.workers, batch_size=args.batch_size,
+        max_mb_per_sec=args.max_mb_per_sec, checkpoint=args.checkpoint, restart=args.restart,
+        storage=storage_from_env(args.media_path)
+    )
+    print(f"Done: {counts['processed']} processed, {counts['updated']} paths updated, "
+          f"{counts['errors']} errors")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Re-sanitize every stored message with the current sanitizer policy.
+
+Run after tightening ``ContentSanitizer`` (or to clean content stored before
+edits were sanitized). Messages are read in primary-key batches and only
+rows whose content changes are written, one transaction per batch.
+
+Usage:
+  python scripts/resanitize_messages.py --database sqlite:////data/virtual_card.db --dry-run
+  python scripts/resanitize_messages.py --batch-size 2000
+Or set the `DATABASE_URL` environment variable and run without args.
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+
+# Ensure repo root is on sys.path so `shared` package can be imported when
+# running this script from any CWD.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from sqlalchemy import bindparam, select, update
+from shared.models import init_db, Message
+from shared.utils import ContentSanitizer
+
+
+def resanitize(engine, batch_size: int = 1000, dry_run: bool = False) -> dict:
+    """Sanitize all messages in batches; returns scanned/changed counts."""
+    table = Message.__table__
+    statement = update(table).where(table.c.id == bindparam('message_id')).values(content=bindparam('clean'))
+    scanned = changed = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table.c.id, table.c.content)
+                .where(table.c.id > last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            cleaned = ContentSanitizer.sanitize_many(content or '' for _, content in rows)
+            updates = [
+                {'message_id': message_id, 'clean': clean}
+                for (message_id, content), clean in zip(rows, cleaned)
+                if content is not None and clean != content
+            ]
+            if updates and not dry_run:
+                conn.execute(statement, updates)
+        scanned += len(rows)
+        changed += len(updates)
+        last_id = rows[-1][0]
+        print(f"  {scanned} scanned, {changed} {'to change' if dry_run else 'changed'}", flush=True)
+    return {'scanned': scanned, 'changed': changed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', '-d', help='Database URL (SQLAlchemy)', default=os.environ.get('DATABASE_URL', 'sqlite:////data/virtual_card.db'))
+    parser.add_argument('--batch-size', type=int, default=1000, help='Messages per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='Only report how many messages would change')
+    args = parser.parse_args()
+
+    print(f"Using database: {args.database}")
+    Session, engine = init_db(args.database)
+    counts = resanitize(engine, batch_size=args.batch_size, dry_run=args.dry_run)
+    verb = 'would change' if args.dry_run else 'changed'
+    print(f"Done: {counts['scanned']} messages scanned, {counts['changed']} {verb}")
+
+
+if __name__ == '__main__':
+    main()
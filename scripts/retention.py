@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""Apply the retention policy: archive old rows, purge media, scrub IPs, vacuum.
+
+- Rejected messages older than ``--rejected-days`` (and, if set, messages
+  still pending after ``--pending-days``) are moved to ``archived_messages``
+  and their media files, including attachments, are deleted. So are
+  submissions left half-processed by a request that died, after a day.
+- Invite links that expired, or were deactivated, more than
+  ``--link-days`` ago are moved to ``archived_invite_links``.
+- ``ip_address`` is cleared on messages older than ``--ip-days``.
+- Free pages are returned to the file with ``PRAGMA incremental_vacuum`` in
+  small steps, and ``ANALYZE`` refreshes the query planner statistics from
+  a bounded sample.
+
+Rows are handled in primary-key batches of ``--batch-size``, one short
+transaction each, so the services' writes are never blocked for long. Media
+files are deleted only after the batch that dropped their rows commits.
+Message ages are counted from ``created_at``; rejection time is not
+recorded.
+
+Databases created before the archive tables need a one-off full VACUUM to
+enable incremental vacuuming (``--enable-incremental-vacuum``; this locks
+the database for the duration, so run it in a maintenance window).
+
+Usage:
+  python scripts/retention.py --dry-run
+  python scripts/retention.py --rejected-days 30 --ip-days 90 --interval 86400
+Or set the `DATABASE_URL`, `MEDIA_PATH` and `RETENTION_*` environment variables.
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+# Ensure repo root is on sys.path so `shared` package can be imported when
+# running this script from any CWD.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from sqlalchemy import delete, insert, or_, select, update
+from shared.models import init_db, ArchivedInviteLink, ArchivedMessage, InviteLink, Message, MessageAttachment
+from shared.utils.storage import MediaStorage, create_storage
+
+ARCHIVED_MESSAGE_COLUMNS = ('id', 'card_id', 'uuid', 'name', 'initials', 'content', 'status',
+                            'created_at', 'approved_at')
+ARCHIVED_LINK_COLUMNS = ('token', 'card_id', 'created_at', 'expires_at', 'max_uses', 'uses_count',
+                         'is_active', 'note')
+
+
+def storage_from_env(media_path: str) -> MediaStorage:
+    """The media storage the services use, configured from the environment."""
+    return create_storage(SimpleNamespace(
+        MEDIA_STORAGE=os.environ.get('MEDIA_STORAGE', 'local'),
+        MEDIA_PATH=media_path,
+        MEDIA_URL=os.environ.get('MEDIA_URL', ''),
+        S3_BUCKET=os.environ.get('S3_BUCKET', ''),
+        S3_ENDPOINT_URL=os.environ.get('S3_ENDPOINT_URL', ''),
+        S3_REGION=os.environ.get('S3_REGION', ''),
+        S3_PREFIX=os.environ.get('S3_PREFIX', ''),
+        S3_URL_EXPIRES=int(os.environ.get('S3_URL_EXPIRES', '3600')),
+    ))
+
+
+def archive_messages(engine, storage: MediaStorage, condition, batch_size: int = 500,
+                     dry_run: bool = False) -> tuple[int, int]:
+    """Move messages matching ``condition`` to the archive; returns (messages, files) removed."""
+    messages = Message.__table__
+    attachments = MessageAttachment.__table__
+    archived = files = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(messages.c.id, messages.c.image_path, messages.c.video_path, messages.c.thumb_path,
+                       messages.c.preview_path, messages.c.poster_path)
+                .where(messages.c.id > last_id, condition)
+                .order_by(messages.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            ids = [row.id for row in rows]
+            paths = {p for row in rows for p in row[1:] if p}
+            paths.update(p for row in conn.execute(
+                select(attachments.c.path, attachments.c.thumb_path,
+                       attachments.c.preview_path, attachments.c.poster_path)
+                .where(attachments.c.message_id.in_(ids))
+            ) for p in row if p)
+            if not dry_run:
+                conn.execute(insert(ArchivedMessage.__table__).from_select(
+                    ARCHIVED_MESSAGE_COLUMNS,
+                    select(*(messages.c[name] for name in ARCHIVED_MESSAGE_COLUMNS))
+                    .where(messages.c.id.in_(ids))
+                ))
+                conn.execute(delete(attachments).where(attachments.c.message_id.in_(ids)))
+                conn.execute(delete(messages).where(messages.c.id.in_(ids)))
+        archived += len(ids)
+        files += len(paths)
+        if not dry_run:
+            for path in paths:
+                storage.delete(path)
+    return archived, files
+
+
+def archive_links(engine, cutoff: datetime, batch_size: int = 500, dry_run: bool = False) -> int:
+    """Move links that expired or were deactivated before ``cutoff``; returns the count."""
+    links = InviteLink.__table__
+    # Deactivation time is not recorded, so inactive links age from creation
+    condition = or_(links.c.expires_at < cutoff,
+                    (links.c.is_active == False) & (links.c.created_at < cutoff))
+    archived = 0
+    last_token = ''
+    while True:
+        with engine.begin() as conn:
+            tokens = conn.execute(
+                select(links.c.token).where(links.c.token > last_token, condition)
+                .order_by(links.c.token).limit(batch_size)
+            ).scalars().all()
+            if not tokens:
+                break
+            last_token = tokens[-1]
+            if not dry_run:
+                conn.execute(insert(ArchivedInviteLink.__table__).from_select(
+                    ARCHIVED_LINK_COLUMNS,
+                    select(*(links.c[name] for name in ARCHIVED_LINK_COLUMNS)).where(links.c.token.in_(tokens))
+                ))
+                conn.execute(delete(links).where(links.c.token.in_(tokens)))
+        archived += len(tokens)
+    return archived
+
+
+def scrub_ips(engine, cutoff: datetime, batch_size: int = 500, dry_run: bool = False) -> int:
+    """Clear ``ip_address`` on messages created before ``cutoff``; returns the count."""
+    messages = Message.__table__
+    scrubbed = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(
+                select(messages.c.id)
+                .where(messages.c.id > last_id, messages.c.created_at < cutoff,
+                       messages.c.ip_address.isnot(None))
+                .order_by(messages.c.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            last_id = ids[-1]
+            if not dry_run:
+                conn.execute(update(messages).where(messages.c.id.in_(ids)).values(ip_address=None))
+        scrubbed += len(ids)
+    return scrubbed
+
+
+def vacuum(engine, pages: int = 500, pause: float = 0.05) -> int | None:
+    """Return free pages to the file ``pages`` at a time; None if not enabled.
+
+    Each step is its own short write transaction, with ``pause`` seconds
+    between steps for the services' writes.
+    """
+    if engine.dialect.name != 'sqlite':
+        return None
+    freed = 0
+    with engine.connect() as conn:
+        if conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() != 2:
+            return None
+        free = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+        while free:
+            conn.exec_driver_sql(f'PRAGMA incremental_vacuum({int(pages)})')
+            conn.commit()
+            remaining = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+            if remaining >= free:
+                break
+            freed += free - remaining
+            free = remaining
+            time.sleep(pause)
+    return freed
+
+
+def analyze(engine, analysis_limit: int = 1000) -> None:
+    """Refresh planner statistics, reading at most ``analysis_limit`` rows per index."""
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.connect() as conn:
+        conn.exec_driver_sql(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+        conn.exec_driver_sql('ANALYZE')
+        conn.commit()
+
+
+def enable_incremental_vacuum(engine) -> None:
+    """Switch an existing database to incremental vacuuming (runs a full VACUUM)."""
+    with engine.connect() as conn:
+        conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.exec_driver_sql('VACUUM')
+
+
+def apply_retention(engine, storage: MediaStorage, rejected_days: int = 30, pending_days: int = 0,
+                    link_days: int = 30, ip_days: int = 90, batch_size: int = 500,
+                    dry_run: bool = False, now: datetime | None = None) -> dict:
+    """Run every retention step once; a day count of 0 disables its step."""
+    now = now or datetime.utcnow()
+    counts = {'messages': 0, 'files': 0, 'links': 0, 'ips': 0, 'pages_freed': None}
+    # Left by submit requests that died while processing media
+    stale = [(Message.status == 'processing') & (Message.created_at < now - timedelta(days=1))]
+    if rejected_days:
+        stale.append((Message.status == 'rejected') & (Message.created_at < now - timedelta(days=rejected_days)))
+    if pending_days:
+        stale.append((Message.status == 'pending') & (Message.created_at < now - timedelta(days=pending_days)))
+    counts['messages'], counts['files'] = archive_messages(
+        engine, storage, or_(*stale), batch_size, dry_run
+    )
+    if link_days:
+        counts['links'] = archive_links(engine, now - timedelta(days=link_days), batch_size, dry_run)
+    if ip_days:
+        counts['ips'] = scrub_ips(engine, now - timedelta(days=ip_days), batch_size, dry_run)
+    if not dry_run:
+        counts['pages_freed'] = vacuum(engine)
+        analyze(engine)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', '-d', help='Database URL (SQLAlchemy)', default=os.environ.get('DATABASE_URL', 'sqlite:////data/virtual_card.db'))
+    parser.add_argument('--media-path', help='Media root', default=os.environ.get('MEDIA_PATH', '/data/media'))
+    parser.add_argument('--rejected-days', type=int, default=int(os.environ.get('RETENTION_REJECTED_DAYS', '30')), help='Archive rejected messages after this many days (0: never)')
+    parser.add_argument('--pending-days', type=int, default=int(os.environ.get('RETENTION_PENDING_DAYS', '0')), help='Archive messages still pending after this many days (0: never)')
+    parser.add_argument('--link-days', type=int, default=int(os.environ.get('RETENTION_LINK_DAYS', '30')), help='Archive expired/deactivated invite links after this many days (0: never)')
+    parser.add_argument('--ip-days', type=int, default=int(os.environ.get('RETENTION_IP_DAYS', '90')), help='Clear IP addresses after this many days (0: never)')
+    parser.add_argument('--batch-size', type=int, default=500, help='Rows per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would change')
+    parser.add_argument('--interval', type=float, default=0, help='Run again every this many seconds (0: run once)')
+    parser.add_argument('--enable-incremental-vacuum', action='store_true', help='One-off full VACUUM to enable incremental vacuuming, then exit')
+    args = parser.parse_args()
+
+    print(f"Using database: {args.database}")
+    Session, engine = init_db(args.database)
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum(engine)
+        print("Incremental vacuum enabled")
+        return
+    storage = storage_from_env(args.media_path)
+    while True:
+        counts = apply_retention(
+            engine, storage, rejected_days=args.rejected_days, pending_days=args.pending_days,
+            link_days=args.link_days, ip_days=args.ip_days, batch_size=args.batch_size,
+            dry_run=args.dry_run
+        )
+        prefix = "Would archive" if args.dry_run else "Archived"
+        print(f"{prefix} {counts['messages']} messages ({counts['files']} media files) and "
+              f"{counts['links']} invite links; {counts['ips']} IP addresses cleared", flush=True)
+        if not args.dry_run:
+            print("Incremental vacuum not enabled" if counts['pages_freed'] is None
+                  else f"{counts['pages_freed']} free pages released", flush=True)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,17 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
-from flask import Flask, render_template, jsonify, send_from_directory
+from flask import Flask, abort, render_template, request, jsonify, redirect, send_from_directory, url_for
 from werkzeug.middleware.proxy_fix import ProxyFix
+from shared.cache import TTLCache
+from shared.compression import init_compression
 from shared.models import init_db
+from shared.json_provider import init_json
+from shared.profiling import init_profiling
+from shared.query_stats import init_query_stats
+from shared.metrics import init_metrics
+from shared.tenancy import init_tenancy, current_card_id, current_card_owns_media
+from shared.utils.storage import create_storage
 from config import Config
 from services import CardService
 
@@ -14,43 +22,152 @@ def create_app():
     """Create and configure the Flask app."""
     app = Flask(__name__)
     app.config.from_object(Config)
+    init_json(app)
     
-    # ProxyFix for correct URL generation
-    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+    # Compress text responses; registered first so it runs after every
+    # other after_request hook
+    if Config.COMPRESSION_ENABLED:
+        init_compression(app, min_size=Config.COMPRESSION_MIN_SIZE)
     
     # Initialize database
     Config.init_paths()
     Session, engine = init_db(Config.DATABASE_URL)
+    storage = create_storage(Config)
+    
+    # Request, query and media metrics for Prometheus at /metrics
+    if Config.METRICS_ENABLED:
+        init_metrics(app, 'card', engine, token=Config.METRICS_TOKEN)
+    
+    # Query counts, slow queries and N+1 warnings per request
+    if Config.SQL_INSTRUMENTATION:
+        init_query_stats(app, engine, Config.SQL_SLOW_QUERY_MS, Config.SQL_REPEAT_THRESHOLD)
+    
+    # Profile requests sent with X-Profile: <PROFILE_SECRET>, or a random sample
+    if Config.PROFILE_SECRET or Config.PROFILE_SAMPLE_RATE:
+        init_profiling(app, 'card', Config.PROFILE_DIR, secret=Config.PROFILE_SECRET,
+                       sample_rate=Config.PROFILE_SAMPLE_RATE, mode=Config.PROFILE_MODE,
+                       max_files=Config.PROFILE_MAX_FILES)
+    
+    # Resolve the card each request belongs to, behind ProxyFix so the
+    # forwarded host is visible
+    init_tenancy(app, Session, Config.TENANT_MODE)
+    
+    # ProxyFix for correct URL generation
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
     
     def get_db():
         """Get database session."""
         return Session()
     
+    # Message lists by (card, media URL, fields, limit, offset), shared by
+    # the cover page and the API. Only the lists every visitor asks for (the
+    # first page, the rest after it, the full list) are cached, so query
+    # parameters cannot fill the cache with one-off pages.
+    messages_cache = TTLCache(ttl=Config.MESSAGES_CACHE_TTL, max_size=1000)
+    cached_fields = {CardService.MESSAGE_FIELDS, CardService.SUMMARY_FIELDS, CardService.TILE_FIELDS}
+    cached_pages = {(Config.FIRST_PAGE_SIZE + 1, 0), (None, 0), (None, Config.FIRST_PAGE_SIZE)}
+    
+    def get_messages(fields, limit=None, offset=0):
+        """Approved messages of the current card, as sent by the API."""
+        card_id = current_card_id()
+        media_url = api_media_url()
+        fields = tuple(fields)
+        
+        def load():
+            db = get_db()
+            try:
+                return CardService(db, card_id).get_messages_json(
+                    media_url=media_url, fields=fields, limit=limit, offset=offset
+                )
+            finally:
+                db.close()
+        
+        if (limit, offset) not in cached_pages or fields not in cached_fields:
+            return load()
+        return messages_cache.get_or_set((card_id, media_url, fields, limit, offset), load)
+    
+    def api_media_url():
+        """Prefix for media URLs in API payloads.
+        
+        Media is linked straight to storage when it has a public base URL;
+        signed URLs differ per file, so those go through ``serve_media``.
+        """
+        return storage.base_url or f'{request.script_root}/media'
+    
+    @app.template_global()
+    def media_url(filename):
+        """URL of a media file, direct from storage when possible."""
+        return storage.url(filename) or url_for('serve_media', filename=filename)
+    
     @app.route('/')
     def index():
-        """Show card cover page."""
+        """Show card cover page.
+        
+        The first page of message tiles is embedded in the page, so the
+        card opens without an API round-trip; the rest is fetched after
+        the page has loaded.
+        """
         db = get_db()
         try:
-            service = CardService(db)
+            service = CardService(db, current_card_id())
             cover = service.get_active_cover()
-            return render_template('index.html', cover=cover)
         finally:
             db.close()
+        # One extra row tells whether there is more to fetch
+        first_page = get_messages(CardService.TILE_FIELDS, limit=Config.FIRST_PAGE_SIZE + 1)
+        return render_template('index.html', cover=cover,
+                               first_page=first_page[:Config.FIRST_PAGE_SIZE],
+                               has_more=len(first_page) > Config.FIRST_PAGE_SIZE,
+                               preload_thumbnails=Config.PRELOAD_THUMBNAILS)
     
     @app.route('/api/messages')
     def api_messages():
-        """Return approved messages as JSON."""
+        """Return approved messages as JSON.
+        
+        ``?fields=summary`` (or ``tile``, or a comma-separated field list)
+        limits the payload, e.g. to what the grid needs before a message is
+        opened. ``?offset=`` and ``?limit=`` select a page of at most
+        ``MAX_PAGE_SIZE`` messages.
+        """
+        try:
+            fields = CardService.parse_fields(request.args.get('fields'))
+            limit = request.args.get('limit', type=int)
+            offset = request.args.get('offset', 0, type=int)
+            if (limit is not None and limit < 0) or offset < 0:
+                raise ValueError('limit and offset must not be negative')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if limit is not None:
+            limit = min(limit, Config.MAX_PAGE_SIZE)
+        return jsonify(get_messages(fields, limit=limit, offset=offset))
+    
+    @app.route('/api/messages/<message_uuid>')
+    def api_message(message_uuid):
+        """Return one approved message as JSON."""
+        try:
+            fields = CardService.parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         db = get_db()
         try:
-            service = CardService(db)
-            messages = service.get_messages_json()
-            return jsonify(messages)
+            service = CardService(db, current_card_id())
+            message = service.get_message_json(
+                message_uuid, media_url=api_media_url(), fields=fields
+            )
+            if message is None:
+                return jsonify({'error': 'Message not found'}), 404
+            return jsonify(message)
         finally:
             db.close()
     
     @app.route('/media/<path:filename>')
     def serve_media(filename):
-        """Serve media files."""
+        """Serve media files of the current card, or redirect to them in storage."""
+        if not current_card_owns_media(filename):
+            abort(404)
+        url = storage.url(filename)
+        if url:
+            return redirect(url)
         return send_from_directory(Config.MEDIA_PATH, filename)
     
     return app
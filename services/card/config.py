@@ -9,6 +9,54 @@ class Config:
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:////data/virtual_card.db')
     MEDIA_PATH = os.getenv('MEDIA_PATH', '/media')
     
+    # Media storage (see shared/utils/storage.py): 'local' keeps files in
+    # MEDIA_PATH; 's3' moves them to S3_BUCKET on any S3-compatible store
+    # (MinIO, R2, ... via S3_ENDPOINT_URL), using MEDIA_PATH as scratch
+    # space. If MEDIA_URL is set, media is linked at MEDIA_URL/<path>;
+    # otherwise S3 links are signed and valid for S3_URL_EXPIRES seconds.
+    MEDIA_STORAGE = os.getenv('MEDIA_STORAGE', 'local')
+    MEDIA_URL = os.getenv('MEDIA_URL', '')
+    S3_BUCKET = os.getenv('S3_BUCKET', '')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', '')
+    S3_REGION = os.getenv('S3_REGION', '')
+    S3_PREFIX = os.getenv('S3_PREFIX', '')
+    S3_URL_EXPIRES = int(os.getenv('S3_URL_EXPIRES', '3600'))
+    
+    # The cover page embeds the first FIRST_PAGE_SIZE messages so the card
+    # opens without waiting for the API, and preloads the first
+    # PRELOAD_THUMBNAILS thumbnails. Message lists are cached per process
+    # for MESSAGES_CACHE_TTL seconds (0 disables), so approvals show up on
+    # the card within that time. API pages hold at most MAX_PAGE_SIZE
+    # messages.
+    FIRST_PAGE_SIZE = int(os.getenv('FIRST_PAGE_SIZE', '24'))
+    MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '500'))
+    PRELOAD_THUMBNAILS = int(os.getenv('PRELOAD_THUMBNAILS', '6'))
+    MESSAGES_CACHE_TTL = float(os.getenv('MESSAGES_CACHE_TTL', '5'))
+    
+    # Multi-tenancy: 'single', 'host' or 'path' (see shared/tenancy.py)
+    TENANT_MODE = os.getenv('TENANT_MODE', 'single')
+    
+    # Prometheus metrics, served at /metrics to scrapers sending
+    # "Authorization: Bearer <METRICS_TOKEN>" (not served without a token)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    
+    # gzip/brotli response compression (see shared/compression.py)
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() != 'false'
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '500'))
+    
+    # Opt-in per-request SQL statistics (see shared/query_stats.py)
+    SQL_INSTRUMENTATION = os.getenv('SQL_INSTRUMENTATION', 'false').lower() == 'true'
+    SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', '100'))
+    SQL_REPEAT_THRESHOLD = int(os.getenv('SQL_REPEAT_THRESHOLD', '3'))
+    
+    # On-demand request profiling (see shared/profiling.py)
+    PROFILE_SECRET = os.getenv('PROFILE_SECRET', '')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_MODE = os.getenv('PROFILE_MODE', 'sampler')
+    PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/profiles')
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '100'))
+    
     @staticmethod
     def init_paths():
         Path(Config.MEDIA_PATH).mkdir(parents=True, exist_ok=True)
@@ -3,44 +3,199 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
-from typing import List, Optional
+from collections import defaultdict
+from typing import Iterable, List, Optional
+from sqlalchemy import String, literal, select
 from sqlalchemy.orm import Session
-from shared.models import Message, CardCover
+from shared.models import Message, MessageAttachment, CardCover, DEFAULT_CARD_ID
 
 
 class CardService:
     """Handle card display operations."""
     
-    def __init__(self, db_session: Session):
+    # Fields of the message payload, in output order
+    MESSAGE_FIELDS = (
+        'uuid', 'name', 'initials', 'content_html', 'thumb_url', 'image_url',
+        'video_url', 'preview_url', 'poster_url', 'media_type', 'media_width',
+        'media_height', 'placeholder', 'attachments', 'color_hint', 'created_at'
+    )
+    
+    # Enough to draw the grid, with media sized and painted before it
+    # loads; the rest is fetched when a message is opened
+    SUMMARY_FIELDS = (
+        'uuid', 'name', 'initials', 'color_hint', 'thumb_url', 'media_type',
+        'media_width', 'media_height', 'placeholder'
+    )
+    
+    # What a tile on the card shows; the rest is fetched when it is opened
+    TILE_FIELDS = SUMMARY_FIELDS + ('content_html',)
+    
+    def __init__(self, db_session: Session, card_id: int = DEFAULT_CARD_ID):
         self.db = db_session
+        self.card_id = card_id
     
     def get_approved_messages(self) -> List[Message]:
-        """Get all approved messages ordered by creation date."""
+        """Get all approved messages in card order."""
         return self.db.query(Message).filter(
+            Message.card_id == self.card_id,
             Message.status == 'approved'
-        ).order_by(Message.created_at.asc()).all()
+        ).order_by(Message.order_key, Message.id).all()
     
     def get_active_cover(self) -> Optional[CardCover]:
         """Get the currently active cover."""
         return self.db.query(CardCover).filter(
+            CardCover.card_id == self.card_id,
             CardCover.is_active == True
         ).first()
     
-    def get_messages_json(self) -> List[dict]:
-        """Get approved messages as JSON-serializable dicts."""
-        messages = self.get_approved_messages()
-        return [
-            {
-                'uuid': msg.uuid,
-                'name': msg.name,
-                'initials': msg.initials,
-                'content_html': msg.content,
-                'thumb_url': f'/media/{msg.thumb_path}' if msg.thumb_path else None,
-                'image_url': f'/media/{msg.image_path}' if msg.image_path else None,
-                'video_url': f'/media/{msg.video_path}' if msg.video_path else None,
-                'media_type': msg.media_type,
-                'color_hint': msg.color_hint,
-                'created_at': msg.created_at.isoformat() if msg.created_at else None
-            }
-            for msg in messages
-        ]
+    @classmethod
+    def parse_fields(cls, fields: Optional[str]) -> Iterable[str]:
+        """Parse a ``fields=`` query value: ``summary``, ``tile`` or a comma-separated list.
+        
+        Raises:
+            ValueError: for unknown field names
+        """
+        if not fields:
+            return cls.MESSAGE_FIELDS
+        if fields == 'summary':
+            return cls.SUMMARY_FIELDS
+        if fields == 'tile':
+            return cls.TILE_FIELDS
+        names = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = set(names) - set(cls.MESSAGE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        return [f for f in cls.MESSAGE_FIELDS if f in names]
+    
+    def get_messages_json(self, media_url: str = '/media',
+                          fields: Iterable[str] = MESSAGE_FIELDS,
+                          limit: Optional[int] = None, offset: int = 0) -> List[dict]:
+        """Get approved messages as JSON-serializable dicts, in card order.
+        
+        Only the requested columns are selected and no ORM objects are
+        built. Media URLs are built under ``media_url`` so they resolve when
+        the card is served below a path prefix.
+        """
+        query = self._message_select(media_url, fields).where(
+            Message.status == 'approved'
+        ).order_by(Message.order_key, Message.id).limit(limit).offset(offset or None)
+        return self._rows_to_dicts(query, media_url)
+    
+    def get_message_json(self, message_uuid: str, media_url: str = '/media',
+                         fields: Iterable[str] = MESSAGE_FIELDS) -> Optional[dict]:
+        """Get one approved message by uuid, or None."""
+        query = self._message_select(media_url, fields).where(
+            Message.status == 'approved',
+            Message.uuid == message_uuid
+        )
+        rows = self._rows_to_dicts(query, media_url)
+        return rows[0] if rows else None
+    
+    # Message columns read to list the media of messages without attachment
+    # rows (those submitted before attachments); dropped from the payload
+    LEGACY_MEDIA_FIELDS = (
+        '_id', '_media_type', '_image_url', '_video_url', '_thumb_url',
+        '_preview_url', '_poster_url', '_media_width', '_media_height', '_placeholder'
+    )
+    
+    # Fields of each entry of ``attachments``
+    ATTACHMENT_FIELDS = ('media_type', 'url', 'thumb_url', 'preview_url', 'poster_url',
+                         'width', 'height', 'placeholder')
+    
+    def _message_select(self, media_url: str, fields: Iterable[str]):
+        """Select each payload field as a labelled column expression.
+        
+        ``attachments`` is not a column: the message id and media columns
+        are selected instead and the list is filled in by ``_rows_to_dicts``.
+        """
+        prefix = literal(f'{media_url}/', String)
+        columns = {
+            'uuid': Message.uuid,
+            'name': Message.name,
+            'initials': Message.initials,
+            'content_html': Message.content,
+            # NULL paths stay NULL through the concatenation
+            'thumb_url': prefix + Message.thumb_path,
+            'image_url': prefix + Message.image_path,
+            'video_url': prefix + Message.video_path,
+            'preview_url': prefix + Message.preview_path,
+            'poster_url': prefix + Message.poster_path,
+            'media_type': Message.media_type,
+            'media_width': Message.media_width,
+            'media_height': Message.media_height,
+            'placeholder': Message.placeholder,
+            'color_hint': Message.color_hint,
+            # Formatted in _rows_to_dicts, like Message.to_dict
+            'created_at': Message.created_at,
+            '_id': Message.id,
+            '_media_type': Message.media_type,
+            '_image_url': prefix + Message.image_path,
+            '_video_url': prefix + Message.video_path,
+            '_thumb_url': prefix + Message.thumb_path,
+            '_preview_url': prefix + Message.preview_path,
+            '_poster_url': prefix + Message.poster_path,
+            '_media_width': Message.media_width,
+            '_media_height': Message.media_height,
+            '_placeholder': Message.placeholder,
+        }
+        # The attachment list takes the place of this field in the output
+        columns['attachments'] = literal(None)
+        selected = list(fields)
+        if 'attachments' in selected:
+            selected += self.LEGACY_MEDIA_FIELDS
+        return select(*(columns[f].label(f) for f in selected)).where(
+            Message.card_id == self.card_id
+        )
+    
+    def _rows_to_dicts(self, query, media_url: str = '/media') -> List[dict]:
+        result = self.db.execute(query)
+        keys = tuple(result.keys())
+        rows = [dict(zip(keys, row)) for row in result]
+        if 'created_at' in keys:
+            for row in rows:
+                if row['created_at'] is not None:
+                    row['created_at'] = row['created_at'].isoformat()
+        if 'attachments' in keys:
+            self._add_attachments(rows, media_url)
+        return rows
+    
+    def _add_attachments(self, rows: List[dict], media_url: str) -> None:
+        """Fill in each row's ordered ``attachments`` list.
+        
+        Attachments of all rows are read with one query per 500 messages.
+        """
+        prefix = literal(f'{media_url}/', String)
+        by_message = defaultdict(list)
+        ids = [row['_id'] for row in rows]
+        for start in range(0, len(ids), 500):
+            result = self.db.execute(
+                select(
+                    MessageAttachment.message_id,
+                    MessageAttachment.media_type,
+                    (prefix + MessageAttachment.path).label('url'),
+                    (prefix + MessageAttachment.thumb_path).label('thumb_url'),
+                    (prefix + MessageAttachment.preview_path).label('preview_url'),
+                    (prefix + MessageAttachment.poster_path).label('poster_url'),
+                    MessageAttachment.width,
+                    MessageAttachment.height,
+                    MessageAttachment.placeholder
+                ).where(
+                    MessageAttachment.message_id.in_(ids[start:start + 500])
+                ).order_by(MessageAttachment.message_id, MessageAttachment.position)
+            )
+            for message_id, *attachment in result:
+                by_message[message_id].append(dict(zip(self.ATTACHMENT_FIELDS, attachment)))
+        
+        for row in rows:
+            legacy = [row.pop(f) for f in self.LEGACY_MEDIA_FIELDS]
+            (message_id, media_type, image_url, video_url, thumb_url, preview_url, poster_url,
+             width, height, placeholder) = legacy
+            attachments = by_message.get(message_id)
+            if attachments is None:
+                attachments = []
+                url = video_url if media_type == 'video' else image_url
+                if media_type and url:
+                    attachments.append(dict(zip(self.ATTACHMENT_FIELDS, (
+                        media_type, url, thumb_url, preview_url, poster_url, width, height, placeholder
+                    ))))
+            row['attachments'] = attachments
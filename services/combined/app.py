@@ -0,0 +1,91 @@
+"""Combined WSGI application running dashboard, submit and card in one process."""
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
+
+import importlib.util
+from config import Config
+
+SERVICES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Each service has its own top-level app/config/services modules
+SERVICE_MODULES = ('app', 'config', 'services')
+
+
+def load_service_app(name: str):
+    """Import a service's app module under a unique name and return it.
+
+    The service's own ``config`` and ``services`` modules are imported in
+    isolation so the three services do not shadow each other.
+    """
+    service_dir = os.path.join(SERVICES_DIR, name)
+    saved = {m: sys.modules.pop(m) for m in SERVICE_MODULES if m in sys.modules}
+    sys.path.insert(0, service_dir)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            f'{name}_app', os.path.join(service_dir, 'app.py')
+        )
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(service_dir)
+        for m in SERVICE_MODULES:
+            sys.modules.pop(m, None)
+        sys.modules.update(saved)
+    return module
+
+
+class ServiceDispatcher:
+    """Dispatch WSGI requests to the dashboard, submit or card app."""
+
+    def __init__(self, dashboard, submit, card, dashboard_prefix: str = '/dashboard',
+                 dashboard_hosts=(), submit_hosts=(), card_hosts=()):
+        self.dashboard = dashboard
+        self.submit = submit
+        self.card = card
+        self.dashboard_prefix = dashboard_prefix
+        self.hosts = {}
+        for hosts, target in ((dashboard_hosts, dashboard), (submit_hosts, submit),
+                              (card_hosts, card)):
+            for host in hosts:
+                self.hosts[host] = target
+
+    def __call__(self, environ, start_response):
+        host = environ.get('HTTP_HOST', '').split(':')[0].lower()
+        target = self.hosts.get(host)
+        if target is not None:
+            return target(environ, start_response)
+
+        path = environ.get('PATH_INFO', '')
+        prefix = self.dashboard_prefix
+        if prefix and (path == prefix or path.startswith(prefix + '/')):
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + prefix
+            environ['PATH_INFO'] = path[len(prefix):] or '/'
+            return self.dashboard(environ, start_response)
+        if path.startswith('/submit/') or path == '/health':
+            return self.submit(environ, start_response)
+        return self.card(environ, start_response)
+
+
+def create_app():
+    """Create the combined WSGI application.
+
+    The three apps share one interpreter, one database engine per URL and
+    one settings cache, so a card can run in a single container.
+    """
+    dashboard = load_service_app('dashboard').create_app()
+    submit = load_service_app('submit').create_app()
+    card = load_service_app('card').create_app()
+    return ServiceDispatcher(
+        dashboard, submit, card,
+        dashboard_prefix=Config.DASHBOARD_PREFIX,
+        dashboard_hosts=Config.DASHBOARD_HOSTS,
+        submit_hosts=Config.SUBMIT_HOSTS,
+        card_hosts=Config.CARD_HOSTS,
+    )
+
+
+if __name__ == '__main__':
+    from werkzeug.serving import run_simple
+    run_simple('0.0.0.0', 8000, create_app(), use_reloader=False, threaded=True)
@@ -0,0 +1,19 @@
+"""Combined deployment configuration."""
+import os
+
+
+def _hosts(name: str) -> list:
+    """Parse a comma-separated list of host names from the environment."""
+    return [h.strip().lower() for h in os.getenv(name, '').split(',') if h.strip()]
+
+
+class Config:
+    """Configuration for the single-process deployment of all three services."""
+    # Requests for these hosts go to the matching service unchanged
+    DASHBOARD_HOSTS = _hosts('DASHBOARD_HOST')
+    SUBMIT_HOSTS = _hosts('SUBMIT_HOST')
+    CARD_HOSTS = _hosts('CARD_HOST')
+
+    # Otherwise the dashboard is mounted under this prefix, submit keeps
+    # /submit/<token> and /health, and the card serves everything else
+    DASHBOARD_PREFIX = os.getenv('DASHBOARD_PREFIX', '/dashboard').rstrip('/')
@@ -3,11 +3,18 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_from_directory
+from datetime import datetime
+from flask import Flask, abort, Response, render_template, request, jsonify, redirect, url_for, flash, send_from_directory, stream_with_context
 from werkzeug.middleware.proxy_fix import ProxyFix
+from shared.compression import init_compression
 from shared.models import init_db
+from shared.profiling import init_profiling
+from shared.query_stats import init_query_stats
+from shared.metrics import init_metrics
+from shared.tenancy import init_tenancy, current_card_id, current_card_owns_media
+from shared.utils.storage import create_storage
 from config import Config
-from services import MessageService, InviteLinkService, CoverService, SettingsService
+from services import MessageService, InviteLinkService, CoverService, SettingsService, ExportService
 
 
 def create_app():
@@ -15,23 +22,52 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     
-    # ProxyFix for correct URL generation behind Traefik
-    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+    # Compress text responses; registered first so it runs after every
+    # other after_request hook
+    if Config.COMPRESSION_ENABLED:
+        init_compression(app, min_size=Config.COMPRESSION_MIN_SIZE)
     
     # Initialize database
     Config.init_paths()
     Session, engine = init_db(Config.DATABASE_URL)
+    storage = create_storage(Config)
+    
+    # Request, query and media metrics for Prometheus at /metrics
+    if Config.METRICS_ENABLED:
+        init_metrics(app, 'dashboard', engine, token=Config.METRICS_TOKEN)
+    
+    # Query counts, slow queries and N+1 warnings per request
+    if Config.SQL_INSTRUMENTATION:
+        init_query_stats(app, engine, Config.SQL_SLOW_QUERY_MS, Config.SQL_REPEAT_THRESHOLD)
+    
+    # Profile requests sent with X-Profile: <PROFILE_SECRET>, or a random sample
+    if Config.PROFILE_SECRET or Config.PROFILE_SAMPLE_RATE:
+        init_profiling(app, 'dashboard', Config.PROFILE_DIR, secret=Config.PROFILE_SECRET,
+                       sample_rate=Config.PROFILE_SAMPLE_RATE, mode=Config.PROFILE_MODE,
+                       max_files=Config.PROFILE_MAX_FILES)
+    
+    # Resolve the card each request belongs to, behind ProxyFix so the
+    # forwarded host is visible
+    init_tenancy(app, Session, Config.TENANT_MODE)
+    
+    # ProxyFix for correct URL generation behind Traefik
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
     
     def get_db():
         """Get database session."""
         return Session()
     
+    @app.template_global()
+    def media_url(filename):
+        """URL of a media file, direct from storage when possible."""
+        return storage.url(filename) or url_for('serve_media', filename=filename)
+    
     @app.route('/')
     def index():
         """Dashboard overview."""
         db = get_db()
         try:
-            msg_service = MessageService(db)
+            msg_service = MessageService(db, current_card_id())
             pending_count = msg_service.get_pending_count()
             recent_messages = msg_service.get_all_messages(limit=10)
             return render_template('index.html', 
@@ -45,9 +81,10 @@ def create_app():
         """List pending messages."""
         db = get_db()
         try:
-            msg_service = MessageService(db)
+            msg_service = MessageService(db, current_card_id())
             messages = msg_service.get_pending_messages()
-            return render_template('pending.html', messages=messages)
+            return render_template('pending.html', messages=messages,
+                                   attachments=msg_service.get_attachments(messages))
         finally:
             db.close()
     
@@ -56,7 +93,7 @@ def create_app():
         """Approve a message."""
         db = get_db()
         try:
-            msg_service = MessageService(db)
+            msg_service = MessageService(db, current_card_id())
             success = msg_service.approve_message(message_id)
             if success:
                 flash('Message approved successfully', 'success')
@@ -71,7 +108,7 @@ def create_app():
         """Reject a message."""
         db = get_db()
         try:
-            msg_service = MessageService(db)
+            msg_service = MessageService(db, current_card_id())
             success = msg_service.reject_message(message_id)
             if success:
                 flash('Message rejected successfully', 'success')
@@ -86,7 +123,7 @@ def create_app():
         """Edit a message."""
         db = get_db()
         try:
-            msg_service = MessageService(db)
+            msg_service = MessageService(db, current_card_id())
             message = msg_service.get_message_by_id(message_id)
             
             if not message:
@@ -121,7 +158,7 @@ def create_app():
         """Delete a message."""
         db = get_db()
         try:
-            msg_service = MessageService(db)
+            msg_service = MessageService(db, current_card_id())
             success = msg_service.delete_message(message_id)
             if success:
                 flash('Message deleted successfully', 'success')
@@ -136,7 +173,7 @@ def create_app():
         """Unapprove a message."""
         db = get_db()
         try:
-            msg_service = MessageService(db)
+            msg_service = MessageService(db, current_card_id())
             success = msg_service.unapprove_message(message_id)
             if success:
                 flash('Message unapproved successfully', 'success')
@@ -146,14 +183,38 @@ def create_app():
             db.close()
         return redirect(request.referrer or url_for('approved_messages'))
     
+    @app.route('/messages/<int:message_id>/move', methods=['POST'])
+    def move_message(message_id):
+        """Move an approved message on the card (used by drag and drop).
+        
+        ``after`` is the id of the message it now follows, or empty to make
+        it the first.
+        """
+        after = request.form.get('after', '').strip()
+        if after and not after.isdigit():
+            return jsonify({'error': 'Invalid message id'}), 400
+        db = get_db()
+        try:
+            msg_service = MessageService(db, current_card_id())
+            if not msg_service.move_message(message_id, int(after) if after else None):
+                return jsonify({'error': 'Message not found'}), 404
+            return jsonify({'moved': message_id})
+        finally:
+            db.close()
+    
     @app.route('/messages/approved')
     def approved_messages():
-        """List approved messages."""
+        """List approved messages.
+        
+        The whole card is listed, so newly approved messages (appended
+        last) are always shown and can be dragged anywhere.
+        """
         db = get_db()
         try:
-            msg_service = MessageService(db)
-            messages = msg_service.get_approved_messages()
-            return render_template('approved.html', messages=messages)
+            msg_service = MessageService(db, current_card_id())
+            messages = msg_service.get_approved_messages(limit=None)
+            return render_template('approved.html', messages=messages,
+                                   attachments=msg_service.get_attachments(messages))
         finally:
             db.close()
     
@@ -162,7 +223,7 @@ def create_app():
         """Manage invite links."""
         db = get_db()
         try:
-            link_service = InviteLinkService(db)
+            link_service = InviteLinkService(db, current_card_id())
             
             if request.method == 'POST':
                 note = request.form.get('note')
@@ -183,7 +244,7 @@ def create_app():
         """Deactivate an invite link."""
         db = get_db()
         try:
-            link_service = InviteLinkService(db)
+            link_service = InviteLinkService(db, current_card_id())
             success = link_service.deactivate_link(token)
             if success:
                 flash('Link deactivated successfully', 'success')
@@ -198,7 +259,7 @@ def create_app():
         """Manage card cover."""
         db = get_db()
         try:
-            cover_service = CoverService(db, Config.MEDIA_PATH)
+            cover_service = CoverService(db, Config.MEDIA_PATH, current_card_id(), storage=storage)
             
             if request.method == 'POST':
                 if 'cover' not in request.files:
@@ -226,15 +287,41 @@ def create_app():
     
     @app.route('/media/<path:filename>')
     def serve_media(filename):
-        """Serve media files."""
+        """Serve media files of the current card, or redirect to them in storage."""
+        if not current_card_owns_media(filename):
+            abort(404)
+        url = storage.url(filename)
+        if url:
+            return redirect(url)
         return send_from_directory(Config.MEDIA_PATH, filename)
     
+    @app.route('/export')
+    def export_card():
+        """Download the card as a ZIP keepsake, streamed as it is built."""
+        card_id = current_card_id()
+        
+        def generate():
+            # The session must outlive the view, so it is owned by the generator
+            db = get_db()
+            try:
+                export_service = ExportService(db, Config.MEDIA_PATH, card_id, storage=storage)
+                yield from export_service.stream_zip()
+            finally:
+                db.close()
+        
+        filename = f"card-{datetime.utcnow().strftime('%Y%m%d')}.zip"
+        return Response(
+            stream_with_context(generate()),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+    
     @app.route('/settings', methods=['GET', 'POST'])
     def settings():
         """Manage application settings."""
         db = get_db()
         try:
-            settings_service = SettingsService(db)
+            settings_service = SettingsService(db, current_card_id())
             
             if request.method == 'POST':
                 submission_heading = request.form.get('submission_heading', '').strip()
@@ -0,0 +1,27 @@
+"""Gunicorn configuration for the dashboard service."""
+import os
+import shutil
+
+bind = '0.0.0.0:8000'
+workers = int(os.getenv('GUNICORN_WORKERS', '4'))
+
+# Import the app (and create the schema) once in the master, then fork
+preload_app = True
+
+# Workers write Prometheus samples to files here so /metrics can aggregate
+# them. It must be set before the app is imported and start out empty.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-dashboard')
+shutil.rmtree(metrics_dir, ignore_errors=True)
+os.makedirs(metrics_dir)
+
+
+def post_fork(server, worker):
+    # Connections opened while preloading belong to the master
+    from shared.models import dispose_engines
+    dispose_engines()
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's in-progress gauge from the aggregate
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
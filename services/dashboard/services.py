@@ -3,35 +3,52 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
+import html
+import json
+import re
 from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
+from pathlib import Path
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
-from shared.models import Message, InviteLink, CardCover, Settings
-from shared.utils import TokenGenerator, ImageProcessor
+from shared.cache import settings_cache
+from shared.models import Message, MessageAttachment, InviteLink, CardCover, Settings, DEFAULT_CARD_ID
+from shared.utils import ContentSanitizer, TokenGenerator, ImageProcessor, NameFormatter, OrderKey, ZipStreamer
+from shared.utils.storage import LocalStorage, MediaStorage
 
 
 class MessageService:
     """Handle message operations."""
     
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: Session, card_id: int = DEFAULT_CARD_ID):
         self.db = db_session
+        self.card_id = card_id
+    
+    def _messages(self):
+        """Query messages belonging to this card, except submissions whose
+        media is still being processed."""
+        return self.db.query(Message).filter(
+            Message.card_id == self.card_id, Message.status != 'processing'
+        )
     
     def get_pending_messages(self, limit: int = 50, offset: int = 0) -> List[Message]:
         """Get pending messages."""
-        return self.db.query(Message).filter(
+        return self._messages().filter(
             Message.status == 'pending'
         ).order_by(Message.created_at.desc()).limit(limit).offset(offset).all()
     
     def get_all_messages(self, limit: int = 100, offset: int = 0) -> List[Message]:
         """Get all messages."""
-        return self.db.query(Message).order_by(
+        return self._messages().order_by(
             Message.created_at.desc()
         ).limit(limit).offset(offset).all()
     
     def approve_message(self, message_id: int) -> bool:
         """Approve a message."""
-        message = self.db.query(Message).filter(Message.id == message_id).first()
+        message = self._messages().filter(Message.id == message_id).first()
         if message and message.status == 'pending':
+            message.order_key = self._next_key()
             message.status = 'approved'
             message.approved_at = datetime.utcnow()
             self.db.commit()
@@ -40,34 +57,39 @@ class MessageService:
     
     def reject_message(self, message_id: int) -> bool:
         """Reject a message."""
-        message = self.db.query(Message).filter(Message.id == message_id).first()
+        message = self._messages().filter(Message.id == message_id).first()
         if message:
             message.status = 'rejected'
+            message.order_key = None
             self.db.commit()
             return True
         return False
     
     def update_message(self, message_id: int, name: str = None, content: str = None) -> bool:
         """Update a message's name and/or content."""
-        message = self.db.query(Message).filter(Message.id == message_id).first()
+        message = self._messages().filter(Message.id == message_id).first()
         if message:
             if name is not None:
                 # Format the name (handle multiple names)
-                formatted_name = self._format_names(name)
+                formatted_name = NameFormatter.format_names(name)
                 message.name = formatted_name
                 # Regenerate initials when name changes
-                message.initials = self._generate_initials(formatted_name)
-                message.color_hint = self._generate_color_hint(formatted_name)
+                message.initials = NameFormatter.generate_initials(formatted_name)
+                message.color_hint = NameFormatter.generate_color_hint(formatted_name)
             if content is not None:
-                message.content = content
+                message.content = ContentSanitizer.sanitize(content)
             self.db.commit()
             return True
         return False
     
     def delete_message(self, message_id: int) -> bool:
         """Delete a message."""
-        message = self.db.query(Message).filter(Message.id == message_id).first()
+        message = self._messages().filter(Message.id == message_id).first()
         if message:
+            # SQLite does not enforce the cascade unless foreign keys are on
+            self.db.query(MessageAttachment).filter(
+                MessageAttachment.message_id == message.id
+            ).delete(synchronize_session=False)
             self.db.delete(message)
             self.db.commit()
             return True
@@ -75,93 +97,126 @@ class MessageService:
     
     def unapprove_message(self, message_id: int) -> bool:
         """Unapprove a message (set back to pending)."""
-        message = self.db.query(Message).filter(Message.id == message_id).first()
+        message = self._messages().filter(Message.id == message_id).first()
         if message and message.status == 'approved':
             message.status = 'pending'
             message.approved_at = None
+            message.order_key = None
             self.db.commit()
             return True
         return False
     
-    def get_approved_messages(self, limit: int = 100, offset: int = 0) -> List[Message]:
-        """Get approved messages."""
-        return self.db.query(Message).filter(
-            Message.status == 'approved'
-        ).order_by(Message.approved_at.desc()).limit(limit).offset(offset).all()
+    def get_approved_messages(self, limit: Optional[int] = 100, offset: int = 0) -> List[Message]:
+        """Get approved messages in card order (all of them if ``limit`` is None)."""
+        return self._approved().order_by(
+            Message.order_key, Message.id
+        ).limit(limit).offset(offset).all()
+    
+    def move_message(self, message_id: int, after_id: Optional[int] = None) -> bool:
+        """Place an approved message right after another one, or first.
+        
+        Only the moved message gets a new order key, unless the card has
+        messages without a key or keys have grown too long, and the whole
+        card is rebalanced. Moving a message after itself changes nothing.
+        """
+        message = self._approved().filter(Message.id == message_id).first()
+        if not message:
+            return False
+        anchor = None
+        if after_id is not None:
+            anchor = self._approved().filter(Message.id == after_id).first()
+            if not anchor:
+                return False
+        if message_id == after_id:
+            return True
+        # Keyless rows have no place between keys: give every row one first
+        if self._approved().filter(Message.order_key.is_(None)).first() is not None:
+            self.rebalance()
+        lower = anchor.order_key if anchor is not None else None
+        key = OrderKey.between(lower, self._key_after(lower, message.id))
+        if OrderKey.needs_rebalance(key):
+            self.rebalance()
+            lower = anchor.order_key if anchor is not None else None
+            key = OrderKey.between(lower, self._key_after(lower, message.id))
+        message.order_key = key
+        self.db.commit()
+        return True
+    
+    def rebalance(self) -> None:
+        """Give every approved message a fresh, short key, keeping their order.
+        
+        Rewrites all rows of the card, so it is only done when keys grow
+        past ``OrderKey.MAX_LENGTH`` or rows have no key; the caller commits.
+        Keyless rows stay first, where SQLite lists them.
+        """
+        ids = [row.id for row in self._approved().with_entities(Message.id).order_by(
+            Message.order_key.isnot(None), Message.order_key, Message.id
+        )]
+        if ids:
+            self.db.execute(update(Message), [
+                {'id': message_id, 'order_key': key} for message_id, key in zip(ids, OrderKey.spread(len(ids)))
+            ])
+            self.db.expire_all()
+    
+    def _approved(self):
+        return self._messages().filter(Message.status == 'approved')
+    
+    def _key_after(self, key: Optional[str], exclude_id: int) -> Optional[str]:
+        """The smallest order key above ``key`` (or of all), ignoring one message."""
+        query = self._approved().filter(Message.id != exclude_id, Message.order_key.isnot(None))
+        if key is not None:
+            query = query.filter(Message.order_key > key)
+        return query.with_entities(func.min(Message.order_key)).scalar()
+    
+    def _next_key(self) -> str:
+        """Order key placing a newly approved message last."""
+        key = OrderKey.between(self._approved().with_entities(func.max(Message.order_key)).scalar(), None)
+        if OrderKey.needs_rebalance(key):
+            self.rebalance()
+            key = OrderKey.between(self._approved().with_entities(func.max(Message.order_key)).scalar(), None)
+        return key
     
     def get_message_by_id(self, message_id: int) -> Optional[Message]:
         """Get a message by ID."""
-        return self.db.query(Message).filter(Message.id == message_id).first()
+        return self._messages().filter(Message.id == message_id).first()
     
     def get_pending_count(self) -> int:
         """Get count of pending messages."""
-        return self.db.query(Message).filter(Message.status == 'pending').count()
+        return self._messages().filter(Message.status == 'pending').count()
     
-    def _format_names(self, name: str) -> str:
-        """Format multiple names according to the specified pattern.
-        
-        1 person: Person 1
-        2 people: Person 1 & Person 2
-        3+ people: Person 1, Person 2 & Person 3
-        """
-        # Split by comma and clean up whitespace
-        names = [n.strip() for n in name.split(',') if n.strip()]
-        
-        if len(names) == 0:
-            return "Unknown"
-        elif len(names) == 1:
-            return names[0]
-        elif len(names) == 2:
-            return f"{names[0]} & {names[1]}"
-        else:
-            # Join all but last with commas, then add & before last
-            return ", ".join(names[:-1]) + f" & {names[-1]}"
+    def get_attachments(self, messages: Iterable[Message]) -> Dict[int, List[MessageAttachment]]:
+        """Get the ordered attachments of several messages, keyed by message id."""
+        return load_attachments(self.db, [m.id for m in messages])
+
+
+def load_attachments(db: Session, message_ids: List[int]) -> Dict[int, List[MessageAttachment]]:
+    """Load attachments of the given messages in batches, in display order."""
+    attachments = defaultdict(list)
+    for start in range(0, len(message_ids), 500):
+        for attachment in db.query(MessageAttachment).filter(
+            MessageAttachment.message_id.in_(message_ids[start:start + 500])
+        ).order_by(MessageAttachment.message_id, MessageAttachment.position):
+            attachments[attachment.message_id].append(attachment)
+    return dict(attachments)
+
+
+def message_media(message: Message, attachments: Dict[int, List[MessageAttachment]]) -> List[Tuple[str, str]]:
+    """``(media_type, path)`` of every media file of a message, in order.
     
-    def _generate_initials(self, name: str) -> str:
-        """Generate initials from name.
-        
-        For formatted names with &, takes first letter of first name and first letter after &.
-        """
-        # Handle names with & (formatted multiple names)
-        if ' & ' in name:
-            parts = name.split(' & ')
-            first_initial = parts[0].strip()[0].upper() if parts[0].strip() else '?'
-            # Get the first letter of the last person's name
-            last_name_words = parts[-1].strip().split()
-            last_initial = last_name_words[0][0].upper() if last_name_words else '?'
-            return first_initial + last_initial
-        
-        # Handle single name or names with commas
-        if ',' in name:
-            # If there are commas, get first name
-            first_name = name.split(',')[0].strip()
-            words = first_name.split()
-        else:
-            words = name.strip().split()
-        
-        if len(words) == 0:
-            return "?"
-        elif len(words) == 1:
-            return words[0][0].upper()
-        else:
-            return (words[0][0] + words[-1][0]).upper()
-    
-    def _generate_color_hint(self, name: str) -> str:
-        """Generate a deterministic color hint from name."""
-        hash_val = 0
-        for char in name:
-            hash_val = (hash_val << 5) - hash_val + ord(char)
-            hash_val = hash_val & 0xFFFFFFFF
-        
-        hue = abs(hash_val) % 360
-        return f"hsl({hue} 60% 90%)"
+    Messages from before attachments only have their own media columns.
+    """
+    if message.id in attachments:
+        return [(a.media_type, a.path) for a in attachments[message.id]]
+    path = message.video_path if message.media_type == 'video' else message.image_path
+    return [(message.media_type, path)] if message.media_type and path else []
 
 
 class InviteLinkService:
     """Handle invite link operations."""
     
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: Session, card_id: int = DEFAULT_CARD_ID):
         self.db = db_session
+        self.card_id = card_id
     
     def create_link(self, note: Optional[str] = None, 
                     max_uses: Optional[int] = None,
@@ -174,6 +229,7 @@ class InviteLinkService:
         
         link = InviteLink(
             token=token,
+            card_id=self.card_id,
             note=note,
             max_uses=max_uses,
             expires_at=expires_at
@@ -184,13 +240,16 @@ class InviteLinkService:
     
     def get_all_links(self) -> List[InviteLink]:
         """Get all invite links."""
-        return self.db.query(InviteLink).order_by(
-            InviteLink.created_at.desc()
-        ).all()
+        return self.db.query(InviteLink).filter(
+            InviteLink.card_id == self.card_id
+        ).order_by(InviteLink.created_at.desc()).all()
     
     def deactivate_link(self, token: str) -> bool:
         """Deactivate an invite link."""
-        link = self.db.query(InviteLink).filter(InviteLink.token == token).first()
+        link = self.db.query(InviteLink).filter(
+            InviteLink.token == token,
+            InviteLink.card_id == self.card_id
+        ).first()
         if link:
             link.is_active = False
             self.db.commit()
@@ -201,19 +260,27 @@ class InviteLinkService:
 class CoverService:
     """Handle card cover operations."""
     
-    def __init__(self, db_session: Session, media_path: str):
+    def __init__(self, db_session: Session, media_path: str, card_id: int = DEFAULT_CARD_ID,
+                 storage: Optional[MediaStorage] = None):
         self.db = db_session
+        self.card_id = card_id
         self.image_processor = ImageProcessor(media_path)
+        self.storage = storage or LocalStorage(media_path)
     
     def upload_cover(self, file_data: bytes, filename: str) -> str:
         """Upload a new card cover image."""
         # Deactivate current cover
-        self.db.query(CardCover).update({'is_active': False})
+        self.db.query(CardCover).filter(
+            CardCover.card_id == self.card_id
+        ).update({'is_active': False})
         
         # Save new cover
-        full_path, _ = self.image_processor.save_image(file_data, filename)
+        full_path, thumb_path, info = self.image_processor.save_image_with_info(file_data, filename)
+        self.storage.store(full_path)
+        self.storage.store(thumb_path)
         
-        cover = CardCover(image_path=full_path, is_active=True)
+        cover = CardCover(image_path=full_path, card_id=self.card_id, is_active=True,
+                          width=info.width, height=info.height, placeholder=info.placeholder)
         self.db.add(cover)
         self.db.commit()
         
@@ -222,6 +289,7 @@ class CoverService:
     def get_active_cover(self) -> Optional[CardCover]:
         """Get the currently active cover."""
         return self.db.query(CardCover).filter(
+            CardCover.card_id == self.card_id,
             CardCover.is_active == True
         ).first()
 
@@ -229,27 +297,156 @@ class CoverService:
 class SettingsService:
     """Handle application settings."""
     
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: Session, card_id: int = DEFAULT_CARD_ID):
         self.db = db_session
+        self.card_id = card_id
+    
+    def _settings(self):
+        """Query settings belonging to this card."""
+        return self.db.query(Settings).filter(Settings.card_id == self.card_id)
     
     def get_setting(self, key: str, default: str = None) -> Optional[str]:
         """Get a setting value by key."""
-        setting = self.db.query(Settings).filter(Settings.key == key).first()
+        setting = self._settings().filter(Settings.key == key).first()
         return setting.value if setting else default
     
     def set_setting(self, key: str, value: str) -> bool:
         """Set a setting value."""
-        setting = self.db.query(Settings).filter(Settings.key == key).first()
+        setting = self._settings().filter(Settings.key == key).first()
         if setting:
             setting.value = value
             setting.updated_at = datetime.utcnow()
         else:
-            setting = Settings(key=key, value=value)
+            setting = Settings(card_id=self.card_id, key=key, value=value)
             self.db.add(setting)
         self.db.commit()
+        settings_cache.invalidate(('settings', self.card_id))
         return True
     
     def get_all_settings(self) -> dict:
         """Get all settings as a dictionary."""
-        settings = self.db.query(Settings).all()
+        settings = self._settings().all()
         return {s.key: s.value for s in settings}
+
+
+class ExportService:
+    """Build a downloadable keepsake archive of the card."""
+    
+    BATCH_SIZE = 200
+    
+    def __init__(self, db_session: Session, media_path: str, card_id: int = DEFAULT_CARD_ID,
+                 storage: Optional[MediaStorage] = None):
+        self.db = db_session
+        self.media_path = media_path
+        self.card_id = card_id
+        self.storage = storage or LocalStorage(media_path)
+        self.streamer = ZipStreamer()
+        self._attachment_cache = None
+    
+    def stream_zip(self) -> Iterator[bytes]:
+        """Stream the card as a ZIP archive without buffering it in memory."""
+        return self.streamer.stream(self._iter_entries())
+    
+    def _approved_messages(self):
+        """Iterate approved messages in card order, loading rows in batches."""
+        return self.db.query(Message).filter(
+            Message.card_id == self.card_id,
+            Message.status == 'approved'
+        ).order_by(Message.order_key, Message.id).yield_per(self.BATCH_SIZE)
+    
+    def _attachments(self) -> Dict[int, List[MessageAttachment]]:
+        """Attachments of all approved messages, loaded once per export."""
+        if self._attachment_cache is None:
+            ids = [row.id for row in self.db.query(Message.id).filter(
+                Message.card_id == self.card_id,
+                Message.status == 'approved'
+            )]
+            self._attachment_cache = load_attachments(self.db, ids)
+        return self._attachment_cache
+    
+    def _iter_entries(self):
+        """Yield (arcname, chunks, size) tuples for every archive entry."""
+        cover = self.db.query(CardCover).filter(
+            CardCover.card_id == self.card_id,
+            CardCover.is_active == True
+        ).first()
+        if cover:
+            entry = self._media_entry(cover.image_path, f"cover{Path(cover.image_path).suffix}")
+            if entry:
+                yield entry
+        
+        for position, message in enumerate(self._approved_messages(), start=1):
+            page = self._render_message_page(message).encode('utf-8')
+            yield self._message_page_name(position, message), [page], len(page)
+            for _, media in message_media(message, self._attachments()):
+                entry = self._media_entry(media, f"media/{media}")
+                if entry:
+                    yield entry
+        
+        yield 'messages.json', self._iter_messages_json(), None
+        yield 'index.html', self._iter_index_html(), None
+    
+    def _media_entry(self, rel_path: str, arcname: str):
+        """Build an entry for a media file, skipping files that are missing."""
+        size = self.storage.size(rel_path)
+        if size is None:
+            return None
+        return arcname, self.storage.iter_chunks(rel_path, self.streamer.chunk_size), size
+    
+    def _iter_messages_json(self) -> Iterator[bytes]:
+        """Yield a JSON array of messages one element at a time."""
+        yield b'[\n'
+        first = True
+        for message in self._approved_messages():
+            data = message.to_dict()
+            data.pop('status', None)
+            data.pop('card_id', None)
+            data.pop('order_index', None)
+            data.pop('order_key', None)
+            # Only original media files are exported
+            data.pop('preview_path', None)
+            data.pop('poster_path', None)
+            data['attachments'] = [
+                {'media_type': media_type, 'path': path}
+                for media_type, path in message_media(message, self._attachments())
+            ]
+            prefix = b'' if first else b',\n'
+            first = False
+            yield prefix + json.dumps(data, ensure_ascii=False).encode('utf-8')
+        yield b'\n]\n'
+    
+    def _iter_index_html(self) -> Iterator[bytes]:
+        """Yield an index page linking to every message page."""
+        yield (
+            '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="UTF-8">\n'
+            '<title>Messages</title>\n</head>\n<body>\n<h1>Messages</h1>\n<ul>\n'
+        ).encode('utf-8')
+        for position, message in enumerate(self._approved_messages(), start=1):
+            href = self._message_page_name(position, message)
+            yield f'<li><a href="{html.escape(href)}">{html.escape(message.name)}</a></li>\n'.encode('utf-8')
+        yield b'</ul>\n</body>\n</html>\n'
+    
+    def _message_page_name(self, position: int, message: Message) -> str:
+        """Build a stable, filesystem-safe archive name for a message page."""
+        slug = re.sub(r'[^a-z0-9]+', '-', message.name.lower()).strip('-') or 'message'
+        return f"messages/{position:04d}-{slug[:40]}.html"
+    
+    def _render_message_page(self, message: Message) -> str:
+        """Render a standalone HTML page for a single message."""
+        media_html = '\n'.join(
+            f'<video src="../media/{html.escape(path)}" controls style="max-width:100%"></video>'
+            if media_type == 'video' else
+            f'<img src="../media/{html.escape(path)}" alt="Message image" style="max-width:100%">'
+            for media_type, path in message_media(message, self._attachments())
+        )
+        created = message.created_at.strftime('%Y-%m-%d') if message.created_at else ''
+        # Content is sanitized on submission, so it is embedded as-is
+        return (
+            '<!DOCTYPE html>\n<html lang="en">\n<head>\n<meta charset="UTF-8">\n'
+            f'<title>{html.escape(message.name)}</title>\n</head>\n<body>\n'
+            f'<h1>{html.escape(message.name)}</h1>\n'
+            f'<p>{created}</p>\n'
+            f'<div>{message.content}</div>\n'
+            f'{media_html}\n'
+            '</body>\n</html>\n'
+        )
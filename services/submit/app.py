@@ -3,13 +3,21 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
-from flask import Flask, render_template, request, jsonify, flash, redirect
+from flask import Flask, g, render_template, request, jsonify, flash, redirect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from werkzeug.middleware.proxy_fix import ProxyFix
-from shared.models import init_db, Settings
+from shared.admission import init_admission, is_large_post
+from shared.compression import init_compression
+from shared.models import init_db
+from shared.profiling import init_profiling
+from shared.query_stats import init_query_stats
+from shared.metrics import init_metrics, record_admission_rejection, record_ratelimit_rejection
+from shared.utils.limiter_storage import SQLiteLimiterStorage  # registers sqlite:// limiter storage
+from shared.tenancy import init_tenancy, current_card_id
+from shared.utils.storage import create_storage
 from config import Config
-from services import SubmissionService
+from services import SubmissionInProgress, SubmissionService
 
 
 def create_app():
@@ -17,20 +25,70 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     
-    # ProxyFix for correct URL generation
-    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+    # Compress text responses; registered first so it runs after every
+    # other after_request hook
+    if Config.COMPRESSION_ENABLED:
+        init_compression(app, min_size=Config.COMPRESSION_MIN_SIZE)
     
-    # Rate limiting
+    # Rate limiting, switched off by Flask-Limiter itself when the config
+    # has RATELIMIT_ENABLED=false
     limiter = Limiter(
         app=app,
         key_func=get_remote_address,
         storage_uri=Config.RATELIMIT_STORAGE_URL,
-        default_limits=["100 per hour"]
+        default_limits=["100 per hour"],
+        on_breach=record_ratelimit_rejection
     )
     
+    def rate_limit(limits, **options):
+        """``limiter.limit``, or no decorator when rate limiting is off.
+        
+        A disabled limiter is not registered on the app, and its decorators
+        only hold a weak reference to it.
+        """
+        return limiter.limit(limits, **options) if limiter.enabled else (lambda view: view)
+    
     # Initialize database
     Config.init_paths()
     Session, engine = init_db(Config.DATABASE_URL)
+    storage = create_storage(Config)
+    
+    # Turn away media uploads beyond MEDIA_CONCURRENCY, ahead of the rate
+    # limiter so a rejected upload does not count against the visitor
+    if Config.MEDIA_CONCURRENCY:
+        init_admission(
+            app, Config.ADMISSION_DIR, Config.MEDIA_CONCURRENCY,
+            is_large_post(Config.MEDIA_MIN_BYTES),
+            retry_after=Config.ADMISSION_RETRY_AFTER,
+            reject=lambda retry_after: (render_template(
+                'error.html',
+                error=f'Lots of messages are arriving right now. Please go back and send yours again in {retry_after} seconds.'
+            ), 503),
+            on_reject=record_admission_rejection
+        )
+    
+    # Request, query and media metrics for Prometheus at /metrics
+    if Config.METRICS_ENABLED:
+        init_metrics(app, 'submit', engine, token=Config.METRICS_TOKEN)
+        if limiter.enabled and 'metrics' in app.view_functions:
+            limiter.exempt(app.view_functions['metrics'])
+    
+    # Query counts, slow queries and N+1 warnings per request
+    if Config.SQL_INSTRUMENTATION:
+        init_query_stats(app, engine, Config.SQL_SLOW_QUERY_MS, Config.SQL_REPEAT_THRESHOLD)
+    
+    # Profile requests sent with X-Profile: <PROFILE_SECRET>, or a random sample
+    if Config.PROFILE_SECRET or Config.PROFILE_SAMPLE_RATE:
+        init_profiling(app, 'submit', Config.PROFILE_DIR, secret=Config.PROFILE_SECRET,
+                       sample_rate=Config.PROFILE_SAMPLE_RATE, mode=Config.PROFILE_MODE,
+                       max_files=Config.PROFILE_MAX_FILES)
+    
+    # Resolve the card each request belongs to, behind ProxyFix so the
+    # forwarded host is visible
+    init_tenancy(app, Session, Config.TENANT_MODE)
+    
+    # ProxyFix for correct URL generation
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
     
     def get_db():
         """Get database session."""
@@ -46,59 +104,89 @@ def create_app():
         """Show submission form."""
         db = get_db()
         try:
-            service = SubmissionService(db, Config.MEDIA_PATH)
+            service = SubmissionService(db, Config.MEDIA_PATH, current_card_id(), storage=storage)
             is_valid, error = service.validate_token(token)
             
             if not is_valid:
                 return render_template('error.html', error=error), 403
             
             # Get settings
-            recipient_name = db.query(Settings).filter(Settings.key == 'recipient_name').first()
-            submission_heading = db.query(Settings).filter(Settings.key == 'submission_heading').first()
-            
-            recipient = recipient_name.value if recipient_name else 'Bob'
-            heading = submission_heading.value if submission_heading else 'Send a Message!'
+            settings = service.get_settings()
+            recipient = settings.get('recipient_name', 'Bob')
+            heading = settings.get('submission_heading', 'Send a Message!')
             
-            return render_template('submit.html', token=token, recipient_name=recipient, submission_heading=heading)
+            return render_template('submit.html', token=token, recipient_name=recipient, submission_heading=heading,
+                                   max_attachments=SubmissionService.MAX_ATTACHMENTS)
+        finally:
+            db.close()
+    
+    def submitted_form():
+        """The name, content and ``(data, filename, media_type)`` uploads of
+        the posted form, read once per request."""
+        if 'submitted_form' not in g:
+            # Handle photo/video uploads, in the order they were picked
+            attachments = []
+            for file in request.files.getlist('image'):
+                if file.filename:
+                    # Simple check for video types
+                    media_type = None
+                    if file.mimetype.startswith('video/'):
+                        media_type = 'video'
+                    elif file.mimetype.startswith('image/'):
+                        media_type = 'image'
+                    
+                    attachments.append((file.read(), file.filename, media_type))
+            g.submitted_form = (request.form.get('name', '').strip(),
+                                request.form.get('content', '').strip(), attachments)
+        return g.submitted_form
+    
+    def is_retried_submission():
+        """A retry of a stored (or still processing) submission is answered
+        without creating a message, so it does not count against the rate
+        limit. The same key with other content is not a retry."""
+        key = SubmissionService.clean_idempotency_key(request.form.get('idempotency_key'))
+        if not key:
+            return False
+        db = get_db()
+        try:
+            service = SubmissionService(db, Config.MEDIA_PATH, current_card_id(), storage=storage)
+            existing = service.find_submission(key)
+            if existing is None:
+                return False
+            name, content, attachments = submitted_form()
+            return existing.idempotency_hash in (
+                None, SubmissionService.payload_hash(request.view_args['token'], name, content, attachments)
+            )
         finally:
             db.close()
     
     @app.route('/submit/<token>', methods=['POST'])
-    @limiter.limit("5 per hour; 1 per minute")
+    @rate_limit("5 per hour; 1 per minute", exempt_when=is_retried_submission)
     def submit_message(token):
         """Handle message submission."""
         db = get_db()
         try:
-            name = request.form.get('name', '').strip()
-            content = request.form.get('content', '').strip()
+            name, content, attachments = submitted_form()
             
             if not name or not content:
                 flash('Name and message are required', 'error')
                 return redirect(request.url)
             
-            # Handle image upload
-            image_data = None
-            image_filename = None
-            media_type = None
-            if 'image' in request.files:
-                file = request.files['image']
-                if file.filename:
-                    # Simple check for video types
-                    if file.mimetype.startswith('video/'):
-                        media_type = 'video'
-                    elif file.mimetype.startswith('image/'):
-                        media_type = 'image'
-                    
-                    image_data = file.read()
-                    image_filename = file.filename
-            
             # Get IP address
             ip_address = get_remote_address()
             
-            service = SubmissionService(db, Config.MEDIA_PATH)
-            success, message = service.create_submission(
-                token, name, content, image_data, image_filename, ip_address, media_type
-            )
+            service = SubmissionService(db, Config.MEDIA_PATH, current_card_id(), storage=storage)
+            try:
+                success, message = service.create_submission(
+                    token, name, content, ip_address=ip_address,
+                    idempotency_key=request.form.get('idempotency_key'),
+                    attachments=attachments
+                )
+            except SubmissionInProgress:
+                return render_template(
+                    'error.html',
+                    error='Your message is still being processed. Please send it again in a few seconds; it will only be posted once.'
+                ), 409, {'Retry-After': str(Config.ADMISSION_RETRY_AFTER)}
             
             if success:
                 return render_template('success.html')
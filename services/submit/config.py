@@ -3,15 +3,80 @@ import os
 from pathlib import Path
 
 
+def _default_ratelimit_storage(database_url: str) -> str:
+    """Place rate limit counters next to a file-based SQLite database."""
+    db_path = database_url.replace('sqlite:///', '')
+    if database_url.startswith('sqlite:///') and db_path not in ('', ':memory:'):
+        return f"sqlite:///{Path(db_path).parent / 'ratelimit.db'}"
+    return 'memory://'
+
+
 class Config:
     """Configuration for submission service."""
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:////data/virtual_card.db')
     MEDIA_PATH = os.getenv('MEDIA_PATH', '/media')
-    MAX_CONTENT_LENGTH = 5 * 1024 * 1024  # 5 MB
+    MAX_CONTENT_LENGTH = 30 * 1024 * 1024  # 30 MB, room for several photos
+    
+    # Media storage (see shared/utils/storage.py): 'local' keeps files in
+    # MEDIA_PATH; 's3' moves them to S3_BUCKET on any S3-compatible store
+    # (MinIO, R2, ... via S3_ENDPOINT_URL), using MEDIA_PATH as scratch
+    # space. If MEDIA_URL is set, media is linked at MEDIA_URL/<path>;
+    # otherwise S3 links are signed and valid for S3_URL_EXPIRES seconds.
+    MEDIA_STORAGE = os.getenv('MEDIA_STORAGE', 'local')
+    MEDIA_URL = os.getenv('MEDIA_URL', '')
+    S3_BUCKET = os.getenv('S3_BUCKET', '')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', '')
+    S3_REGION = os.getenv('S3_REGION', '')
+    S3_PREFIX = os.getenv('S3_PREFIX', '')
+    S3_URL_EXPIRES = int(os.getenv('S3_URL_EXPIRES', '3600'))
+    
+    # Multi-tenancy: 'single', 'host' or 'path' (see shared/tenancy.py)
+    TENANT_MODE = os.getenv('TENANT_MODE', 'single')
+    
+    # Prometheus metrics, served at /metrics to scrapers sending
+    # "Authorization: Bearer <METRICS_TOKEN>" (not served without a token)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+    
+    # gzip/brotli response compression (see shared/compression.py)
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() != 'false'
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '500'))
+    
+    # Opt-in per-request SQL statistics (see shared/query_stats.py)
+    SQL_INSTRUMENTATION = os.getenv('SQL_INSTRUMENTATION', 'false').lower() == 'true'
+    SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', '100'))
+    SQL_REPEAT_THRESHOLD = int(os.getenv('SQL_REPEAT_THRESHOLD', '3'))
+    
+    # On-demand request profiling (see shared/profiling.py)
+    PROFILE_SECRET = os.getenv('PROFILE_SECRET', '')
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_MODE = os.getenv('PROFILE_MODE', 'sampler')
+    PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/profiles')
+    PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '100'))
+    
+    # Admission control (see shared/admission.py): at most MEDIA_CONCURRENCY
+    # POSTs larger than MEDIA_MIN_BYTES (i.e. with media) are processed at
+    # once across all workers; the rest get 503 and Retry-After. Keep it
+    # below GUNICORN_WORKERS so workers stay free for form views, text-only
+    # messages and /health. 0 disables the cap.
+    MEDIA_CONCURRENCY = int(os.getenv(
+        'MEDIA_CONCURRENCY', str(max(1, int(os.getenv('GUNICORN_WORKERS', '4')) // 2))
+    ))
+    MEDIA_MIN_BYTES = int(os.getenv('MEDIA_MIN_BYTES', str(64 * 1024)))
+    ADMISSION_DIR = os.getenv('ADMISSION_DIR', '/tmp/collation-admission')
+    ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '10'))
     
-    # Rate limiting (requires Redis in production)
-    RATELIMIT_STORAGE_URL = os.getenv('REDIS_URL', 'memory://')
+    # Rate limiting. Counters must be shared by all workers for limits to be
+    # accurate: by default they live in a SQLite file next to the database
+    # (or in memory for in-memory databases); REDIS_URL also works.
+    RATELIMIT_STORAGE_URL = (
+        os.getenv('RATELIMIT_STORAGE_URL')
+        or os.getenv('REDIS_URL')
+        or _default_ratelimit_storage(DATABASE_URL)
+    )
+    # Set RATELIMIT_ENABLED=false for load testing only
+    RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'true').lower() != 'false'
     
     @staticmethod
     def init_paths():
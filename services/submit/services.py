@@ -3,26 +3,90 @@ import sys
 import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 
+import hashlib
+import re
+import threading
 import uuid
-from datetime import datetime
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from shared.models import Message, InviteLink
-from shared.utils import ContentSanitizer, ImageProcessor, VideoProcessor
+from shared.cache import settings_cache
+from shared.metrics import track_media
+from shared.models import Message, MessageAttachment, InviteLink, Settings, DEFAULT_CARD_ID
+from shared.utils import ContentSanitizer, ImageProcessor, VideoProcessor, NameFormatter
+from shared.utils.image_utils import MediaInfo
+from shared.utils.storage import LocalStorage, MediaStorage
+
+
+class SubmissionInProgress(Exception):
+    """A submission with the same idempotency key is still being processed."""
+
+
+class SavedMedia(NamedTuple):
+    """A processed upload, as stored in the media directory."""
+    media_type: str
+    path: str
+    thumb_path: Optional[str]
+    info: MediaInfo
+    preview_path: Optional[str] = None
+    poster_path: Optional[str] = None
+    
+    @property
+    def files(self) -> Tuple[Optional[str], ...]:
+        """Every stored file of the upload (unset ones are None)."""
+        return self.path, self.thumb_path, self.preview_path, self.poster_path
+
+
+# Media files of a submission are processed concurrently. The pool is shared
+# by all requests of a worker so the number of busy threads stays bounded;
+# Pillow and ffmpeg do their work outside the GIL.
+_media_pool = None
+_media_pool_lock = threading.Lock()
+
+
+def _get_media_pool() -> ThreadPoolExecutor:
+    global _media_pool
+    with _media_pool_lock:
+        if _media_pool is None:
+            _media_pool = ThreadPoolExecutor(
+                max_workers=SubmissionService.MEDIA_THREADS, thread_name_prefix='media'
+            )
+        return _media_pool
 
 
 class SubmissionService:
     """Handle message submissions."""
     
-    def __init__(self, db_session: Session, media_path: str):
+    # Keys are generated by the form (a UUID); anything else is ignored
+    IDEMPOTENCY_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+    
+    MAX_ATTACHMENTS = 6
+    MEDIA_THREADS = 4
+    
+    # Submissions with media and an idempotency key are stored with this
+    # status while their media is processed, so retries find them; one
+    # older than RESERVATION_TIMEOUT was left by a request that died
+    PROCESSING = 'processing'
+    RESERVATION_TIMEOUT = timedelta(minutes=10)
+    
+    KEY_REUSED = "This form was already used to send another message. Please reload the page to send a new one."
+    
+    def __init__(self, db_session: Session, media_path: str, card_id: int = DEFAULT_CARD_ID,
+                 storage: Optional[MediaStorage] = None):
         self.db = db_session
+        self.card_id = card_id
+        self.media_path = Path(media_path)
+        self.storage = storage or LocalStorage(media_path)
         self.sanitizer = ContentSanitizer()
         self.image_processor = ImageProcessor(media_path)
         self.video_processor = VideoProcessor(media_path)
     
     def validate_token(self, token: str) -> Tuple[bool, Optional[str]]:
         """Validate invite token."""
-        link = self.db.query(InviteLink).filter(InviteLink.token == token).first()
+        link = self._get_link(token)
         
         if not link:
             return False, "Invalid token"
@@ -38,124 +102,248 @@ class SubmissionService:
         
         return True, None
     
+    def get_settings(self) -> dict:
+        """Get all settings as a dictionary, served from the settings cache."""
+        return settings_cache.get_or_set(
+            ('settings', self.card_id),
+            lambda: {
+                s.key: s.value
+                for s in self.db.query(Settings).filter(Settings.card_id == self.card_id)
+            }
+        )
+    
+    @classmethod
+    def clean_idempotency_key(cls, key: Optional[str]) -> Optional[str]:
+        """Return the key if it is well-formed, else None."""
+        if key and cls.IDEMPOTENCY_KEY_PATTERN.match(key):
+            return key
+        return None
+    
+    @staticmethod
+    def payload_hash(token: str, name: str, content: str,
+                     files: Sequence[Tuple[bytes, str, Optional[str]]] = ()) -> str:
+        """SHA-256 of a submitted form, to tell a retry from other content."""
+        digest = hashlib.sha256()
+        parts = [token, name, content]
+        for data, filename, media_type in files:
+            parts += [hashlib.sha256(data).hexdigest(), filename, media_type or '']
+        for part in parts:
+            encoded = part.encode()
+            digest.update(len(encoded).to_bytes(8, 'big') + encoded)
+        return digest.hexdigest()
+    
+    def find_submission(self, idempotency_key: Optional[str]) -> Optional[Message]:
+        """Get the message already created with an idempotency key."""
+        if not idempotency_key:
+            return None
+        return self.db.query(Message).filter(
+            Message.card_id == self.card_id,
+            Message.idempotency_key == idempotency_key
+        ).first()
+    
     def create_submission(self, token: str, name: str, content: str, 
                          image_data: Optional[bytes] = None,
                          image_filename: Optional[str] = None,
                          ip_address: Optional[str] = None,
-                         media_type: Optional[str] = None) -> Tuple[bool, str]:
-        """Create a new message submission."""
+                         media_type: Optional[str] = None,
+                         idempotency_key: Optional[str] = None,
+                         attachments: Optional[Sequence[Tuple[bytes, str, str]]] = None) -> Tuple[bool, str]:
+        """Create a new message submission.
+        
+        Media is given as ``image_data``/``image_filename``/``media_type``
+        and/or a list of ``(data, filename, media_type)`` ``attachments``, in
+        display order. The first file is also stored in the message's own
+        media columns.
+        
+        A retry carrying the ``idempotency_key`` of a stored submission gets
+        the original result; its media is not processed again and the
+        token is not used again. A key sent again with different content
+        is refused.
+        
+        Raises:
+            SubmissionInProgress: if the submission with this key is still
+                being processed by another request
+        """
+        files = list(attachments or [])
+        if image_data and image_filename and media_type:
+            files.insert(0, (image_data, image_filename, media_type))
+        
+        idempotency_key = self.clean_idempotency_key(idempotency_key)
+        payload_hash = self.payload_hash(token, name, content, files) if idempotency_key else None
+        existing = self.find_submission(idempotency_key)
+        if existing is not None:
+            if (existing.status != self.PROCESSING
+                    or existing.created_at > datetime.utcnow() - self.RESERVATION_TIMEOUT):
+                return self._retry_result(existing, payload_hash)
+            self.db.delete(existing)
+            self.db.commit()
+        
         # Validate token
         is_valid, error = self.validate_token(token)
         if not is_valid:
             return False, error
         
         # Format the name (handle multiple names)
-        formatted_name = self._format_names(name)
+        formatted_name = NameFormatter.format_names(name)
         
         # Sanitize content
         clean_content = self.sanitizer.sanitize(content)
         
         # Generate initials
-        initials = self._generate_initials(formatted_name)
+        initials = NameFormatter.generate_initials(formatted_name)
         
         # Handle media upload
-        image_path, video_path, thumb_path = None, None, None
-        if image_data and image_filename and media_type:
-            try:
-                if media_type == 'image':
-                    image_path, thumb_path = self.image_processor.save_image(
-                        image_data, image_filename
-                    )
-                elif media_type == 'video':
-                    video_path, thumb_path = self.video_processor.save_video(
-                        image_data, image_filename
-                    )
-            except Exception as e:
-                return False, f"Media upload failed: {str(e)}"
+        files = [f for f in files if f[0] and f[1] and f[2] in ('image', 'video')]
+        if len(files) > self.MAX_ATTACHMENTS:
+            return False, f"At most {self.MAX_ATTACHMENTS} files can be attached"
         
         # Generate color hint
-        color_hint = self._generate_color_hint(formatted_name)
+        color_hint = NameFormatter.generate_color_hint(formatted_name)
         
         # Create message
         message = Message(
+            card_id=self.card_id,
             uuid=str(uuid.uuid4()),
             name=formatted_name,
             initials=initials,
             content=clean_content,
-            image_path=image_path,
-            video_path=video_path,
-            thumb_path=thumb_path,
-            media_type=media_type,
             ip_address=ip_address,
             color_hint=color_hint,
-            status='pending'
+            status='pending',
+            idempotency_key=idempotency_key,
+            idempotency_hash=payload_hash
         )
         
-        self.db.add(message)
+        # Processing media can outlast a phone's request timeout; reserve
+        # the key first so the retry waits for this request instead of
+        # processing the same files again
+        reserved = bool(idempotency_key and files)
+        if reserved:
+            message.status = self.PROCESSING
+            try:
+                self.db.add(message)
+                self.db.commit()
+            except IntegrityError:
+                self.db.rollback()
+                existing = self.find_submission(idempotency_key)
+                if existing is None:
+                    raise
+                return self._retry_result(existing, payload_hash)
         
-        # Increment token usage
-        link = self.db.query(InviteLink).filter(InviteLink.token == token).first()
-        link.uses_count += 1
+        try:
+            saved = self._save_media(files)
+        except Exception as e:
+            if reserved:
+                # Release the key so the visitor can try again
+                self.db.delete(message)
+                self.db.commit()
+            return False, f"Media upload failed: {str(e)}"
         
-        self.db.commit()
+        if saved:
+            first = saved[0]
+            message.media_type = first.media_type
+            message.thumb_path = first.thumb_path
+            message.preview_path, message.poster_path = first.preview_path, first.poster_path
+            message.media_width, message.media_height = first.info.width, first.info.height
+            message.placeholder = first.info.placeholder
+            if first.media_type == 'image':
+                message.image_path = first.path
+            else:
+                message.video_path = first.path
+        message.status = 'pending'
+        
+        try:
+            self.db.add(message)
+            self.db.flush()
+            self.db.add_all(
+                MessageAttachment(
+                    message_id=message.id, card_id=self.card_id, position=position,
+                    media_type=media.media_type, path=media.path, thumb_path=media.thumb_path,
+                    preview_path=media.preview_path, poster_path=media.poster_path,
+                    width=media.info.width, height=media.info.height,
+                    placeholder=media.info.placeholder
+                )
+                for position, media in enumerate(saved)
+            )
+            
+            # Increment token usage
+            link = self._get_link(token)
+            link.uses_count += 1
+            
+            self.db.commit()
+        except IntegrityError:
+            # A concurrent retry with the same key was stored first
+            self.db.rollback()
+            existing = self.find_submission(idempotency_key)
+            if existing is None:
+                raise
+            self._discard_media(*(p for media in saved for p in media.files))
+            return self._retry_result(existing, payload_hash)
         
         return True, "Submission successful"
     
-    def _format_names(self, name: str) -> str:
-        """Format multiple names according to the specified pattern.
+    def _retry_result(self, existing: Message, payload_hash: Optional[str]) -> Tuple[bool, str]:
+        """Answer a submission whose idempotency key is already stored.
         
-        1 person: Person 1
-        2 people: Person 1 & Person 2
-        3+ people: Person 1, Person 2 & Person 3
+        Raises:
+            SubmissionInProgress: if the stored submission is still processing
         """
-        # Split by comma and clean up whitespace
-        names = [n.strip() for n in name.split(',') if n.strip()]
-        
-        if len(names) == 0:
-            return "Unknown"
-        elif len(names) == 1:
-            return names[0]
-        elif len(names) == 2:
-            return f"{names[0]} & {names[1]}"
-        else:
-            # Join all but last with commas, then add & before last
-            return ", ".join(names[:-1]) + f" & {names[-1]}"
-    
-    def _generate_initials(self, name: str) -> str:
-        """Generate initials from name.
-        
-        For formatted names with &, takes first letter of first name and first letter after &.
+        # Rows stored before hashes were kept match any retry
+        if existing.idempotency_hash and existing.idempotency_hash != payload_hash:
+            return False, self.KEY_REUSED
+        if existing.status == self.PROCESSING:
+            raise SubmissionInProgress()
+        return True, "Submission successful"
+    
+    def _save_media(self, files: Sequence[Tuple[bytes, str, str]]) -> List[SavedMedia]:
+        """Validate and store uploaded files concurrently, keeping their order.
+        
+        If any file fails, the files already stored are deleted and the
+        first error is raised.
         """
-        # Handle names with & (formatted multiple names)
-        if ' & ' in name:
-            parts = name.split(' & ')
-            first_initial = parts[0].strip()[0].upper() if parts[0].strip() else '?'
-            # Get the first letter of the last person's name
-            last_name_words = parts[-1].strip().split()
-            last_initial = last_name_words[0][0].upper() if last_name_words else '?'
-            return first_initial + last_initial
-        
-        # Handle single name or names with commas
-        if ',' in name:
-            # If there are commas, get first name
-            first_name = name.split(',')[0].strip()
-            words = first_name.split()
-        else:
-            words = name.strip().split()
-        
-        if len(words) == 0:
-            return "?"
-        elif len(words) == 1:
-            return words[0][0].upper()
-        else:
-            return (words[0][0] + words[-1][0]).upper()
-    
-    def _generate_color_hint(self, name: str) -> str:
-        """Generate a deterministic color hint from name."""
-        hash_val = 0
-        for char in name:
-            hash_val = (hash_val << 5) - hash_val + ord(char)
-            hash_val = hash_val & 0xFFFFFFFF
-        
-        hue = abs(hash_val) % 360
-        return f"hsl({hue} 60% 90%)"
+        if len(files) <= 1:
+            return [self._save_one(*f) for f in files]
+        futures = [_get_media_pool().submit(self._save_one, *f) for f in files]
+        saved, error = [], None
+        for future in futures:
+            try:
+                saved.append(future.result())
+            except Exception as e:
+                error = error or e
+        if error:
+            self._discard_media(*(p for media in saved for p in media.files))
+            raise error
+        return saved
+    
+    def _save_one(self, data: bytes, filename: str, media_type: str) -> SavedMedia:
+        with track_media(media_type, len(data)):
+            if media_type == 'image':
+                path, thumb_path, info = self.image_processor.save_image_with_info(data, filename)
+                media = SavedMedia(media_type, path, thumb_path, info)
+            else:
+                path, thumb_path, info = self.video_processor.save_video_with_info(data, filename)
+                media = SavedMedia(media_type, path, thumb_path, info,
+                                   *self.video_processor.generate_previews(path))
+        try:
+            for file_path in media.files:
+                if file_path:
+                    self.storage.store(file_path)
+        except Exception:
+            self._discard_media(*media.files)
+            raise
+        return media
+    
+    def _discard_media(self, *paths: Optional[str]) -> None:
+        """Delete stored media files that no message refers to."""
+        for path in paths:
+            if path:
+                self.storage.delete(path)
+                # A copy may still be waiting in the processing directory
+                (self.media_path / path).unlink(missing_ok=True)
+    
+    def _get_link(self, token: str) -> Optional[InviteLink]:
+        """Get an invite link belonging to this card."""
+        return self.db.query(InviteLink).filter(
+            InviteLink.token == token,
+            InviteLink.card_id == self.card_id
+        ).first()
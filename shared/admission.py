@@ -0,0 +1,100 @@
+"""Admission control for expensive requests, shared by all workers.
+
+Media uploads can keep a worker busy for seconds. Capping how many are
+processed at once leaves the remaining workers free for cheap requests
+(form views, text-only submissions, ``/health``), and turning the excess
+away with ``503`` and ``Retry-After`` is faster for everyone than queueing
+it behind the uploads already running.
+
+The cap is a set of slot files locked with ``flock``: any process on the
+host that opens the same directory shares the slots, and a slot is freed by
+the kernel if its worker dies mid-request.
+"""
+import fcntl
+import os
+from pathlib import Path
+from typing import Callable, Optional
+from flask import g, request
+
+
+class SlotSemaphore:
+    """A counting semaphore made of ``slots`` lock files in ``directory``."""
+
+    def __init__(self, directory: str, slots: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.paths = [str(self.directory / f'slot-{i}.lock') for i in range(slots)]
+
+    def try_acquire(self) -> Optional[int]:
+        """Lock a free slot without waiting; returns its descriptor, or None if all are taken."""
+        # Start at a different slot in each process to spread the probing
+        offset = os.getpid() % len(self.paths) if self.paths else 0
+        for i in range(len(self.paths)):
+            fd = os.open(self.paths[(offset + i) % len(self.paths)], os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    @staticmethod
+    def release(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def is_large_post(min_bytes: int) -> Callable[[], bool]:
+    """Classify POSTs whose declared body exceeds ``min_bytes`` as heavy.
+
+    Decided from the headers alone, before the body is read, so a rejected
+    upload costs almost nothing. A multipart POST without ``Content-Length``
+    (a chunked upload) has no declared size and may carry any amount of
+    media, so it is heavy too.
+    """
+    def check() -> bool:
+        if request.method != 'POST':
+            return False
+        if request.content_length is None:
+            return request.mimetype == 'multipart/form-data'
+        return request.content_length > min_bytes
+    return check
+
+
+def init_admission(app, directory: str, slots: int, is_heavy: Callable[[], bool],
+                   retry_after: int = 10, reject: Optional[Callable] = None,
+                   on_reject: Optional[Callable[[], None]] = None) -> SlotSemaphore:
+    """Admit at most ``slots`` heavy requests at a time across workers.
+
+    ``reject(retry_after)`` builds the response for turned-away requests (a
+    plain-text 503 by default); ``on_reject`` is called for each of them,
+    e.g. to count it. The check runs before the app's other request hooks
+    so a rejected request does not use up a rate limit.
+    """
+    semaphore = SlotSemaphore(directory, slots)
+
+    def admit():
+        if not is_heavy():
+            return None
+        fd = semaphore.try_acquire()
+        if fd is None:
+            if on_reject:
+                on_reject()
+            if reject:
+                response = app.make_response(reject(retry_after))
+            else:
+                response = app.response_class('Server busy, please retry shortly\n', status=503,
+                                              mimetype='text/plain')
+            response.headers['Retry-After'] = str(retry_after)
+            return response
+        g.admission_slot = fd
+        return None
+
+    def release(exc):
+        fd = g.pop('admission_slot', None)
+        if fd is not None:
+            semaphore.release(fd)
+
+    app.before_request_funcs.setdefault(None, []).insert(0, admit)
+    app.teardown_request(release)
+    return semaphore
@@ -0,0 +1,62 @@
+"""Small in-process caches shared by the services."""
+import os
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+
+class TTLCache:
+    """Thread-safe key/value cache whose entries expire after a fixed time.
+    
+    Entries are per process: apps running in the same process share them,
+    separate processes converge once the TTL has elapsed. With ``max_size``,
+    expired entries are purged when the cache is full, and then the oldest
+    ones are evicted.
+    """
+    
+    def __init__(self, ttl: float = 30.0, max_size: Optional[int] = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = {}
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a cached value, or ``default`` if missing or expired."""
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+    
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store a value."""
+        with self._lock:
+            # Re-inserted so the dict stays ordered oldest first
+            self._data.pop(key, None)
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            if self.max_size is not None and len(self._data) > self.max_size:
+                now = time.monotonic()
+                for expired in [k for k, (expires, _) in self._data.items() if expires < now]:
+                    del self._data[expired]
+                while len(self._data) > self.max_size:
+                    del self._data[next(iter(self._data))]
+    
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """Return a cached value, computing and storing it when missing."""
+        entry = self._data.get(key)
+        if entry is not None and entry[0] >= time.monotonic():
+            return entry[1]
+        value = factory()
+        self.set(key, value)
+        return value
+    
+    def invalidate(self, key: Hashable = None) -> None:
+        """Drop one entry, or everything when no key is given."""
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+
+# Application settings rarely change and are read on every form view
+settings_cache = TTLCache(ttl=float(os.getenv('SETTINGS_CACHE_TTL', '30')))
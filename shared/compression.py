@@ -0,0 +1,141 @@
+"""Response compression (gzip, and brotli when installed) for the Flask apps.
+
+Text responses are compressed with the best encoding the client accepts.
+Compressing is much slower than hashing, and the same bodies (the card's
+message list, the cover page) are sent over and over, so compressed bodies
+are kept in a small LRU cache keyed by a hash of the uncompressed body.
+Streamed responses are compressed chunk by chunk as they are sent.
+"""
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Iterable, Iterator, Optional
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional
+    brotli = None
+
+GZIP_LEVEL = 6
+# Brotli's higher qualities are meant for static assets; 5 compresses better
+# than gzip at a similar speed
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/javascript', 'application/xml',
+    'application/manifest+json', 'image/svg+xml',
+}
+
+
+class _Compressor:
+    """Incremental compressor with a common interface for both encodings."""
+
+    def __init__(self, encoding: str):
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress = self._compressor.process
+            self.flush = self._compressor.finish
+        else:
+            # wbits=31 writes a gzip header and trailer
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress = self._compressor.compress
+            self.flush = self._compressor.flush
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress a whole body with ``encoding`` ('br' or 'gzip')."""
+    compressor = _Compressor(encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    """Compress a streamed body as it is produced."""
+    compressor = _Compressor(encoding)
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close:
+            close()
+
+
+class CompressedBodyCache:
+    """LRU cache of compressed bodies, bounded by their total size."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_or_compress(self, data: bytes, encoding: str) -> bytes:
+        key = (encoding, hashlib.blake2b(data, digest_size=16).digest())
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                return body
+        body = compress(data, encoding)
+        if len(body) <= self.max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = body
+                    self._size += len(body)
+                    while self._size > self.max_bytes:
+                        _, evicted = self._entries.popitem(last=False)
+                        self._size -= len(evicted)
+        return body
+
+
+def _is_compressible(response) -> bool:
+    mimetype = response.mimetype or ''
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def _choose_encoding() -> Optional[str]:
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    # Ties go to the first offered encoding, i.e. brotli
+    return request.accept_encodings.best_match(offered)
+
+
+def init_compression(app, min_size: int = 500, cache_bytes: int = 8 * 1024 * 1024) -> CompressedBodyCache:
+    """Compress text responses of an app according to ``Accept-Encoding``.
+
+    Bodies smaller than ``min_size`` bytes are sent as they are. Call
+    before registering other ``after_request`` hooks so compression runs
+    after them, on the final body.
+    """
+    cache = CompressedBodyCache(cache_bytes)
+
+    def compress_response(response):
+        if (response.direct_passthrough or response.status_code < 200
+                or response.status_code in (204, 206, 304)
+                or 'Content-Encoding' in response.headers
+                or 'no-transform' in response.headers.get('Cache-Control', '')
+                or not _is_compressible(response)):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = _choose_encoding()
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(cache.get_or_compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    app.after_request(compress_response)
+    return cache
@@ -0,0 +1,162 @@
+"""Prometheus metrics shared by the services.
+
+When ``PROMETHEUS_MULTIPROC_DIR`` is set (the gunicorn configs set it), each
+worker records samples in memory-mapped files in that directory and
+``/metrics`` aggregates all of them, so any worker can answer a scrape.
+Without it the default in-process registry is used, which is what the
+development servers and tests get.
+
+``/metrics`` only answers requests carrying ``Authorization: Bearer
+<METRICS_TOKEN>``; without a token it is not served at all.
+"""
+import hmac
+import os
+import time
+from contextlib import contextmanager
+from flask import Response, abort, current_app, g, has_app_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+from shared.statement_timing import time_statements
+
+REQUEST_LATENCY = Histogram(
+    'collation_http_request_duration_seconds',
+    'HTTP request latency by route',
+    ['service', 'method', 'route', 'status'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'collation_http_requests_in_progress',
+    'HTTP requests currently being handled',
+    ['service'],
+    multiprocess_mode='livesum'
+)
+DB_QUERY_DURATION = Histogram(
+    'collation_db_query_duration_seconds',
+    'Duration of SQL statements (the _count is the number of queries)',
+    ['service'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1)
+)
+MEDIA_PROCESSING = Histogram(
+    'collation_media_processing_seconds',
+    'Time spent validating, converting and storing uploaded media',
+    ['media_type', 'outcome'],
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+)
+UPLOAD_BYTES = Histogram(
+    'collation_upload_bytes',
+    'Size of uploaded media files',
+    ['media_type'],
+    buckets=(64 * 1024, 256 * 1024, 1024 ** 2, 5 * 1024 ** 2, 20 * 1024 ** 2, 50 * 1024 ** 2)
+)
+RATELIMIT_REJECTIONS = Counter(
+    'collation_ratelimit_rejections_total',
+    'Requests rejected by the rate limiter',
+    ['service', 'route']
+)
+ADMISSION_REJECTIONS = Counter(
+    'collation_admission_rejections_total',
+    'Heavy requests turned away because all processing slots were busy',
+    ['service', 'route']
+)
+
+
+def _service() -> str:
+    if has_app_context():
+        return current_app.config.get('SERVICE_NAME', 'unknown')
+    return 'none'
+
+
+def _route() -> str:
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def _observe_statement(statement, parameters, executemany, seconds):
+    DB_QUERY_DURATION.labels(_service()).observe(seconds)
+
+
+def instrument_engine(engine) -> None:
+    """Time every SQL statement run on ``engine`` (idempotent)."""
+    time_statements(engine, _observe_statement)
+
+
+@contextmanager
+def track_media(media_type: str, size: int):
+    """Record upload size and processing time of one media file.
+
+    The outcome is ``ok``, ``invalid`` when the processor rejects the file
+    (``ValueError``) or ``error`` for anything else.
+    """
+    UPLOAD_BYTES.labels(media_type).observe(size)
+    outcome = 'error'
+    started = time.perf_counter()
+    try:
+        yield
+        outcome = 'ok'
+    except ValueError:
+        outcome = 'invalid'
+        raise
+    finally:
+        MEDIA_PROCESSING.labels(media_type, outcome).observe(time.perf_counter() - started)
+
+
+def record_ratelimit_rejection(limit) -> None:
+    """Flask-Limiter ``on_breach`` callback."""
+    RATELIMIT_REJECTIONS.labels(_service(), _route()).inc()
+
+
+def record_admission_rejection() -> None:
+    """``init_admission`` ``on_reject`` callback."""
+    ADMISSION_REJECTIONS.labels(_service(), _route()).inc()
+
+
+def metrics_registry() -> CollectorRegistry:
+    """Registry to expose: all workers' samples in multiprocess mode."""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def init_metrics(app, service: str, engine, token: str = '') -> None:
+    """Collect request and query metrics for an app, and serve them at
+    ``/metrics`` to scrapers presenting ``token``."""
+    app.config['SERVICE_NAME'] = service
+    instrument_engine(engine)
+
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        REQUESTS_IN_PROGRESS.labels(service).inc()
+
+    def remember_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    def observe_request(exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        REQUESTS_IN_PROGRESS.labels(service).dec()
+        REQUEST_LATENCY.labels(
+            service, request.method, _route(), str(g.pop('metrics_status', 500))
+        ).observe(time.perf_counter() - started)
+
+    # Run before any other hook (e.g. the rate limiter) so rejected
+    # requests are timed too
+    app.before_request_funcs.setdefault(None, []).insert(0, start_timer)
+    app.after_request(remember_status)
+    app.teardown_request(observe_request)
+
+    if not token:
+        return
+    expected = f'Bearer {token}'.encode()
+
+    def metrics():
+        header = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(header.encode(), expected):
+            abort(401)
+        return Response(generate_latest(metrics_registry()), mimetype=CONTENT_TYPE_LATEST)
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
@@ -1,18 +1,54 @@
 """Shared database models."""
+import fcntl
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, Boolean
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, DateTime, Text, Boolean, Index, ForeignKey
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from shared.utils.order_keys import OrderKey
 
 Base = declarative_base()
 
+# Rows created before multi-tenancy, and single-card deployments, use card 0
+DEFAULT_CARD_ID = 0
+
+
+class Card(Base):
+    """A card (tenant) hosted by the deployment."""
+    __tablename__ = 'cards'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    slug = Column(String(100), unique=True, nullable=False)
+    host = Column(String(255), unique=True, nullable=True)
+    name = Column(String(255), nullable=True)
+    is_active = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    def to_dict(self):
+        """Convert to dictionary."""
+        return {
+            'id': self.id,
+            'slug': self.slug,
+            'host': self.host,
+            'name': self.name,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
 
 class Message(Base):
     """Message submission model."""
     __tablename__ = 'messages'
+    __table_args__ = (
+        Index('ix_messages_card_status_created', 'card_id', 'status', 'created_at'),
+        Index('ix_messages_card_status_approved', 'card_id', 'status', 'approved_at'),
+        Index('ix_messages_card_idempotency', 'card_id', 'idempotency_key', unique=True),
+        Index('ix_messages_card_status_order', 'card_id', 'status', 'order_key'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    card_id = Column(Integer, default=DEFAULT_CARD_ID, server_default='0', nullable=False)
     uuid = Column(String(36), unique=True, nullable=False)
     name = Column(String(255), nullable=False)
     initials = Column(String(5), nullable=False)
@@ -20,18 +56,34 @@ class Message(Base):
     image_path = Column(String(500), nullable=True)
     video_path = Column(String(500), nullable=True)
     thumb_path = Column(String(500), nullable=True)
+    # Muted preview clip and poster of a video (see VideoProcessor)
+    preview_path = Column(String(500), nullable=True)
+    poster_path = Column(String(500), nullable=True)
     media_type = Column(String(20), nullable=True) # 'image' or 'video'
+    # Intrinsic media size and BlurHash, so clients can lay out and paint
+    # a placeholder before the media loads
+    media_width = Column(Integer, nullable=True)
+    media_height = Column(Integer, nullable=True)
+    placeholder = Column(String(100), nullable=True)
     status = Column(String(20), default='pending', nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     approved_at = Column(DateTime, nullable=True)
     ip_address = Column(String(45), nullable=True)
     color_hint = Column(String(20), nullable=True)
     order_index = Column(Integer, nullable=True)
+    # Position on the card (see shared/utils/order_keys.py); set when the
+    # message is approved and cleared when it leaves the card
+    order_key = Column(String(64), nullable=True)
+    # Sent by the submit form so a retried POST finds the message it created
+    idempotency_key = Column(String(64), nullable=True)
+    # SHA-256 of the submitted form, so a key reused for other content is refused
+    idempotency_hash = Column(String(64), nullable=True)
     
     def to_dict(self):
         """Convert to dictionary."""
         return {
             'id': self.id,
+            'card_id': self.card_id,
             'uuid': self.uuid,
             'name': self.name,
             'initials': self.initials,
@@ -39,20 +91,69 @@ class Message(Base):
             'image_path': self.image_path,
             'video_path': self.video_path,
             'thumb_path': self.thumb_path,
+            'preview_path': self.preview_path,
+            'poster_path': self.poster_path,
             'media_type': self.media_type,
+            'media_width': self.media_width,
+            'media_height': self.media_height,
+            'placeholder': self.placeholder,
             'status': self.status,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'approved_at': self.approved_at.isoformat() if self.approved_at else None,
             'color_hint': self.color_hint,
-            'order_index': self.order_index
+            'order_index': self.order_index,
+            'order_key': self.order_key
+        }
+
+
+class MessageAttachment(Base):
+    """One media file of a message, in the order it was attached.
+    
+    The first attachment is also stored in the message's own media columns,
+    which are all that messages from before attachments have.
+    """
+    __tablename__ = 'message_attachments'
+    __table_args__ = (
+        Index('ix_message_attachments_message_position', 'message_id', 'position'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    message_id = Column(Integer, ForeignKey('messages.id', ondelete='CASCADE'), nullable=False)
+    card_id = Column(Integer, default=DEFAULT_CARD_ID, server_default='0', nullable=False)
+    position = Column(Integer, nullable=False)
+    media_type = Column(String(20), nullable=False) # 'image' or 'video'
+    path = Column(String(500), nullable=False)
+    thumb_path = Column(String(500), nullable=True)
+    preview_path = Column(String(500), nullable=True)
+    poster_path = Column(String(500), nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    placeholder = Column(String(100), nullable=True)
+    
+    def to_dict(self):
+        """Convert to dictionary."""
+        return {
+            'position': self.position,
+            'media_type': self.media_type,
+            'path': self.path,
+            'thumb_path': self.thumb_path,
+            'preview_path': self.preview_path,
+            'poster_path': self.poster_path,
+            'width': self.width,
+            'height': self.height,
+            'placeholder': self.placeholder
         }
 
 
 class InviteLink(Base):
     """Invite link token model."""
     __tablename__ = 'invite_links'
+    __table_args__ = (
+        Index('ix_invite_links_card_created', 'card_id', 'created_at'),
+    )
     
     token = Column(String(64), primary_key=True)
+    card_id = Column(Integer, default=DEFAULT_CARD_ID, server_default='0', nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     expires_at = Column(DateTime, nullable=True)
     max_uses = Column(Integer, nullable=True)
@@ -64,6 +165,7 @@ class InviteLink(Base):
         """Convert to dictionary."""
         return {
             'token': self.token,
+            'card_id': self.card_id,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'expires_at': self.expires_at.isoformat() if self.expires_at else None,
             'max_uses': self.max_uses,
@@ -73,12 +175,60 @@ class InviteLink(Base):
         }
 
 
+class ArchivedMessage(Base):
+    """A message moved out of ``messages`` by the retention job.
+    
+    Keeps the text for the record; media files and the IP address are not
+    kept. ``id`` is the id the message had.
+    """
+    __tablename__ = 'archived_messages'
+    __table_args__ = (
+        Index('ix_archived_messages_card_archived', 'card_id', 'archived_at'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    card_id = Column(Integer, default=DEFAULT_CARD_ID, server_default='0', nullable=False)
+    uuid = Column(String(36), nullable=False)
+    name = Column(String(255), nullable=False)
+    initials = Column(String(5), nullable=False)
+    content = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    approved_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ArchivedInviteLink(Base):
+    """An expired or deactivated invite link moved out of ``invite_links``."""
+    __tablename__ = 'archived_invite_links'
+    __table_args__ = (
+        Index('ix_archived_invite_links_card_archived', 'card_id', 'archived_at'),
+    )
+    
+    token = Column(String(64), primary_key=True)
+    card_id = Column(Integer, default=DEFAULT_CARD_ID, server_default='0', nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=True)
+    max_uses = Column(Integer, nullable=True)
+    uses_count = Column(Integer, default=0, nullable=False)
+    is_active = Column(Boolean, nullable=False)
+    note = Column(String(500), nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
 class CardCover(Base):
     """Card cover image model."""
     __tablename__ = 'card_covers'
+    __table_args__ = (
+        Index('ix_card_covers_card_active', 'card_id', 'is_active'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
+    card_id = Column(Integer, default=DEFAULT_CARD_ID, server_default='0', nullable=False)
     image_path = Column(String(500), nullable=False)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    placeholder = Column(String(100), nullable=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     is_active = Column(Boolean, default=True, nullable=False)
 
@@ -87,6 +237,7 @@ class Settings(Base):
     """Application settings model."""
     __tablename__ = 'settings'
     
+    card_id = Column(Integer, primary_key=True, default=DEFAULT_CARD_ID, server_default='0')
     key = Column(String(100), primary_key=True)
     value = Column(Text, nullable=True)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
@@ -94,15 +245,219 @@ class Settings(Base):
     def to_dict(self):
         """Convert to dictionary."""
         return {
+            'card_id': self.card_id,
             'key': self.key,
             'value': self.value,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
 
+class SchemaInfo(Base):
+    """Schema version marker, so workers can skip schema setup."""
+    __tablename__ = 'schema_info'
+    
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+# Tables that gained a card_id column with multi-tenancy
+TENANT_TABLES = ('messages', 'invite_links', 'card_covers', 'settings')
+
+
+def _baseline(conn):
+    """Version 1: tables as created by ``create_all``."""
+
+
+def _add_card_ids(conn):
+    """Version 2: scope rows by card (multi-tenancy)."""
+    inspector = inspect(conn)
+    for table_name in TENANT_TABLES:
+        columns = {c['name'] for c in inspector.get_columns(table_name)}
+        if 'card_id' in columns:
+            continue
+        if table_name == 'settings':
+            # The primary key changes from (key) to (card_id, key)
+            conn.execute(text('ALTER TABLE settings RENAME TO settings_old'))
+            Settings.__table__.create(conn)
+            conn.execute(text(
+                'INSERT INTO settings (card_id, key, value, updated_at) '
+                'SELECT 0, key, value, updated_at FROM settings_old'
+            ))
+            conn.execute(text('DROP TABLE settings_old'))
+        else:
+            conn.execute(text(
+                f'ALTER TABLE {table_name} ADD COLUMN card_id INTEGER NOT NULL DEFAULT 0'
+            ))
+
+
+# Columns added by version 3, per table
+MEDIA_INFO_COLUMNS = {
+    'messages': {'media_width': 'INTEGER', 'media_height': 'INTEGER', 'placeholder': 'VARCHAR(100)'},
+    'card_covers': {'width': 'INTEGER', 'height': 'INTEGER', 'placeholder': 'VARCHAR(100)'},
+}
+
+
+def _add_media_info(conn):
+    """Version 3: media dimensions and BlurHash placeholders."""
+    inspector = inspect(conn)
+    for table_name, new_columns in MEDIA_INFO_COLUMNS.items():
+        columns = {c['name'] for c in inspector.get_columns(table_name)}
+        for name, type_ in new_columns.items():
+            if name not in columns:
+                conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {name} {type_}'))
+
+
+def _add_idempotency_keys(conn):
+    """Version 4: idempotency keys of submissions (the index is created afterwards)."""
+    columns = {c['name'] for c in inspect(conn).get_columns('messages')}
+    if 'idempotency_key' not in columns:
+        conn.execute(text('ALTER TABLE messages ADD COLUMN idempotency_key VARCHAR(64)'))
+
+
+def _add_message_attachments(conn):
+    """Version 5: the message_attachments table (created by ``create_all``)."""
+
+
+def _add_archive_tables(conn):
+    """Version 6: archive tables of the retention job (created by ``create_all``)."""
+
+
+def _add_order_keys(conn):
+    """Version 7: manual card order, starting from the creation order."""
+    columns = {c['name'] for c in inspect(conn).get_columns('messages')}
+    if 'order_key' not in columns:
+        conn.execute(text('ALTER TABLE messages ADD COLUMN order_key VARCHAR(64)'))
+    card_ids = conn.execute(text(
+        "SELECT DISTINCT card_id FROM messages WHERE status = 'approved' AND order_key IS NULL"
+    )).scalars().all()
+    for card_id in card_ids:
+        ids = conn.execute(text(
+            "SELECT id FROM messages WHERE card_id = :card_id AND status = 'approved' "
+            "ORDER BY created_at, id"
+        ), {'card_id': card_id}).scalars().all()
+        conn.execute(text('UPDATE messages SET order_key = :key WHERE id = :id'), [
+            {'id': message_id, 'key': key} for message_id, key in zip(ids, OrderKey.spread(len(ids)))
+        ])
+
+
+# Columns added by version 8, per table
+VIDEO_PREVIEW_COLUMNS = {
+    'messages': {'preview_path': 'VARCHAR(500)', 'poster_path': 'VARCHAR(500)'},
+    'message_attachments': {'preview_path': 'VARCHAR(500)', 'poster_path': 'VARCHAR(500)'},
+}
+
+
+def _add_video_previews(conn):
+    """Version 8: preview clips and posters of videos."""
+    inspector = inspect(conn)
+    for table_name, new_columns in VIDEO_PREVIEW_COLUMNS.items():
+        columns = {c['name'] for c in inspector.get_columns(table_name)}
+        for name, type_ in new_columns.items():
+            if name not in columns:
+                conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {name} {type_}'))
+
+
+def _add_idempotency_hashes(conn):
+    """Version 9: hashes of the submissions idempotency keys were sent with."""
+    columns = {c['name'] for c in inspect(conn).get_columns('messages')}
+    if 'idempotency_hash' not in columns:
+        conn.execute(text('ALTER TABLE messages ADD COLUMN idempotency_hash VARCHAR(64)'))
+
+
+# Ordered (version, step) pairs. Missing tables and indexes are created by
+# ``create_all`` before the steps run, so steps only alter existing tables
+# and must be safe to run against a database that already has the change.
+MIGRATIONS = [
+    (1, _baseline),
+    (2, _add_card_ids),
+    (3, _add_media_info),
+    (4, _add_idempotency_keys),
+    (5, _add_message_attachments),
+    (6, _add_archive_tables),
+    (7, _add_order_keys),
+    (8, _add_video_previews),
+    (9, _add_idempotency_hashes),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Engines and session factories are shared by every app in the process
+_databases = {}
+
+
+def _schema_version(conn) -> int:
+    """Read the schema version of a database (0 if never recorded)."""
+    if not inspect(conn).has_table(SchemaInfo.__tablename__):
+        return 0
+    return conn.execute(text('SELECT version FROM schema_info WHERE id = 1')).scalar() or 0
+
+
+@contextmanager
+def _schema_lock(engine):
+    """Serialize schema changes between processes sharing a SQLite file."""
+    database = engine.url.database
+    if engine.dialect.name != 'sqlite' or not database or database == ':memory:':
+        yield
+        return
+    with open(f"{database}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def ensure_schema(engine):
+    """Create or upgrade the schema unless it is already current.
+    
+    The common case is a single version read; only the first process to see
+    an outdated schema takes the lock and applies the migrations.
+    """
+    with engine.connect() as conn:
+        if _schema_version(conn) >= SCHEMA_VERSION:
+            return
+    with _schema_lock(engine):
+        with engine.begin() as conn:
+            version = _schema_version(conn)
+            if version >= SCHEMA_VERSION:
+                return
+            if version == 0 and engine.dialect.name == 'sqlite':
+                # Lets the retention job return free pages to the file
+                # without a full VACUUM; only takes effect on an empty file
+                conn.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+            Base.metadata.create_all(conn)
+            for step_version, step in MIGRATIONS:
+                if step_version > version:
+                    step(conn)
+            # create_all only adds indexes together with new tables
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+            conn.execute(text('DELETE FROM schema_info'))
+            conn.execute(
+                text('INSERT INTO schema_info (id, version) VALUES (1, :version)'),
+                {'version': SCHEMA_VERSION}
+            )
+
+
 def init_db(database_url: str):
-    """Initialize database and return session factory."""
-    engine = create_engine(database_url, echo=False)
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    return Session, engine
+    """Initialize database and return session factory.
+    
+    Apps that share a process (e.g. the combined deployment) get the same
+    engine and connection pool for the same database URL.
+    """
+    if database_url not in _databases:
+        engine = create_engine(database_url, echo=False)
+        ensure_schema(engine)
+        Session = sessionmaker(bind=engine)
+        _databases[database_url] = (Session, engine)
+    return _databases[database_url]
+
+
+def dispose_engines():
+    """Forget pooled connections inherited from a parent process.
+    
+    Call in each worker after fork so workers never share a connection;
+    the parent's connections are left open for the parent.
+    """
+    for Session, engine in _databases.values():
+        engine.dispose(close=False)
@@ -0,0 +1,189 @@
+"""On-demand profiling of individual production requests.
+
+A request is profiled when it carries ``X-Profile: <PROFILE_SECRET>`` or is
+picked by ``PROFILE_SAMPLE_RATE``. Two modes are available:
+
+    sampler:  a background thread samples the request thread's stack every
+              few milliseconds and writes folded stacks (``.folded``), the
+              input format of flamegraph.pl, speedscope and inferno
+    cprofile: deterministic ``cProfile`` output (``.prof``) for pstats,
+              snakeviz or flameprof
+
+Profiles are written to ``PROFILE_DIR`` and only the newest
+``PROFILE_MAX_FILES`` are kept. At most one request per app and process is
+profiled at a time, and when profiling is not configured the middleware is not
+installed at all.
+"""
+import cProfile
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from werkzeug.wsgi import ClosingIterator
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+
+class StackSampler:
+    """Sample one thread's Python stack at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{_short_path(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path: str) -> None:
+        """Write stacks in the folded format, one ``stack count`` per line."""
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _short_path(filename: str) -> str:
+    """Keep the last two path components so frames stay readable."""
+    parts = filename.replace('\\', '/').rsplit('/', 2)
+    return '/'.join(parts[-2:])
+
+
+class ProfilingMiddleware:
+    """WSGI middleware profiling selected requests into a bounded directory."""
+
+    MODES = ('sampler', 'cprofile')
+
+    def __init__(self, wsgi_app, service: str, directory: str, secret: str = '',
+                 sample_rate: float = 0.0, mode: str = 'sampler', max_files: int = 100,
+                 interval: float = 0.005):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.wsgi_app = wsgi_app
+        self.service = service
+        self.directory = directory
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.max_files = max_files
+        self.interval = interval
+        self._busy = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        requested = self._requested(environ)
+        sampled = requested or (self.sample_rate > 0 and random.random() < self.sample_rate)
+        if not sampled or not self._busy.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+
+        name = self._profile_name(environ)
+
+        def start_profiled_response(status, headers, exc_info=None):
+            if requested:
+                headers = list(headers) + [(PROFILE_ID_HEADER, name)]
+            return start_response(status, headers, exc_info)
+
+        profiler = self._start()
+        if profiler is None:
+            self._busy.release()
+            return self.wsgi_app(environ, start_response)
+        try:
+            app_iter = self.wsgi_app(environ, start_profiled_response)
+        except BaseException:
+            self._finish(profiler, name)
+            raise
+        # Streamed bodies are part of the request: stop once they are closed
+        return ClosingIterator(app_iter, lambda: self._finish(profiler, name))
+
+    def _requested(self, environ) -> bool:
+        """Whether the request carries the profiling secret."""
+        header = environ.get('HTTP_X_PROFILE')
+        return bool(header and self.secret and hmac.compare_digest(header.encode(), self.secret.encode()))
+
+    def _profile_name(self, environ) -> str:
+        path = re.sub(r'[^A-Za-z0-9]+', '_', environ.get('PATH_INFO', '')).strip('_')[:60] or 'root'
+        ext = 'folded' if self.mode == 'sampler' else 'prof'
+        now = time.time()
+        # UTC with microseconds keeps names in creation order for _rotate,
+        # also across DST changes
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime(now)) + f'.{int(now % 1 * 1e6):06d}Z'
+        return (f"{stamp}-{self.service}-"
+                f"{environ.get('REQUEST_METHOD', 'GET')}-{path}-{uuid.uuid4().hex[:8]}.{ext}")
+
+    def _start(self):
+        if self.mode == 'sampler':
+            sampler = StackSampler(threading.get_ident(), self.interval)
+            sampler.start()
+            return sampler
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active in this interpreter
+            return None
+        return profiler
+
+    def _finish(self, profiler, name: str) -> None:
+        try:
+            path = os.path.join(self.directory, name)
+            if isinstance(profiler, StackSampler):
+                profiler.stop()
+                profiler.write(path)
+            else:
+                profiler.disable()
+                profiler.dump_stats(path)
+            self._rotate()
+        except OSError:
+            pass
+        finally:
+            self._busy.release()
+
+    def _rotate(self) -> None:
+        """Delete the oldest profiles beyond ``max_files``."""
+        entries = [e for e in os.scandir(self.directory)
+                   if e.is_file() and e.name.endswith(('.folded', '.prof'))]
+        if len(entries) <= self.max_files:
+            return
+        # By name, which starts with the creation time: file mtimes are too
+        # coarse to order profiles written in quick succession
+        entries.sort(key=lambda e: e.name)
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def init_profiling(app, service: str, directory: str, secret: str = '', sample_rate: float = 0.0,
+                   mode: str = 'sampler', max_files: int = 100) -> None:
+    """Install request profiling on a Flask app.
+
+    Call before tenancy and ProxyFix so the profile covers the app itself.
+    """
+    app.wsgi_app = ProfilingMiddleware(
+        app.wsgi_app, service, directory, secret=secret, sample_rate=sample_rate,
+        mode=mode, max_files=max_files
+    )
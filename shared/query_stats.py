@@ -0,0 +1,118 @@
+"""Per-request SQL statistics for finding slow queries and N+1 patterns.
+
+Opt-in with ``SQL_INSTRUMENTATION=true``. While a request is handled every
+statement executed on the engine is counted and timed; statements slower
+than ``SQL_SLOW_QUERY_MS`` are logged with the shape of their parameters
+(types only, never values), and statements executed ``SQL_REPEAT_THRESHOLD``
+times or more within one request are reported as likely N+1 queries. In
+debug mode the totals are also returned as response headers.
+"""
+import logging
+from collections import Counter
+from contextvars import ContextVar
+from typing import Optional
+from flask import current_app, request
+from shared.statement_timing import time_statements
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_HEADER = 'X-DB-Query-Count'
+QUERY_TIME_HEADER = 'X-DB-Query-Time-Ms'
+
+_TOKEN_KEY = 'collation.query_stats'
+
+_current: ContextVar[Optional['QueryStats']] = ContextVar('query_stats', default=None)
+
+
+class QueryStats:
+    """Statements executed during one request."""
+
+    def __init__(self, slow_query_ms: float = 100.0):
+        self.slow_query_seconds = slow_query_ms / 1000.0
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self, threshold: int):
+        """Statements executed at least ``threshold`` times, most frequent first."""
+        return [(s, n) for s, n in self.statements.most_common() if n >= threshold]
+
+
+def parameter_shape(parameters, executemany: bool = False) -> str:
+    """Describe bound parameters by type so they can be logged safely."""
+    if executemany:
+        rows = list(parameters)
+        return f"{len(rows)} x {parameter_shape(rows[0]) if rows else '()'}"
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(type(v).__name__ for v in parameters) + ')'
+    return type(parameters).__name__
+
+
+def current_stats() -> Optional[QueryStats]:
+    """Statistics of the request being handled, if instrumentation is on."""
+    return _current.get()
+
+
+def _observe_statement(statement, parameters, executemany, elapsed):
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.record(statement, elapsed)
+    if elapsed >= stats.slow_query_seconds:
+        logger.warning(
+            "Slow query (%.1f ms) in %s %s: %s params=%s",
+            elapsed * 1000, request.method, request.path,
+            ' '.join(statement.split()), parameter_shape(parameters, executemany)
+        )
+
+
+def instrument_engine(engine) -> None:
+    """Record statements run on ``engine`` (idempotent).
+
+    Engines are shared by apps running in one process, so the observer is
+    module level and records into whichever request is current.
+    """
+    time_statements(engine, _observe_statement)
+
+
+def init_query_stats(app, engine, slow_query_ms: float = 100.0, repeat_threshold: int = 3) -> None:
+    """Collect per-request SQL statistics for an app."""
+    instrument_engine(engine)
+
+    def start():
+        request.environ[_TOKEN_KEY] = _current.set(QueryStats(slow_query_ms))
+
+    def report(response):
+        stats = _current.get()
+        if stats is None:
+            return response
+        for statement, times in stats.repeated(repeat_threshold):
+            logger.warning(
+                "Possible N+1: statement ran %d times in %s %s: %s",
+                times, request.method, request.path, ' '.join(statement.split())
+            )
+        if current_app.debug:
+            response.headers[QUERY_COUNT_HEADER] = str(stats.count)
+            response.headers[QUERY_TIME_HEADER] = f"{stats.seconds * 1000:.2f}"
+        return response
+
+    def finish(exc):
+        token = request.environ.pop(_TOKEN_KEY, None)
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Streamed responses may finish in another context
+                _current.set(None)
+
+    # Run first so queries made by other before_request hooks are counted
+    app.before_request_funcs.setdefault(None, []).insert(0, start)
+    app.after_request(report)
+    app.teardown_request(finish)
@@ -0,0 +1,41 @@
+"""One engine hook timing every SQL statement, shared by metrics and query stats.
+
+The start time is kept on the statement's execution context rather than on
+the connection, so a statement that raises (and never reaches
+``after_cursor_execute``) leaves nothing behind for the next one to pair
+with.
+"""
+import time
+import weakref
+from typing import Callable
+from sqlalchemy import event
+
+# Observers per engine, called as observer(statement, parameters, executemany, seconds)
+_observers = weakref.WeakKeyDictionary()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._statement_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_statement_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    for observer in _observers.get(conn.engine, ()):
+        observer(statement, parameters, executemany, elapsed)
+
+
+def time_statements(engine, observer: Callable) -> None:
+    """Call ``observer`` with the duration of every statement run on ``engine``.
+
+    Each observer is added once per engine, however often this is called.
+    """
+    observers = _observers.setdefault(engine, [])
+    if observer not in observers:
+        observers.append(observer)
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
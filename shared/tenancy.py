@@ -0,0 +1,145 @@
+"""Resolve which card (tenant) a request belongs to."""
+import os
+from typing import Optional
+from flask import request
+from sqlalchemy import or_, select
+from werkzeug.exceptions import NotFound
+from shared.cache import TTLCache
+from shared.models import Card, CardCover, Message, MessageAttachment, DEFAULT_CARD_ID
+
+CARD_ID_KEY = 'collation.card_id'
+TENANCY_KEY = 'collation.tenancy'
+
+# How long a resolved card is trusted before it is looked up again
+CACHE_TTL = float(os.getenv('TENANT_CACHE_TTL', '10'))
+CACHE_SIZE = 1000
+MEDIA_CACHE_SIZE = 10000
+
+
+class TenantMiddleware:
+    """WSGI middleware that tags each request with its card id.
+
+    Modes:
+        single: every request belongs to the default card (no lookups)
+        host:   the card is looked up by the request's host name
+        path:   the first path segment is the card's slug; it is moved from
+                PATH_INFO to SCRIPT_NAME so the app's routes are unchanged
+
+    Found cards are cached per host/slug for ``cache_ttl`` seconds, so
+    resolving a tenant costs a dict hit. Misses are not cached: a new card
+    is served at once, and unknown hosts cannot grow the cache.
+    """
+
+    MODES = ('single', 'host', 'path')
+
+    # Infrastructure endpoints that are not scoped to a card
+    EXEMPT_PATHS = ('/health', '/metrics')
+
+    def __init__(self, wsgi_app, Session, mode: str = 'single', cache_ttl: float = CACHE_TTL):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown tenant mode: {mode}")
+        self.wsgi_app = wsgi_app
+        self.Session = Session
+        self.mode = mode
+        self.cache = TTLCache(ttl=cache_ttl, max_size=CACHE_SIZE)
+        # (card id, media path) pairs known to belong together
+        self.media_cache = TTLCache(ttl=cache_ttl, max_size=MEDIA_CACHE_SIZE)
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        environ[TENANCY_KEY] = self
+        if self.mode == 'single' or path in self.EXEMPT_PATHS:
+            environ[CARD_ID_KEY] = DEFAULT_CARD_ID
+            return self.wsgi_app(environ, start_response)
+
+        if self.mode == 'host':
+            host = environ.get('HTTP_HOST', '').split(':')[0].lower()
+            card_id = self.lookup('host', host)
+        else:
+            slug, _, rest = path.lstrip('/').partition('/')
+            card_id = self.lookup('slug', slug) if slug else None
+            if card_id is not None:
+                environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + '/' + slug
+                environ['PATH_INFO'] = '/' + rest
+
+        if card_id is None:
+            return NotFound()(environ, start_response)
+        environ[CARD_ID_KEY] = card_id
+        return self.wsgi_app(environ, start_response)
+
+    def lookup(self, field: str, value: str) -> Optional[int]:
+        """Find the id of an active card by host or slug."""
+        key = (field, value)
+        card_id = self.cache.get(key)
+        if card_id is not None:
+            return card_id
+
+        column = Card.host if field == 'host' else Card.slug
+        db = self.Session()
+        try:
+            card_id = db.query(Card.id).filter(
+                column == value,
+                Card.is_active == True
+            ).scalar()
+        finally:
+            db.close()
+        if card_id is not None:
+            self.cache.set(key, card_id)
+        return card_id
+    
+    def owns_media(self, card_id: int, filename: str) -> bool:
+        """Whether a media file belongs to a message or cover of a card."""
+        if self.mode == 'single':
+            return True
+        key = (card_id, filename)
+        if self.media_cache.get(key):
+            return True
+        
+        messages = select(Message.id).where(Message.card_id == card_id)
+        db = self.Session()
+        try:
+            owned = (
+                db.query(Message.id).filter(
+                    Message.card_id == card_id,
+                    or_(*(column == filename for column in (
+                        Message.image_path, Message.video_path, Message.thumb_path,
+                        Message.preview_path, Message.poster_path
+                    )))
+                ).first()
+                or db.query(MessageAttachment.id).filter(
+                    MessageAttachment.message_id.in_(messages),
+                    or_(*(column == filename for column in (
+                        MessageAttachment.path, MessageAttachment.thumb_path,
+                        MessageAttachment.preview_path, MessageAttachment.poster_path
+                    )))
+                ).first()
+                or db.query(CardCover.id).filter(
+                    CardCover.card_id == card_id,
+                    CardCover.image_path == filename
+                ).first()
+            ) is not None
+        finally:
+            db.close()
+        if owned:
+            self.media_cache.set(key, True)
+        return owned
+
+
+def init_tenancy(app, Session, mode: str = 'single') -> None:
+    """Install tenant resolution on a Flask app.
+
+    Must be called before ProxyFix is applied so the middleware sees the
+    forwarded host.
+    """
+    app.wsgi_app = TenantMiddleware(app.wsgi_app, Session, mode=mode)
+
+
+def current_card_id() -> int:
+    """Return the card id of the current request."""
+    return request.environ.get(CARD_ID_KEY, DEFAULT_CARD_ID)
+
+
+def current_card_owns_media(filename: str) -> bool:
+    """Whether a media file belongs to the card of the current request."""
+    middleware = request.environ.get(TENANCY_KEY)
+    return middleware is None or middleware.owns_media(current_card_id(), filename)
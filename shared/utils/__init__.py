@@ -1,7 +1,31 @@
-"""Shared utilities."""
-from .image_utils import ImageProcessor
-from .video_utils import VideoProcessor
-from .sanitizer import ContentSanitizer
-from .token_utils import TokenGenerator
+"""Shared utilities.
 
-__all__ = ['ImageProcessor', 'VideoProcessor', 'ContentSanitizer', 'TokenGenerator']
+Utilities are imported on first use so services only pay for the heavy
+libraries (Pillow, python-magic, bleach) they actually need.
+"""
+import importlib
+
+_EXPORTS = {
+    'ImageProcessor': '.image_utils',
+    'VideoProcessor': '.video_utils',
+    'ContentSanitizer': '.sanitizer',
+    'TokenGenerator': '.token_utils',
+    'ZipStreamer': '.zip_stream',
+    'NameFormatter': '.names',
+    'SQLiteLimiterStorage': '.limiter_storage',
+    'BlurHash': '.blurhash',
+    'OrderKey': '.order_keys',
+    'LocalStorage': '.storage',
+    'S3Storage': '.storage',
+    'create_storage': '.storage',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
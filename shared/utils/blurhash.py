@@ -0,0 +1,85 @@
+"""BlurHash placeholders for images."""
+import math
+from typing import List, Tuple
+
+
+class BlurHash:
+    """Encode images as BlurHash strings (https://blurha.sh).
+
+    A hash is ~20-30 characters that a client decodes into a blurred
+    preview, so it can be embedded in API payloads and pages and painted
+    before the real image arrives.
+    """
+
+    CHARACTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+    # Images are reduced to this size first; the hash cannot hold more detail
+    SAMPLE_SIZE = (32, 32)
+
+    _SRGB_TO_LINEAR = [
+        v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+        for v in (i / 255 for i in range(256))
+    ]
+
+    @classmethod
+    def encode(cls, img, x_components: int = 4, y_components: int = 3) -> str:
+        """Encode a PIL image."""
+        from PIL import Image
+        if not (1 <= x_components <= 9 and 1 <= y_components <= 9):
+            raise ValueError("BlurHash components must be between 1 and 9")
+
+        sample = img.convert('RGB')
+        sample.thumbnail(cls.SAMPLE_SIZE, Image.Resampling.BILINEAR)
+        width, height = sample.size
+        to_linear = cls._SRGB_TO_LINEAR
+        pixels = [(to_linear[r], to_linear[g], to_linear[b]) for r, g, b in sample.getdata()]
+
+        factors: List[Tuple[float, float, float]] = []
+        for j in range(y_components):
+            cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+            for i in range(x_components):
+                cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+                r = g = b = 0.0
+                for y in range(height):
+                    row = pixels[y * width:(y + 1) * width]
+                    for x, (pr, pg, pb) in enumerate(row):
+                        basis = cos_x[x] * cos_y[y]
+                        r += basis * pr
+                        g += basis * pg
+                        b += basis * pb
+                scale = (1 if i == j == 0 else 2) / (width * height)
+                factors.append((r * scale, g * scale, b * scale))
+
+        dc, ac = factors[0], factors[1:]
+        parts = [cls._base83((x_components - 1) + (y_components - 1) * 9, 1)]
+        if ac:
+            actual_max = max(abs(c) for factor in ac for c in factor)
+            quantised_max = max(0, min(82, int(actual_max * 166 - 0.5)))
+            maximum = (quantised_max + 1) / 166
+            parts.append(cls._base83(quantised_max, 1))
+        else:
+            maximum = 1
+            parts.append(cls._base83(0, 1))
+
+        r, g, b = (cls._linear_to_srgb(c) for c in dc)
+        parts.append(cls._base83((r << 16) + (g << 8) + b, 4))
+        for factor in ac:
+            qr, qg, qb = (
+                max(0, min(18, int(math.floor(math.copysign(abs(c / maximum) ** 0.5, c) * 9 + 9.5))))
+                for c in factor
+            )
+            parts.append(cls._base83(qr * 19 * 19 + qg * 19 + qb, 2))
+        return ''.join(parts)
+
+    @classmethod
+    def _base83(cls, value: int, length: int) -> str:
+        return ''.join(
+            cls.CHARACTERS[(value // 83 ** (length - i - 1)) % 83] for i in range(length)
+        )
+
+    @staticmethod
+    def _linear_to_srgb(value: float) -> int:
+        v = max(0.0, min(1.0, value))
+        if v <= 0.0031308:
+            return int(v * 12.92 * 255 + 0.5)
+        return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
@@ -2,9 +2,14 @@
 import os
 import uuid
 from pathlib import Path
-from typing import Tuple, Optional
-from PIL import Image
-import magic
+from typing import NamedTuple, Tuple, Optional
+
+
+class MediaInfo(NamedTuple):
+    """Intrinsic size and BlurHash placeholder of a stored image or video."""
+    width: Optional[int]
+    height: Optional[int]
+    placeholder: Optional[str]
 
 
 class ImageProcessor:
@@ -14,6 +19,8 @@ class ImageProcessor:
     MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5 MB
     THUMB_SIZE = (200, 200)
     FULL_MAX_WIDTH = 1600
+    FULL_QUALITY = 85
+    THUMB_QUALITY = 80
     
     def __init__(self, media_path: str):
         """Initialize with media storage path."""
@@ -25,6 +32,7 @@ class ImageProcessor:
         if len(file_data) > self.MAX_IMAGE_SIZE:
             return False
         
+        import magic
         mime = magic.from_buffer(file_data, mime=True)
         return mime in self.ALLOWED_MIME_TYPES
     
@@ -35,9 +43,21 @@ class ImageProcessor:
         Returns:
             Tuple of (full_image_path, thumbnail_path)
         """
+        full_path, thumb_path, _ = self.save_image_with_info(file_data, filename)
+        return full_path, thumb_path
+    
+    def save_image_with_info(self, file_data: bytes, filename: str) -> Tuple[str, str, MediaInfo]:
+        """
+        Save image with thumbnail generation, describing the stored image.
+        
+        Returns:
+            Tuple of (full_image_path, thumbnail_path, info)
+        """
         if not self.validate_image(file_data):
             raise ValueError("Invalid image file")
         
+        from PIL import Image
+        
         # Generate unique filename
         ext = Path(filename).suffix or '.jpg'
         unique_name = f"{uuid.uuid4()}{ext}"
@@ -59,24 +79,99 @@ class ImageProcessor:
             img = bg
         
         # Resize if too large
-        if img.width > self.FULL_MAX_WIDTH:
-            ratio = self.FULL_MAX_WIDTH / img.width
-            new_size = (self.FULL_MAX_WIDTH, int(img.height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        
-        img.save(full_path, quality=85, optimize=True)
+        img = self._fit_full(img)
+        img.save(full_path, quality=self.FULL_QUALITY, optimize=True)
         
         # Generate thumbnail
-        thumb_name = f"thumb_{unique_name}"
+        thumb_name = self.thumb_name(unique_name)
         thumb_path = target_dir / thumb_name
-        img.thumbnail(self.THUMB_SIZE, Image.Resampling.LANCZOS)
-        img.save(thumb_path, quality=80, optimize=True)
+        self._save_thumbnail(img, thumb_path)
         
         # Return relative paths
         rel_full = f"{date_dir}/{unique_name}"
         rel_thumb = f"{date_dir}/{thumb_name}"
         
-        return rel_full, rel_thumb
+        return rel_full, rel_thumb, self.describe(img)
+    
+    @staticmethod
+    def describe(img) -> MediaInfo:
+        """Size and placeholder of a PIL image."""
+        from .blurhash import BlurHash
+        return MediaInfo(img.width, img.height, BlurHash.encode(img))
+    
+    def image_info(self, image_rel: str) -> MediaInfo:
+        """Size and placeholder of a stored image."""
+        from PIL import Image
+        with Image.open(self.media_path / image_rel) as img:
+            width, height = img.size
+            # JPEGs can be decoded at a fraction of their size for the hash
+            img.draft('RGB', (64, 64))
+            placeholder = self.describe(img).placeholder
+        return MediaInfo(width, height, placeholder)
+    
+    @staticmethod
+    def thumb_name(image_name: str) -> str:
+        """File name of the thumbnail belonging to an image."""
+        return f"thumb_{image_name}"
+    
+    def _fit_full(self, img):
+        """Downscale an image to at most ``FULL_MAX_WIDTH`` wide."""
+        from PIL import Image
+        if img.width > self.FULL_MAX_WIDTH:
+            ratio = self.FULL_MAX_WIDTH / img.width
+            new_size = (self.FULL_MAX_WIDTH, int(img.height * ratio))
+            img = img.resize(new_size, Image.Resampling.LANCZOS)
+        return img
+    
+    def _save_thumbnail(self, img, thumb_path: Path) -> None:
+        from PIL import Image
+        img = img.copy()
+        img.thumbnail(self.THUMB_SIZE, Image.Resampling.LANCZOS)
+        img.save(thumb_path, quality=self.THUMB_QUALITY, optimize=True)
+    
+    def regenerate_thumbnail(self, image_rel: str) -> str:
+        """
+        Rebuild the thumbnail of a stored image with the current settings.
+        
+        The new file replaces any existing one atomically.
+        
+        Returns:
+            Relative path of the thumbnail
+        """
+        from PIL import Image
+        full_path = self.media_path / image_rel
+        thumb_path = full_path.with_name(self.thumb_name(full_path.name))
+        with Image.open(full_path) as img:
+            img.load()
+            self._atomic_write(thumb_path, lambda tmp: self._save_thumbnail(img, tmp))
+        return str(Path(image_rel).with_name(thumb_path.name))
+    
+    def reencode_full(self, image_rel: str) -> None:
+        """Re-encode a stored full-size image in place with the current settings.
+        
+        Lossy formats lose some quality every time this runs.
+        """
+        from PIL import Image
+        full_path = self.media_path / image_rel
+        with Image.open(full_path) as img:
+            img.load()
+            if img.mode == 'RGBA':
+                bg = Image.new('RGB', img.size, (255, 255, 255))
+                bg.paste(img, mask=img.split()[3])
+                img = bg
+            img = self._fit_full(img)
+            self._atomic_write(full_path, lambda tmp: img.save(tmp, quality=self.FULL_QUALITY, optimize=True))
+    
+    @staticmethod
+    def _atomic_write(path: Path, write) -> None:
+        """Call ``write`` with a temporary path next to ``path``, then move it in place."""
+        tmp = path.with_name(f".{path.stem}.{os.getpid()}.tmp{path.suffix}")
+        try:
+            write(tmp)
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
 
 
 import io
@@ -0,0 +1,102 @@
+"""SQLite storage backend for Flask-Limiter."""
+import os
+import sqlite3
+import threading
+import time
+from limits.storage import Storage
+
+
+class SQLiteLimiterStorage(Storage):
+    """Rate limit counters kept in a SQLite file shared by every worker.
+
+    Importing this module registers the ``sqlite:///<path>`` storage URI with
+    ``limits``. Each counter is one row keyed by the limit key, so every
+    operation is a single primary-key lookup or upsert; increments are atomic
+    across processes and containers that share the file. Expired rows are
+    purged periodically rather than on every request.
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    PURGE_INTERVAL = 60.0
+    BUSY_TIMEOUT = 5.0
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        self.path = uri.split(':///', 1)[1]
+        self._local = threading.local()
+        self._next_purge = 0.0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _connection(self) -> sqlite3.Connection:
+        """Get this thread's connection, reopening it after a fork."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS ratelimits ('
+                'key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL'
+                ') WITHOUT ROWID'
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        """Increment a counter, starting a new window if the old one expired."""
+        now = time.time()
+        conn = self._connection()
+        if now >= self._next_purge:
+            self._next_purge = now + self.PURGE_INTERVAL
+            conn.execute('DELETE FROM ratelimits WHERE expires_at <= ?', (now,))
+        if elastic_expiry:
+            new_expiry = 'excluded.expires_at'
+        else:
+            new_expiry = 'CASE WHEN expires_at <= :now THEN excluded.expires_at ELSE expires_at END'
+        row = conn.execute(
+            'INSERT INTO ratelimits (key, count, expires_at) VALUES (:key, :amount, :expires_at) '
+            'ON CONFLICT(key) DO UPDATE SET '
+            'count = CASE WHEN expires_at <= :now THEN excluded.count ELSE count + excluded.count END, '
+            f'expires_at = {new_expiry} '
+            'RETURNING count',
+            {'key': key, 'amount': amount, 'expires_at': now + expiry, 'now': now}
+        ).fetchone()
+        return row[0]
+
+    def get(self, key: str) -> int:
+        """Get the current count of an unexpired counter."""
+        row = self._connection().execute(
+            'SELECT count FROM ratelimits WHERE key = ? AND expires_at > ?',
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        """Get the time at which a counter's window ends."""
+        now = time.time()
+        row = self._connection().execute(
+            'SELECT expires_at FROM ratelimits WHERE key = ? AND expires_at > ?',
+            (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self) -> bool:
+        """Check that the database file is usable."""
+        try:
+            self._connection().execute('SELECT 1')
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> int:
+        """Remove every counter."""
+        return self._connection().execute('DELETE FROM ratelimits').rowcount
+
+    def clear(self, key: str) -> None:
+        """Remove a single counter."""
+        self._connection().execute('DELETE FROM ratelimits WHERE key = ?', (key,))
@@ -0,0 +1,67 @@
+"""Contributor name helpers."""
+
+
+class NameFormatter:
+    """Format contributor names and derive their avatar initials and colour."""
+    
+    @staticmethod
+    def format_names(name: str) -> str:
+        """Format multiple names according to the specified pattern.
+        
+        1 person: Person 1
+        2 people: Person 1 & Person 2
+        3+ people: Person 1, Person 2 & Person 3
+        """
+        # Split by comma and clean up whitespace
+        names = [n.strip() for n in name.split(',') if n.strip()]
+        
+        if len(names) == 0:
+            return "Unknown"
+        elif len(names) == 1:
+            return names[0]
+        elif len(names) == 2:
+            return f"{names[0]} & {names[1]}"
+        else:
+            # Join all but last with commas, then add & before last
+            return ", ".join(names[:-1]) + f" & {names[-1]}"
+    
+    @staticmethod
+    def generate_initials(name: str) -> str:
+        """Generate initials from name.
+        
+        For formatted names with &, takes first letter of first name and first letter after &.
+        """
+        # Handle names with & (formatted multiple names)
+        if ' & ' in name:
+            parts = name.split(' & ')
+            first_initial = parts[0].strip()[0].upper() if parts[0].strip() else '?'
+            # Get the first letter of the last person's name
+            last_name_words = parts[-1].strip().split()
+            last_initial = last_name_words[0][0].upper() if last_name_words else '?'
+            return first_initial + last_initial
+        
+        # Handle single name or names with commas
+        if ',' in name:
+            # If there are commas, get first name
+            first_name = name.split(',')[0].strip()
+            words = first_name.split()
+        else:
+            words = name.strip().split()
+        
+        if len(words) == 0:
+            return "?"
+        elif len(words) == 1:
+            return words[0][0].upper()
+        else:
+            return (words[0][0] + words[-1][0]).upper()
+    
+    @staticmethod
+    def generate_color_hint(name: str) -> str:
+        """Generate a deterministic color hint from name."""
+        hash_val = 0
+        for char in name:
+            hash_val = (hash_val << 5) - hash_val + ord(char)
+            hash_val = hash_val & 0xFFFFFFFF
+        
+        hue = abs(hash_val) % 360
+        return f"hsl({hue} 60% 90%)"
@@ -0,0 +1,85 @@
+"""Fractional order keys for manually ordered lists."""
+from typing import List, Optional
+
+# Base-62 digits in ASCII order, so keys sort correctly as plain strings
+# (SQLite's default BINARY collation)
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+
+
+class OrderKey:
+    """Generate string sort keys that always leave room between neighbours.
+    
+    Keys are base-62 fractions (``'V'`` is 0.5) that never end in ``'0'``,
+    so there is a key between any two different keys and moving an item
+    only changes its own key. Keys grow when items are repeatedly placed in
+    the same gap; once one is longer than ``MAX_LENGTH`` the list should be
+    given fresh keys with ``spread``.
+    """
+    
+    MAX_LENGTH = 48
+    
+    @staticmethod
+    def between(before: Optional[str], after: Optional[str]) -> str:
+        """A key that sorts after ``before`` and before ``after``.
+        
+        ``None`` stands for the start or the end of the list.
+        
+        Raises:
+            ValueError: if ``before`` does not sort before ``after``
+        """
+        if before is not None and after is not None and before >= after:
+            raise ValueError(f"No key between {before!r} and {after!r}")
+        if after is None:
+            return OrderKey._after(before or '')
+        return OrderKey._midpoint(before or '', after)
+    
+    @staticmethod
+    def _after(key: str) -> str:
+        # Incrementing the first digit keeps appended keys short: they only
+        # grow by one digit every ~60 appends
+        if not key:
+            return DIGITS[BASE // 2]
+        digit = DIGITS.index(key[0])
+        if digit < BASE - 1:
+            return DIGITS[digit + 1]
+        return key[0] + OrderKey._after(key[1:])
+    
+    @staticmethod
+    def _midpoint(low: str, high: str) -> str:
+        # Shared leading digits are kept as they are
+        n = 0
+        while n < len(high) and (low[n] if n < len(low) else '0') == high[n]:
+            n += 1
+        if n:
+            return high[:n] + OrderKey._midpoint(low[n:], high[n:])
+        low_digit = DIGITS.index(low[0]) if low else 0
+        high_digit = DIGITS.index(high[0])
+        if high_digit - low_digit > 1:
+            return DIGITS[(low_digit + high_digit) // 2]
+        # Adjacent digits: a prefix of ``high`` fits if it is longer than one
+        # digit, otherwise go one digit deeper after ``low``
+        if len(high) > 1:
+            return high[0]
+        return DIGITS[low_digit] + OrderKey._after(low[1:])
+    
+    @staticmethod
+    def spread(count: int) -> List[str]:
+        """``count`` evenly spaced, ascending keys of equal length, for rebalancing."""
+        width = 1
+        while BASE ** width <= count:
+            width += 1
+        width += 1
+        step = BASE ** width // (count + 1)
+        keys = []
+        for i in range(1, count + 1):
+            value, digits = i * step, []
+            for _ in range(width):
+                value, digit = divmod(value, BASE)
+                digits.append(DIGITS[digit])
+            keys.append(''.join(reversed(digits)).rstrip('0'))
+        return keys
+    
+    @staticmethod
+    def needs_rebalance(key: str) -> bool:
+        return len(key) > OrderKey.MAX_LENGTH
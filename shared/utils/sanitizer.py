@@ -1,9 +1,18 @@
 """HTML content sanitization."""
-import bleach
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Iterable, List
 
 
 class ContentSanitizer:
-    """Sanitize user-submitted HTML content."""
+    """Sanitize user-submitted HTML content.
+    
+    The ``bleach.Cleaner`` (with a CSS sanitizer limited to
+    ``ALLOWED_STYLES``) is built once per thread, as bleach cleaners are not
+    thread-safe, and results are kept in an LRU cache keyed by a digest of
+    the input so the same content is only cleaned once.
+    """
     
     ALLOWED_TAGS = [
         'p', 'br', 'strong', 'em', 'u', 'h1', 'h2', 'h3',
@@ -17,12 +26,59 @@ class ContentSanitizer:
     
     ALLOWED_STYLES = ['color', 'background-color', 'font-weight']
     
+    # Number of cleaned results kept, and the largest input that is cached
+    CACHE_SIZE = 2048
+    CACHE_MAX_INPUT = 64 * 1024
+    
+    _local = threading.local()
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+    
+    @classmethod
+    def _cleaner(cls):
+        """Return this thread's cleaner, building it on first use."""
+        cleaner = getattr(cls._local, 'cleaner', None)
+        if cleaner is None:
+            import bleach
+            from bleach.css_sanitizer import CSSSanitizer
+            cleaner = bleach.Cleaner(
+                tags=cls.ALLOWED_TAGS,
+                attributes=cls.ALLOWED_ATTRIBUTES,
+                css_sanitizer=CSSSanitizer(allowed_css_properties=cls.ALLOWED_STYLES),
+                strip=True
+            )
+            cls._local.cleaner = cleaner
+        return cleaner
+    
     @classmethod
     def sanitize(cls, html: str) -> str:
         """Sanitize HTML content to prevent XSS."""
-        return bleach.clean(
-            html,
-            tags=cls.ALLOWED_TAGS,
-            attributes=cls.ALLOWED_ATTRIBUTES,
-            strip=True
-        )
+        if len(html) > cls.CACHE_MAX_INPUT:
+            return cls._cleaner().clean(html)
+        
+        key = hashlib.blake2b(html.encode('utf-8'), digest_size=16).digest()
+        with cls._cache_lock:
+            clean = cls._cache.get(key)
+            if clean is not None:
+                cls._cache.move_to_end(key)
+                return clean
+        
+        clean = cls._cleaner().clean(html)
+        with cls._cache_lock:
+            cls._cache[key] = clean
+            if len(cls._cache) > cls.CACHE_SIZE:
+                cls._cache.popitem(last=False)
+        return clean
+    
+    @classmethod
+    def sanitize_many(cls, htmls: Iterable[str]) -> List[str]:
+        """Sanitize a batch of HTML fragments, cleaning duplicates once."""
+        seen = {}
+        return [seen[html] if html in seen else seen.setdefault(html, cls.sanitize(html))
+                for html in htmls]
+    
+    @classmethod
+    def clear_cache(cls) -> None:
+        """Forget cached results."""
+        with cls._cache_lock:
+            cls._cache.clear()
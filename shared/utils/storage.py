@@ -0,0 +1,204 @@
+"""Media storage backends."""
+import mimetypes
+import os
+import shutil
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+from urllib.parse import quote
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class MediaStorage(ABC):
+    """Where media files live, addressed by their path relative to the media root.
+
+    ``ImageProcessor``/``VideoProcessor`` write their output under a local
+    ``staging_path``; ``store`` then hands each finished file to the
+    storage. Pages and API responses link to ``url(path)`` when it returns
+    one, so media bytes are served by the storage instead of the app.
+    """
+
+    # URL prefix that serves any stored path without signing, if there is one
+    base_url: Optional[str] = None
+
+    def __init__(self, staging_path: str):
+        self.staging_path = Path(staging_path)
+
+    @abstractmethod
+    def store(self, rel_path: str) -> None:
+        """Move a file written under ``staging_path`` into the storage."""
+
+    @abstractmethod
+    def write(self, rel_path: str, stream: BinaryIO) -> None:
+        """Store the contents of a readable binary stream, in chunks."""
+
+    @abstractmethod
+    def open(self, rel_path: str) -> BinaryIO:
+        """Open a stored file for reading."""
+
+    @abstractmethod
+    def size(self, rel_path: str) -> Optional[int]:
+        """Size of a stored file in bytes, or None if it does not exist."""
+
+    @abstractmethod
+    def delete(self, rel_path: str) -> None:
+        """Delete a stored file; missing files are ignored."""
+
+    def url(self, rel_path: str) -> Optional[str]:
+        """Direct (possibly signed) URL of a file, or None to serve it through the app."""
+        if self.base_url:
+            return f"{self.base_url}/{quote(rel_path)}"
+        return None
+
+    def exists(self, rel_path: str) -> bool:
+        return self.size(rel_path) is not None
+
+    def iter_chunks(self, rel_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the contents of a stored file in chunks."""
+        with self.open(rel_path) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+
+class LocalStorage(MediaStorage):
+    """Media kept in a local directory (the ``MEDIA_PATH`` volume).
+
+    Files are served by the app's ``/media`` route, or from ``base_url``
+    when a static file server or CDN publishes the directory.
+    """
+
+    def __init__(self, root: str, base_url: Optional[str] = None):
+        super().__init__(root)
+        self.root = self.staging_path
+        self.base_url = base_url.rstrip('/') if base_url else None
+
+    def _path(self, rel_path: str) -> Path:
+        from werkzeug.security import safe_join
+        path = safe_join(str(self.root), rel_path)
+        if path is None:
+            raise ValueError(f"Unsafe media path: {rel_path!r}")
+        return Path(path)
+
+    def store(self, rel_path: str) -> None:
+        # Processors already write into the media directory
+        self._path(rel_path)
+
+    def write(self, rel_path: str, stream: BinaryIO) -> None:
+        path = self._path(rel_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, 'wb') as f:
+                shutil.copyfileobj(stream, f, CHUNK_SIZE)
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+
+    def open(self, rel_path: str) -> BinaryIO:
+        return open(self._path(rel_path), 'rb')
+
+    def size(self, rel_path: str) -> Optional[int]:
+        try:
+            path = self._path(rel_path)
+        except ValueError:
+            return None
+        return path.stat().st_size if path.is_file() else None
+
+    def delete(self, rel_path: str) -> None:
+        self._path(rel_path).unlink(missing_ok=True)
+
+
+class S3Storage(MediaStorage):
+    """Media kept in an S3-compatible bucket (AWS S3, MinIO, R2, ...).
+
+    Files are uploaded with multipart ``upload_fileobj``, so large videos
+    are streamed rather than read into memory. Links are time-limited
+    presigned URLs unless ``base_url`` points at a public bucket or CDN.
+    boto3 is imported on first use and credentials come from its usual
+    sources (``AWS_ACCESS_KEY_ID``/``AWS_SECRET_ACCESS_KEY``, profiles,
+    instance roles).
+    """
+
+    def __init__(self, bucket: str, staging_path: str, endpoint_url: Optional[str] = None,
+                 region: Optional[str] = None, prefix: str = '', base_url: Optional[str] = None,
+                 url_expires: int = 3600):
+        super().__init__(staging_path)
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url or None
+        self.region = region or None
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.base_url = base_url.rstrip('/') if base_url else None
+        self.url_expires = url_expires
+        self._client = None
+        self._client_pid = None
+
+    @property
+    def client(self):
+        """boto3 S3 client, created once per process (clients do not survive fork)."""
+        if self._client is None or self._client_pid != os.getpid():
+            import boto3
+            self._client = boto3.client('s3', endpoint_url=self.endpoint_url, region_name=self.region)
+            self._client_pid = os.getpid()
+        return self._client
+
+    def __getstate__(self):
+        # boto3 clients cannot be pickled; worker processes create their own
+        return {**self.__dict__, '_client': None, '_client_pid': None}
+
+    def key(self, rel_path: str) -> str:
+        return f"{self.prefix}{rel_path}"
+
+    def store(self, rel_path: str) -> None:
+        local = self.staging_path / rel_path
+        with open(local, 'rb') as f:
+            self.write(rel_path, f)
+        local.unlink()
+
+    def write(self, rel_path: str, stream: BinaryIO) -> None:
+        content_type = mimetypes.guess_type(rel_path)[0] or 'application/octet-stream'
+        self.client.upload_fileobj(stream, self.bucket, self.key(rel_path),
+                                   ExtraArgs={'ContentType': content_type})
+
+    def open(self, rel_path: str) -> BinaryIO:
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(rel_path))['Body']
+
+    def size(self, rel_path: str) -> Optional[int]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(rel_path))
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return head['ContentLength']
+
+    def delete(self, rel_path: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(rel_path))
+
+    def url(self, rel_path: str) -> Optional[str]:
+        if self.base_url:
+            return super().url(rel_path)
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self.key(rel_path)},
+            ExpiresIn=self.url_expires
+        )
+
+
+def create_storage(config) -> MediaStorage:
+    """Build the storage selected by a service ``Config`` (``MEDIA_STORAGE``)."""
+    kind = getattr(config, 'MEDIA_STORAGE', 'local')
+    if kind == 'local':
+        return LocalStorage(config.MEDIA_PATH, base_url=getattr(config, 'MEDIA_URL', None))
+    if kind == 's3':
+        if not config.S3_BUCKET:
+            raise ValueError("MEDIA_STORAGE=s3 requires S3_BUCKET")
+        return S3Storage(
+            config.S3_BUCKET, config.MEDIA_PATH, endpoint_url=config.S3_ENDPOINT_URL,
+            region=config.S3_REGION, prefix=config.S3_PREFIX,
+            base_url=config.MEDIA_URL, url_expires=config.S3_URL_EXPIRES
+        )
+    raise ValueError(f"Unknown MEDIA_STORAGE: {kind!r}")
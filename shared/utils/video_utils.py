@@ -1,16 +1,31 @@
 """Video processing utilities."""
 import os
+import json
 import uuid
 import subprocess
 from pathlib import Path
-from typing import Tuple
-import magic
+from typing import NamedTuple, Optional, Tuple
+from .image_utils import ImageProcessor, MediaInfo
+
+
+class VideoPreviews(NamedTuple):
+    """Files shown in place of a video until it is played; None if not generated."""
+    preview_path: Optional[str]
+    poster_path: Optional[str]
+
 
 class VideoProcessor:
     """Handle video validation, processing, and storage."""
     
     ALLOWED_MIME_TYPES = {'video/mp4', 'video/webm', 'video/quicktime'}
     MAX_VIDEO_SIZE = 50 * 1024 * 1024  # 50 MB
+    # Muted looping clip shown instead of the original until it is played
+    PREVIEW_SECONDS = 4
+    PREVIEW_MAX_WIDTH = 480
+    PREVIEW_MAX_BITRATE = '400k'
+    # Full-width still shown before playback (the thumbnail is a 200px square)
+    POSTER_MAX_WIDTH = 1280
+    POSTER_QUALITY = 4  # ffmpeg JPEG scale, 2 (best) to 31
     
     def __init__(self, media_path: str):
         """Initialize with media storage path."""
@@ -22,6 +37,7 @@ class VideoProcessor:
         if len(file_data) > self.MAX_VIDEO_SIZE:
             return False
         
+        import magic
         mime = magic.from_buffer(file_data, mime=True)
         return mime in self.ALLOWED_MIME_TYPES
     
@@ -32,6 +48,16 @@ class VideoProcessor:
         Returns:
             Tuple of (video_path, thumbnail_path)
         """
+        video_path, thumb_path, _ = self.save_video_with_info(file_data, filename)
+        return video_path, thumb_path
+    
+    def save_video_with_info(self, file_data: bytes, filename: str) -> Tuple[str, str, MediaInfo]:
+        """
+        Save video and generate a thumbnail, describing the stored video.
+        
+        Returns:
+            Tuple of (video_path, thumbnail_path, info)
+        """
         if not self.validate_video(file_data):
             raise ValueError("Invalid video file")
         
@@ -51,9 +77,71 @@ class VideoProcessor:
             f.write(file_data)
         
         # Generate thumbnail
-        thumb_name = f"thumb_{Path(unique_name).stem}.jpg"
+        thumb_name = self.thumb_name(unique_name)
         thumb_path = target_dir / thumb_name
+        self._extract_thumbnail(video_path, thumb_path)
+
+        # Return relative paths
+        rel_video = f"{date_dir}/{unique_name}"
+        rel_thumb = f"{date_dir}/{Path(thumb_name).name}"
+        
+        return rel_video, rel_thumb, self.video_info(rel_video, rel_thumb)
+    
+    def video_info(self, video_rel: str, thumb_rel: str) -> MediaInfo:
+        """Frame size of a stored video, with a placeholder from its thumbnail."""
+        width, height = self._probe_size(self.media_path / video_rel) or (None, None)
+        placeholder = None
+        if (self.media_path / thumb_rel).is_file():
+            placeholder = ImageProcessor(self.media_path).image_info(thumb_rel).placeholder
+        return MediaInfo(width, height, placeholder)
+    
+    @classmethod
+    def _probe_size(cls, video_path: Path) -> Optional[Tuple[int, int]]:
+        """Displayed width and height of the first video stream, or None if unknown."""
+        try:
+            result = subprocess.run([
+                'ffprobe', '-v', 'error',
+                '-select_streams', 'v:0',
+                '-show_entries', 'stream=width,height:stream_tags=rotate:stream_side_data=rotation',
+                '-of', 'json',
+                str(video_path)
+            ], check=True, capture_output=True, text=True)
+            return cls._display_size(json.loads(result.stdout)['streams'][0])
+        except (subprocess.CalledProcessError, FileNotFoundError, ValueError, KeyError, IndexError):
+            return None
+    
+    @staticmethod
+    def _display_size(stream: dict) -> Tuple[int, int]:
+        """Frame size of an ffprobe stream as played back, after its rotation.
         
+        Phones store portrait video as landscape frames plus a rotation: a
+        display matrix in the side data (newer ffmpeg) or a ``rotate`` tag
+        (older ffmpeg).
+        """
+        width, height = int(stream['width']), int(stream['height'])
+        rotation = stream.get('tags', {}).get('rotate', 0)
+        for side_data in stream.get('side_data_list', []):
+            rotation = side_data.get('rotation', rotation)
+        if int(float(rotation)) % 180 == 90:
+            return height, width
+        return width, height
+    
+    @staticmethod
+    def thumb_name(video_name: str) -> str:
+        """File name of the thumbnail belonging to a video."""
+        return f"thumb_{Path(video_name).stem}.jpg"
+    
+    @staticmethod
+    def preview_name(video_name: str) -> str:
+        """File name of the preview clip belonging to a video."""
+        return f"preview_{Path(video_name).stem}.mp4"
+    
+    @staticmethod
+    def poster_name(video_name: str) -> str:
+        """File name of the poster image belonging to a video."""
+        return f"poster_{Path(video_name).stem}.jpg"
+    
+    def _extract_thumbnail(self, video_path: Path, thumb_path: Path) -> None:
         try:
             # Use ffmpeg to extract the first frame
             subprocess.run([
@@ -69,9 +157,92 @@ class VideoProcessor:
             # Fallback: if ffmpeg fails or is not installed, you might want a default thumb
             # For now, we'll just raise the error to be explicit
             raise RuntimeError(f"ffmpeg thumbnail generation failed: {e}")
-
-        # Return relative paths
-        rel_video = f"{date_dir}/{unique_name}"
-        rel_thumb = f"{date_dir}/{Path(thumb_name).name}"
+    
+    def regenerate_thumbnail(self, video_rel: str) -> str:
+        """
+        Rebuild the thumbnail of a stored video, replacing it atomically.
+        
+        Returns:
+            Relative path of the thumbnail
+        """
+        video_path = self.media_path / video_rel
+        if not video_path.is_file():
+            raise FileNotFoundError(video_path)
+        thumb_path = video_path.with_name(self.thumb_name(video_path.name))
+        tmp = thumb_path.with_name(f".{thumb_path.stem}.{os.getpid()}.tmp.jpg")
+        try:
+            self._extract_thumbnail(video_path, tmp)
+            os.replace(tmp, thumb_path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        return str(Path(video_rel).with_name(thumb_path.name))
+    
+    def generate_previews(self, video_rel: str) -> VideoPreviews:
+        """
+        Write the preview clip and poster of a stored video next to it,
+        replacing existing ones atomically.
         
-        return rel_video, rel_thumb
+        Either path is None if ffmpeg could not produce the file; the
+        original video still plays without them.
+        """
+        video_path = self.media_path / video_rel
+        if not video_path.is_file():
+            raise FileNotFoundError(video_path)
+        paths = []
+        for name, build in ((self.preview_name(video_path.name), self._encode_preview),
+                            (self.poster_name(video_path.name), self._extract_poster)):
+            target = video_path.with_name(name)
+            tmp = target.with_name(f".{target.stem}.{os.getpid()}.tmp{target.suffix}")
+            try:
+                build(video_path, tmp)
+                os.replace(tmp, target)
+                paths.append(str(Path(video_rel).with_name(name)))
+            except RuntimeError:
+                paths.append(None)
+            finally:
+                if tmp.exists():
+                    tmp.unlink()
+        return VideoPreviews(*paths)
+    
+    @staticmethod
+    def _ffmpeg(*args: str) -> None:
+        try:
+            subprocess.run(['ffmpeg', '-y', '-v', 'error', *args], check=True, capture_output=True)
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            raise RuntimeError(f"ffmpeg failed: {e}")
+    
+    def _encode_preview(self, video_path: Path, preview_path: Path) -> None:
+        """Encode the first seconds, scaled down and without audio, as H.264."""
+        self._ffmpeg(
+            '-i', str(video_path),
+            '-t', str(self.PREVIEW_SECONDS),
+            '-an',
+            '-vf', f"scale='min({self.PREVIEW_MAX_WIDTH},iw)':-2,fps=24",
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '32',
+            '-maxrate', self.PREVIEW_MAX_BITRATE, '-bufsize', '800k',
+            '-pix_fmt', 'yuv420p',
+            # Index first, so playback starts before the whole clip is loaded
+            '-movflags', '+faststart',
+            str(preview_path)
+        )
+    
+    def _extract_poster(self, video_path: Path, poster_path: Path) -> None:
+        """Grab a frame one second in (the first frame of shorter videos)."""
+        error = RuntimeError(f"No frame could be read from {video_path.name}")
+        for offset in ('1', '0'):
+            try:
+                self._ffmpeg(
+                    '-ss', offset,
+                    '-i', str(video_path),
+                    '-frames:v', '1',
+                    '-vf', f"scale='min({self.POSTER_MAX_WIDTH},iw)':-2",
+                    '-q:v', str(self.POSTER_QUALITY),
+                    str(poster_path)
+                )
+            except RuntimeError as e:
+                error = e
+                continue
+            if poster_path.is_file() and poster_path.stat().st_size:
+                return
+        raise error
@@ -0,0 +1,106 @@
+"""Streaming ZIP archive generation."""
+import os
+import time
+import zipfile
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+class _StreamSink:
+    """Write-only, unseekable file object that buffers bytes until drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+            self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        """Return and forget everything written since the last drain."""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class ZipStreamer:
+    """Build a ZIP archive on the fly, yielding bytes as entries are written.
+
+    Nothing is ever held in memory beyond the chunk currently being copied,
+    so archives of any size can be streamed straight into an HTTP response.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    # Formats that are already compressed are stored as-is
+    STORED_EXTENSIONS = {
+        '.jpg', '.jpeg', '.png', '.webp', '.gif',
+        '.mp4', '.webm', '.mov', '.m4v',
+        '.zip', '.gz',
+    }
+
+    def __init__(self, chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+
+    def stream(self, entries: Iterable[Tuple[str, Iterable[bytes], Optional[int]]]) -> Iterator[bytes]:
+        """
+        Stream a ZIP archive.
+
+        Args:
+            entries: Iterable of ``(arcname, chunks, size)`` tuples. ``chunks``
+                yields the entry's bytes; ``size`` is the uncompressed size if
+                known up front (used to decide on ZIP64 headers) or None.
+
+        Yields:
+            Consecutive pieces of the archive.
+        """
+        sink = _StreamSink()
+        with zipfile.ZipFile(sink, mode='w', allowZip64=True) as archive:
+            for arcname, chunks, size in entries:
+                info = zipfile.ZipInfo(arcname, date_time=time.localtime()[:6])
+                info.compress_type = self.compress_type(arcname)
+                info.external_attr = 0o644 << 16
+                if size:
+                    info.file_size = size
+                with archive.open(info, mode='w') as entry:
+                    for chunk in chunks:
+                        entry.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                data = sink.drain()
+                if data:
+                    yield data
+        # Central directory is written when the archive is closed
+        data = sink.drain()
+        if data:
+            yield data
+
+    def file_entry(self, arcname: str, path: Path) -> Tuple[str, Iterator[bytes], int]:
+        """Build an entry that reads ``path`` from disk in chunks."""
+        return arcname, self.iter_file(path), os.path.getsize(path)
+
+    def iter_file(self, path: Path) -> Iterator[bytes]:
+        """Yield the contents of a file in fixed-size chunks."""
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    @classmethod
+    def compress_type(cls, arcname: str) -> int:
+        """Pick STORED for already-compressed media and DEFLATED otherwise."""
+        if Path(arcname).suffix.lower() in cls.STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
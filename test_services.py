@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 """Test script to verify all services can initialize."""
+import json
 import sys
 import os
+from pathlib import Path
+from shared.utils.storage import LocalStorage
+
+
+def _reset_service_modules():
+    """Forget per-service modules so the next import picks up the right service."""
+    for name in ('app', 'config', 'services'):
+        sys.modules.pop(name, None)
 
 def test_dashboard():
     """Test dashboard service."""
     print("Testing Dashboard service...")
+    _reset_service_modules()
     sys.path.insert(0, 'services/dashboard')
     sys.path.insert(0, '.')
     
@@ -26,6 +36,7 @@ def test_dashboard():
 def test_submit():
     """Test submit service."""
     print("\nTesting Submit service...")
+    _reset_service_modules()
     sys.path.insert(0, 'services/submit')
     
     os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
@@ -44,9 +55,223 @@ def test_submit():
     # Clean up path
     sys.path = [p for p in sys.path if 'submit' not in p]
 
+def test_admission_control():
+    """Test that media uploads beyond the cap get 503 while the rest is served."""
+    import io
+    import tempfile
+    print("\nTesting admission control...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/submit')
+    
+    admission_dir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    os.environ['MEDIA_CONCURRENCY'] = '1'
+    os.environ['MEDIA_MIN_BYTES'] = '1024'
+    os.environ['ADMISSION_DIR'] = admission_dir
+    try:
+        from app import create_app
+        from shared.admission import SlotSemaphore
+        app = create_app()
+        upload = {'name': 'Ann', 'content': '<p>hi</p>', 'image': (io.BytesIO(b'x' * 4096), 'big.jpg')}
+        
+        # Another worker holds the only slot
+        slot = SlotSemaphore(admission_dir, 1).try_acquire()
+        assert slot is not None
+        with app.test_client() as client:
+            response = client.post('/submit/nope', data=dict(upload), environ_base={'REMOTE_ADDR': '10.0.0.1'})
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '10'
+            assert client.get('/health').status_code == 200
+            response = client.post('/submit/nope', data={'name': 'Ben', 'content': '<p>short</p>'},
+                                   environ_base={'REMOTE_ADDR': '10.0.0.2'})
+            assert response.status_code != 503
+            print("✓ Uploads over the cap get 503, forms and text still served")
+            
+            response = client.post('/submit/nope', environ_base={'REMOTE_ADDR': '10.0.0.3'}, headers={
+                'Transfer-Encoding': 'chunked', 'Content-Type': 'multipart/form-data; boundary=x'
+            })
+            assert response.status_code == 503
+            print("✓ Chunked uploads without Content-Length count as media")
+            
+            SlotSemaphore.release(slot)
+            # The rejected attempt did not use up the rate limit
+            upload['image'] = (io.BytesIO(b'x' * 4096), 'big.jpg')
+            response = client.post('/submit/nope', data=upload, environ_base={'REMOTE_ADDR': '10.0.0.1'})
+            assert response.status_code not in (429, 503)
+        # The slot is free again once the request is done
+        slot = SlotSemaphore(admission_dir, 1).try_acquire()
+        assert slot is not None
+        SlotSemaphore.release(slot)
+        print("✓ Slots are released after the request")
+    finally:
+        for key in ('MEDIA_CONCURRENCY', 'MEDIA_MIN_BYTES', 'ADMISSION_DIR'):
+            del os.environ[key]
+        sys.path = [p for p in sys.path if 'submit' not in p]
+
+def test_idempotent_submission():
+    """Test that a retried submission returns the original result."""
+    print("\nTesting idempotent submissions...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/submit')
+    
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    
+    from app import create_app
+    from shared.models import init_db, InviteLink, Message
+    app = create_app()
+    Session, engine = init_db(os.environ['DATABASE_URL'])
+    db = Session()
+    db.add(InviteLink(token='retry-token', max_uses=1))
+    db.commit()
+    db.close()
+    
+    form = {'name': 'Ann', 'content': '<p>Hello</p>', 'idempotency_key': '6f1c2b0e-1d7a-4c1e-9a57-3f0b5b3e8d21'}
+    with app.test_client() as client:
+        first = client.post('/submit/retry-token', data=form, environ_base={'REMOTE_ADDR': '10.1.0.1'})
+        # The retry is neither rate limited nor refused for the used-up token
+        retry = client.post('/submit/retry-token', data=form, environ_base={'REMOTE_ADDR': '10.1.0.1'})
+        assert first.status_code == retry.status_code == 200
+        assert retry.get_data() == first.get_data()
+        other = dict(form, idempotency_key='0c6b6d1e-8f0a-4f43-a1a4-5d1f1e2c9b77')
+        assert client.post('/submit/retry-token', data=other, environ_base={'REMOTE_ADDR': '10.1.0.1'}).status_code == 429
+        # The key of a sent form, reused for another message, is no retry
+        reused = dict(form, content='<p>Another one</p>')
+        assert client.post('/submit/retry-token', data=reused, environ_base={'REMOTE_ADDR': '10.1.0.1'}).status_code == 429
+    
+    os.environ['RATELIMIT_ENABLED'] = 'false'
+    _reset_service_modules()
+    try:
+        from app import create_app
+        unlimited = create_app()
+    finally:
+        del os.environ['RATELIMIT_ENABLED']
+    with unlimited.test_client() as client:
+        for _ in range(3):
+            response = client.post('/submit/missing', data={'name': 'Dan', 'content': '<p>x</p>'},
+                                   environ_base={'REMOTE_ADDR': '10.1.0.2'})
+            assert response.status_code not in (429, 500)
+    print("✓ RATELIMIT_ENABLED=false turns the rate limit off")
+    
+    db = Session()
+    assert db.query(Message).filter(Message.name == 'Ann').count() == 1
+    assert db.get(InviteLink, 'retry-token').uses_count == 1
+    from services import SubmissionService
+    service = SubmissionService(db, os.environ['MEDIA_PATH'])
+    assert service.create_submission('retry-token', 'Ann', '<p>Hello</p>',
+                                     idempotency_key=form['idempotency_key']) == (True, "Submission successful")
+    assert service.create_submission('retry-token', 'Ann', '<p>Another one</p>',
+                                     idempotency_key=form['idempotency_key']) == (False, SubmissionService.KEY_REUSED)
+    assert db.query(Message).filter(Message.name == 'Ann').count() == 1
+    db.close()
+    print("✓ Retried POST reuses the stored message and token use; other content is refused")
+    
+    from datetime import datetime, timedelta
+    from services import SubmissionService
+    db = Session()
+    db.add(InviteLink(token='slow-token'))
+    busy_key = '9a7e4c1d-2b3f-4a5e-8c6d-7e8f9a0b1c2d'
+    db.add(Message(uuid='busy', name='Cat', initials='C', content='<p>x</p>', status='processing',
+                   idempotency_key=busy_key))
+    db.commit()
+    db.close()
+    with app.test_client() as client:
+        # Still rate limited from above, but a retry of an in-flight submission is answered
+        busy = client.post('/submit/slow-token', data=dict(form, idempotency_key=busy_key),
+                           environ_base={'REMOTE_ADDR': '10.1.0.1'})
+        assert busy.status_code == 409 and busy.headers['Retry-After'] == '10'
+    
+    db = Session()
+    service = SubmissionService(db, os.environ['MEDIA_PATH'])
+    bad_file = [(b'not an image', 'x.png', 'image')]
+    ok, _ = service.create_submission('slow-token', 'Dan', '<p>x</p>', idempotency_key='f' * 32,
+                                      attachments=bad_file)
+    assert not ok and service.find_submission('f' * 32) is None
+    db.query(Message).filter(Message.uuid == 'busy').update(
+        {'created_at': datetime.utcnow() - SubmissionService.RESERVATION_TIMEOUT - timedelta(seconds=1)})
+    db.commit()
+    assert service.create_submission('slow-token', 'Cat', '<p>x</p>', idempotency_key=busy_key)[0]
+    assert service.find_submission(busy_key).status == 'pending'
+    db.close()
+    print("✓ In-flight submissions are reserved, failed and abandoned ones released")
+    
+    sys.path = [p for p in sys.path if 'submit' not in p]
+
+def test_message_attachments():
+    """Test multi-file submissions and the attachment list in the card API."""
+    import io
+    import tempfile
+    from PIL import Image
+    print("\nTesting message attachments...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/submit')
+    
+    tmp_dir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{tmp_dir}/attachments.db'
+    os.environ['MEDIA_PATH'] = f'{tmp_dir}/media'
+    
+    from services import SubmissionService
+    from shared.models import init_db, InviteLink, Message, MessageAttachment
+    Session, engine = init_db(os.environ['DATABASE_URL'])
+    db = Session()
+    db.add(InviteLink(token='attach-token'))
+    db.commit()
+    
+    def png(width, height):
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height), (10, 120, 200)).save(buffer, 'PNG')
+        return buffer.getvalue()
+    
+    service = SubmissionService(db, os.environ['MEDIA_PATH'])
+    files = [(png(300, 200), 'a.png', 'image'), (png(100, 400), 'b.png', 'image'), (png(50, 50), 'c.png', 'image')]
+    ok, _ = service.create_submission('attach-token', 'Ann', '<p>Photos</p>', attachments=files)
+    assert ok
+    message = db.query(Message).filter(Message.name == 'Ann').one()
+    rows = db.query(MessageAttachment).filter(MessageAttachment.message_id == message.id).order_by(MessageAttachment.position).all()
+    assert [(a.width, a.height) for a in rows] == [(300, 200), (100, 400), (50, 50)]
+    assert (message.image_path, message.media_width) == (rows[0].path, 300)
+    
+    # A bad file fails the submission without leaving the others behind
+    stored = {str(p) for p in Path(os.environ['MEDIA_PATH']).rglob('*') if p.is_file()}
+    ok, error = service.create_submission('attach-token', 'Ben', '<p>x</p>',
+                                          attachments=[files[0], (b'not an image', 'd.png', 'image')])
+    assert not ok and 'Media upload failed' in error
+    assert {str(p) for p in Path(os.environ['MEDIA_PATH']).rglob('*') if p.is_file()} == stored
+    ok, error = service.create_submission('attach-token', 'Ben', '<p>x</p>', attachments=files * 3)
+    assert not ok
+    print("✓ Files processed together, in order, all or nothing")
+    
+    db.add(Message(uuid='legacy-media', name='Old', initials='O', content='<p>old</p>', status='approved',
+                   image_path='x/old.jpg', thumb_path='x/thumb_old.jpg', media_type='image'))
+    message.status = 'approved'
+    db.commit()
+    message_uuid = message.uuid
+    paths = [(a.path, a.thumb_path) for a in rows]
+    db.close()
+    sys.path = [p for p in sys.path if 'submit' not in p]
+    
+    _reset_service_modules()
+    sys.path.insert(0, 'services/card')
+    from app import create_app
+    with create_app().test_client() as client:
+        messages = {m['uuid']: m for m in client.get('/api/messages').get_json()}
+        new = messages[message_uuid]['attachments']
+        assert [a['url'] for a in new] == [f'/media/{path}' for path, _ in paths]
+        assert new[1]['thumb_url'] == f'/media/{paths[1][1]}' and new[1]['height'] == 400
+        assert messages['legacy-media']['attachments'] == [{
+            'media_type': 'image', 'url': '/media/x/old.jpg', 'thumb_url': '/media/x/thumb_old.jpg',
+            'preview_url': None, 'poster_url': None, 'width': None, 'height': None, 'placeholder': None
+        }]
+        assert 'attachments' not in client.get('/api/messages?fields=summary').get_json()[0]
+    print("✓ Card API lists attachments, falling back to a message's own media")
+    
+    sys.path = [p for p in sys.path if 'card' not in p]
+
 def test_card():
     """Test card service."""
     print("\nTesting Card service...")
+    _reset_service_modules()
     sys.path.insert(0, 'services/card')
     
     os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
@@ -65,6 +290,1115 @@ def test_card():
     # Clean up path
     sys.path = [p for p in sys.path if 'card' not in p]
 
+def test_card_message_projection():
+    """Test the column-projected card message API."""
+    print("\nTesting card message projection...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/card')
+    
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    
+    from datetime import datetime
+    from app import create_app
+    from shared.models import init_db, Message
+    app = create_app()
+    Session, engine = init_db(os.environ['DATABASE_URL'])
+    db = Session()
+    db.query(Message).delete()
+    db.add_all([
+        # Whole seconds, which isoformat() writes without a fraction
+        Message(uuid='m1', name='Ann', initials='A', content='<p>One</p>', status='approved',
+                color_hint='hsl(1 60% 90%)', created_at=datetime(2026, 1, 2, 3, 4, 5)),
+        Message(uuid='m2', name='Ben', initials='B', content='<p>Two</p>', status='approved',
+                image_path='x/full.jpg', thumb_path='x/thumb.jpg', media_type='image',
+                media_width=1600, media_height=900, placeholder='LEHV6nWB2yk8pyo0adR*.7kCMdnj'),
+        Message(uuid='m3', name='Cat', initials='C', content='<p>Three</p>', status='pending'),
+    ])
+    db.commit()
+    expected = {
+        msg.uuid: {
+            'uuid': msg.uuid, 'name': msg.name, 'initials': msg.initials,
+            'content_html': msg.content,
+            'thumb_url': f'/media/{msg.thumb_path}' if msg.thumb_path else None,
+            'image_url': f'/media/{msg.image_path}' if msg.image_path else None,
+            'video_url': None, 'preview_url': None, 'poster_url': None,
+            'media_type': msg.media_type, 'media_width': msg.media_width,
+            'media_height': msg.media_height, 'placeholder': msg.placeholder,
+            'attachments': [{
+                'media_type': 'image', 'url': f'/media/{msg.image_path}', 'thumb_url': f'/media/{msg.thumb_path}',
+                'preview_url': None, 'poster_url': None, 'width': msg.media_width, 'height': msg.media_height, 'placeholder': msg.placeholder
+            }] if msg.image_path else [],
+            'color_hint': msg.color_hint,
+            'created_at': msg.created_at.isoformat(),
+        }
+        for msg in db.query(Message).filter(Message.status == 'approved')
+    }
+    db.close()
+    
+    with app.test_client() as client:
+        messages = client.get('/api/messages').get_json()
+        assert [m['uuid'] for m in messages] == ['m1', 'm2']
+        assert {m['uuid']: m for m in messages} == expected
+        assert messages[0]['created_at'] == '2026-01-02T03:04:05'
+        print("✓ Projected rows match the ORM payload")
+        
+        summary = client.get('/api/messages?fields=summary').get_json()
+        assert set(summary[1]) == {'uuid', 'name', 'initials', 'color_hint', 'thumb_url', 'media_type',
+                                   'media_width', 'media_height', 'placeholder'}
+        assert summary[1]['thumb_url'] == '/media/x/thumb.jpg'
+        assert (summary[1]['media_width'], summary[1]['media_height']) == (1600, 900)
+        assert client.get('/api/messages?fields=name,uuid').get_json()[0] == {'name': 'Ann', 'uuid': 'm1'}
+        assert client.get('/api/messages?fields=ip_address').status_code == 400
+        
+        assert client.get('/api/messages/m2').get_json() == expected['m2']
+        assert client.get('/api/messages/m3').status_code == 404
+        print("✓ Summary projection and per-message fetch work")
+    
+    from flask import jsonify
+    with app.app_context():
+        assert jsonify(b=1, a=[2]).get_data() == b'{"a":[2],"b":1}'
+        assert jsonify(1, 'x').get_json() == [1, 'x']
+        assert jsonify({'a': 1}).get_json() == {'a': 1}
+        assert jsonify().get_json() is None
+    print("✓ jsonify payloads built from args and kwargs")
+    
+    sys.path = [p for p in sys.path if 'card' not in p]
+
+def test_card_first_paint():
+    """Test that the cover page embeds the first message tiles."""
+    import json
+    import re
+    print("\nTesting card first paint...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/card')
+    
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    os.environ['FIRST_PAGE_SIZE'] = '2'
+    try:
+        from app import create_app
+        from services import CardService
+        from shared.models import init_db, Message
+        app = create_app()
+        Session, engine = init_db(os.environ['DATABASE_URL'])
+        db = Session()
+        db.query(Message).delete()
+        db.add_all([
+            Message(uuid=f'p{i}', name='Ann', initials='A', content=f'<p>{i}</p>', status='approved',
+                    order_key=key, thumb_path=f'x/thumb{i}.jpg', image_path=f'x/full{i}.jpg', media_type='image')
+            for i, key in enumerate(('a', 'b', 'c'))
+        ])
+        db.commit()
+        db.close()
+        
+        with app.test_client() as client:
+            page = client.get('/').get_data(as_text=True)
+            inline = json.loads(re.search(
+                r'<script id="initialMessages" type="application/json">(.*?)</script>', page, re.S
+            ).group(1))
+            assert [m['uuid'] for m in inline] == ['p0', 'p1']
+            assert set(inline[0]) == set(CardService.TILE_FIELDS)
+            assert '<link rel="preload" as="image" href="/media/x/thumb0.jpg"' in page
+            assert 'let moreMessages = true;' in page
+            print("✓ First tiles and thumbnail preloads are inlined")
+            
+            rest = client.get('/api/messages?fields=tile&offset=2').get_json()
+            assert [m['uuid'] for m in rest] == ['p2']
+            assert rest[0]['content_html'] == '<p>2</p>' and 'attachments' not in rest[0]
+            assert [m['uuid'] for m in client.get('/api/messages?limit=1&offset=1').get_json()] == ['p1']
+            assert client.get('/api/messages?offset=-1').status_code == 400
+            print("✓ Remaining messages are served by page")
+            
+            db = Session()
+            db.add(Message(uuid='p3', name='Ann', initials='A', content='<p>3</p>', status='approved',
+                           order_key='d'))
+            db.commit()
+            db.close()
+            # The page every visitor loads is cached; arbitrary pages are not
+            assert [m['uuid'] for m in client.get('/api/messages?fields=tile&offset=2').get_json()] == ['p2']
+            assert [m['uuid'] for m in client.get('/api/messages?offset=2&limit=5').get_json()] == ['p2', 'p3']
+            print("✓ Only canonical pages are cached")
+        
+        from shared.cache import TTLCache
+        bounded = TTLCache(ttl=60, max_size=3)
+        for i in range(10):
+            bounded.set(i, i)
+        assert [i for i in range(10) if bounded.get(i) is not None] == [7, 8, 9]
+        print("✓ Bounded caches evict their oldest entries")
+    finally:
+        os.environ.pop('FIRST_PAGE_SIZE')
+        sys.path = [p for p in sys.path if 'card' not in p]
+
+def test_media_storage():
+    """Test the local media storage and direct media URLs."""
+    import io
+    import tempfile
+    print("\nTesting media storage...")
+    from shared.utils import LocalStorage, create_storage
+    
+    root = tempfile.mkdtemp()
+    storage = LocalStorage(root)
+    storage.write('a/clip.mp4', io.BytesIO(b'x' * 3000))
+    assert storage.size('a/clip.mp4') == 3000 and storage.exists('a/clip.mp4')
+    assert b''.join(storage.iter_chunks('a/clip.mp4', 1024)) == b'x' * 3000
+    assert storage.url('a/clip.mp4') is None
+    assert storage.size('../etc/passwd') is None and storage.size('missing.jpg') is None
+    storage.delete('a/clip.mp4')
+    storage.delete('a/clip.mp4')
+    assert not storage.exists('a/clip.mp4') and os.listdir(os.path.join(root, 'a')) == []
+    print("✓ Local storage streams, sizes and deletes files")
+    
+    class S3Config:
+        MEDIA_STORAGE, MEDIA_PATH, MEDIA_URL, S3_BUCKET = 's3', root, '', ''
+    try:
+        create_storage(S3Config)
+        assert False, "S3 storage without a bucket should be rejected"
+    except ValueError:
+        pass
+    
+    class FakeS3:
+        """In-memory stand-in for a boto3 S3 client."""
+        class exceptions:
+            class ClientError(Exception):
+                def __init__(self, code):
+                    self.response = {'Error': {'Code': code}}
+        
+        def __init__(self):
+            self.objects = {}
+        
+        def upload_fileobj(self, stream, bucket, key, ExtraArgs=None):
+            self.objects[(bucket, key)] = (stream.read(), ExtraArgs['ContentType'])
+        
+        def get_object(self, Bucket, Key):
+            return {'Body': io.BytesIO(self.objects[(Bucket, Key)][0])}
+        
+        def head_object(self, Bucket, Key):
+            if (Bucket, Key) not in self.objects:
+                raise self.exceptions.ClientError('404')
+            return {'ContentLength': len(self.objects[(Bucket, Key)][0])}
+        
+        def delete_object(self, Bucket, Key):
+            self.objects.pop((Bucket, Key), None)
+        
+        def generate_presigned_url(self, operation, Params, ExpiresIn):
+            return f"https://{Params['Bucket']}.s3.test/{Params['Key']}?expires={ExpiresIn}"
+    
+    from shared.utils import S3Storage
+    s3 = S3Storage('cards', root, prefix='/tenant-a/', url_expires=60)
+    s3._client, s3._client_pid = FakeS3(), os.getpid()
+    os.makedirs(os.path.join(root, 'b'))
+    Path(root, 'b/photo.jpg').write_bytes(b'jpeg')
+    s3.store('b/photo.jpg')
+    assert not Path(root, 'b/photo.jpg').exists()
+    assert s3.client.objects[('cards', 'tenant-a/b/photo.jpg')] == (b'jpeg', 'image/jpeg')
+    s3.write('b/clip.mp4', io.BytesIO(b'v' * 10))
+    assert s3.size('b/clip.mp4') == 10 and s3.size('b/missing.mp4') is None
+    assert b''.join(s3.iter_chunks('b/clip.mp4', 4)) == b'v' * 10
+    assert s3.url('b/clip.mp4') == 'https://cards.s3.test/tenant-a/b/clip.mp4?expires=60'
+    s3.delete('b/clip.mp4')
+    assert not s3.exists('b/clip.mp4')
+    s3.base_url = 'https://cdn.example.com/media'
+    assert s3.url('b/photo.jpg') == 'https://cdn.example.com/media/b/photo.jpg'
+    print("✓ S3 storage uploads under its prefix and signs links without MEDIA_URL")
+    
+    _reset_service_modules()
+    sys.path.insert(0, 'services/card')
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    os.environ['MEDIA_URL'] = 'https://cdn.example.com/media/'
+    try:
+        from app import create_app
+        from shared.models import init_db, Message
+        app = create_app()
+        Session, engine = init_db(os.environ['DATABASE_URL'])
+        db = Session()
+        db.query(Message).delete()
+        db.add(Message(uuid='s1', name='Ann', initials='A', content='<p>One</p>', status='approved',
+                       image_path='x/full.jpg', thumb_path='x/thumb.jpg', media_type='image'))
+        db.commit()
+        db.close()
+        with app.test_client() as client:
+            message = client.get('/api/messages/s1').get_json()
+            assert message['thumb_url'] == 'https://cdn.example.com/media/x/thumb.jpg'
+            assert message['attachments'][0]['url'] == 'https://cdn.example.com/media/x/full.jpg'
+            response = client.get('/media/x/full.jpg')
+            assert response.status_code == 302
+            assert response.headers['Location'] == 'https://cdn.example.com/media/x/full.jpg'
+        print("✓ Media links point straight at MEDIA_URL")
+    finally:
+        os.environ.pop('MEDIA_URL')
+        sys.path = [p for p in sys.path if 'card' not in p]
+
+def test_message_ordering():
+    """Test manual card order with fractional order keys."""
+    import tempfile
+    print("\nTesting message ordering...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/dashboard')
+    
+    os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/order.db'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    
+    from app import create_app
+    from services import MessageService
+    from shared.models import init_db, Message
+    from shared.utils import OrderKey
+    app = create_app()
+    Session, engine = init_db(os.environ['DATABASE_URL'])
+    db = Session()
+    db.add_all([Message(uuid=f'o{i}', name='Ann', initials='A', content='<p>x</p>') for i in range(1, 5)])
+    db.commit()
+    ids = {m.uuid: m.id for m in db.query(Message)}
+    service = MessageService(db)
+    for uuid in ('o1', 'o2', 'o3'):
+        assert service.approve_message(ids[uuid])
+    
+    def order():
+        db.expire_all()
+        return [m.uuid for m in service.get_approved_messages()]
+    
+    def keys():
+        return {m.uuid: m.order_key for m in db.query(Message)}
+    
+    assert order() == ['o1', 'o2', 'o3']
+    before = keys()
+    assert service.move_message(ids['o3'])
+    after = keys()
+    assert order() == ['o3', 'o1', 'o2']
+    assert [uuid for uuid in after if after[uuid] != before[uuid]] == ['o3']
+    assert service.move_message(ids['o1'], after_id=ids['o2'])
+    assert order() == ['o3', 'o2', 'o1']
+    assert not service.move_message(ids['o4']) and not service.move_message(ids['o1'], ids['o4'])
+    assert service.move_message(ids['o1'], ids['o1']) and order() == ['o3', 'o2', 'o1']
+    assert service.unapprove_message(ids['o2']) and keys()['o2'] is None
+    assert service.approve_message(ids['o2']) and order() == ['o3', 'o1', 'o2']
+    print("✓ Moves rewrite only the moved message")
+    
+    with app.test_client() as client:
+        assert client.post(f"/messages/{ids['o2']}/move", data={'after': ''}).status_code == 200
+        assert order() == ['o2', 'o3', 'o1']
+        assert client.post(f"/messages/{ids['o1']}/move", data={'after': 'x'}).status_code == 400
+        assert client.post(f"/messages/{ids['o4']}/move", data={'after': ''}).status_code == 404
+        assert client.post(f"/messages/{ids['o1']}/move", data={'after': ids['o1']}).status_code == 200
+        assert client.post(f"/messages/{ids['o1']}/move", data={'after': '999'}).status_code == 404
+        
+        db.add_all([Message(uuid=f'bulk{i}', name='Bulk', initials='B', content='<p>x</p>') for i in range(120)])
+        db.commit()
+        for message in db.query(Message).filter(Message.uuid.like('bulk%')).order_by(Message.id):
+            service.approve_message(message.id)
+        page = client.get('/messages/approved').get_data(as_text=True)
+        # Messages approved last are listed past the first hundred
+        assert page.count('data-message-id=') == 123
+        assert f'data-message-id="{db.query(Message).filter_by(uuid="bulk119").one().id}"' in page
+        db.query(Message).filter(Message.uuid.like('bulk%')).delete(synchronize_session=False)
+        db.commit()
+    
+    max_length = OrderKey.MAX_LENGTH
+    OrderKey.MAX_LENGTH = 2
+    try:
+        for _ in range(20):
+            first, second = order()[:2]
+            assert service.move_message(ids[second])
+            assert order()[:2] == [second, first]
+        assert max(len(key) for key in keys().values() if key) <= 2
+    finally:
+        OrderKey.MAX_LENGTH = max_length
+    print("✓ Move endpoint works and long keys are rebalanced")
+    
+    # Rows approved before order keys (or bulk loaded) have none
+    db.query(Message).update({'order_key': None, 'status': 'approved'})
+    db.commit()
+    assert order() == ['o1', 'o2', 'o3', 'o4']
+    assert service.move_message(ids['o4'])
+    assert order() == ['o4', 'o1', 'o2', 'o3']
+    assert service.move_message(ids['o1'], after_id=ids['o3'])
+    assert order() == ['o4', 'o2', 'o3', 'o1']
+    assert None not in keys().values()
+    db.close()
+    print("✓ Moves on a card with keyless rows rebalance it first")
+    
+    sys.path = [p for p in sys.path if 'dashboard' not in p]
+
+def test_video_previews():
+    """Test video preview clips and posters in the dashboard and card API."""
+    import tempfile
+    print("\nTesting video previews...")
+    from shared.utils import VideoProcessor
+    media_path = tempfile.mkdtemp()
+    processor = VideoProcessor(media_path)
+    Path(media_path, '2025/01/01').mkdir(parents=True)
+    Path(media_path, '2025/01/01/clip.mp4').write_bytes(b'not a video')
+    assert processor.preview_name('clip.mp4') == 'preview_clip.mp4'
+    assert processor.poster_name('clip.mp4') == 'poster_clip.jpg'
+    # Without a decodable video (or ffmpeg) the original is left to play alone
+    assert processor.generate_previews('2025/01/01/clip.mp4') == (None, None)
+    assert sorted(p.name for p in Path(media_path, '2025/01/01').iterdir()) == ['clip.mp4']
+    print("✓ Failed previews leave no partial files")
+    
+    assert processor._display_size({'width': 1920, 'height': 1080}) == (1920, 1080)
+    assert processor._display_size({'width': 1920, 'height': 1080, 'tags': {'rotate': '90'}}) == (1080, 1920)
+    assert processor._display_size({'width': 1920, 'height': 1080,
+                                     'side_data_list': [{'rotation': -90}]}) == (1080, 1920)
+    assert processor._display_size({'width': 1920, 'height': 1080,
+                                     'side_data_list': [{'rotation': 180}]}) == (1920, 1080)
+    print("✓ Rotated videos report their displayed size")
+    
+    _reset_service_modules()
+    sys.path.insert(0, 'services/dashboard')
+    os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/previews.db'
+    os.environ['MEDIA_PATH'] = media_path
+    
+    from app import create_app
+    from shared.models import init_db, Message, MessageAttachment
+    app = create_app()
+    Session, engine = init_db(os.environ['DATABASE_URL'])
+    db = Session()
+    message = Message(uuid='v1', name='Ann', initials='A', content='<p>x</p>', status='approved',
+                      media_type='video', video_path='2025/01/01/clip.mp4',
+                      thumb_path='2025/01/01/thumb_clip.jpg', preview_path='2025/01/01/preview_clip.mp4',
+                      poster_path='2025/01/01/poster_clip.jpg')
+    db.add(message)
+    db.add(Message(uuid='v2', name='Ben', initials='B', content='<p>y</p>', status='approved',
+                   media_type='video', video_path='2025/01/01/old.mp4'))
+    db.flush()
+    db.add(MessageAttachment(message_id=message.id, position=0, media_type='video',
+                             path=message.video_path, thumb_path=message.thumb_path,
+                             preview_path=message.preview_path, poster_path=message.poster_path))
+    db.commit()
+    db.close()
+    
+    with app.test_client() as client:
+        html = client.get('/messages/approved').get_data(as_text=True)
+        assert html.count('preload="none"') == 2
+        assert 'poster="/media/2025/01/01/poster_clip.jpg"' in html
+    print("✓ Dashboard videos load only on play, with posters")
+    sys.path = [p for p in sys.path if 'dashboard' not in p]
+    
+    _reset_service_modules()
+    sys.path.insert(0, 'services/card')
+    from app import create_app
+    with create_app().test_client() as client:
+        data = client.get('/api/messages/v1').get_json()
+        assert (data['preview_url'], data['poster_url']) == (
+            '/media/2025/01/01/preview_clip.mp4', '/media/2025/01/01/poster_clip.jpg')
+        assert data['attachments'][0]['preview_url'] == data['preview_url']
+        legacy = client.get('/api/messages/v2').get_json()
+        assert legacy['attachments'][0]['preview_url'] is None
+        assert legacy['attachments'][0]['url'] == '/media/2025/01/01/old.mp4'
+        assert 'preload="none"' in client.get('/').get_data(as_text=True)
+    print("✓ Card API exposes preview clips and posters")
+    sys.path = [p for p in sys.path if 'card' not in p]
+
+def test_sanitizer():
+    """Test the shared sanitizer, dashboard edits and the resanitize command."""
+    import tempfile
+    print("\nTesting content sanitizer...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/dashboard')
+    sys.path.insert(0, 'scripts')
+    
+    os.environ['DATABASE_URL'] = f'sqlite:///{tempfile.mkdtemp()}/sanitize.db'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    
+    from shared.utils import ContentSanitizer
+    styled = '<span style="color: red; position: fixed">hi</span><script>x()</script>'
+    assert ContentSanitizer.sanitize(styled) == '<span style="color: red;">hi</span>x()'
+    assert ContentSanitizer.sanitize(styled) is ContentSanitizer.sanitize(styled)
+    assert ContentSanitizer.sanitize_many(['<p>a</p>', '<b>b</b>', '<p>a</p>']) == ['<p>a</p>', 'b', '<p>a</p>']
+    print("✓ Styles filtered and results cached")
+    
+    from app import create_app
+    from shared.models import init_db, Message
+    from resanitize_messages import resanitize
+    app = create_app()
+    Session, engine = init_db(os.environ['DATABASE_URL'])
+    db = Session()
+    message = Message(uuid='san-1', name='Ann', initials='A', content='<p>ok</p>', status='pending')
+    legacy = Message(uuid='san-2', name='Ben', initials='B', content='<p onclick="x()">old</p>', status='approved')
+    db.add_all([message, legacy])
+    db.commit()
+    message_id, legacy_id = message.id, legacy.id
+    db.close()
+    
+    with app.test_client() as client:
+        client.post(f'/messages/{message_id}/edit', data={
+            'name': 'Ann', 'content': '<p>new<img src=x onerror=alert(1)></p>'
+        })
+    assert resanitize(engine, batch_size=1, dry_run=True) == {'scanned': 2, 'changed': 1}
+    assert resanitize(engine, batch_size=1) == {'scanned': 2, 'changed': 1}
+    db = Session()
+    assert db.get(Message, message_id).content == '<p>new</p>'
+    assert db.get(Message, legacy_id).content == '<p>old</p>'
+    db.close()
+    print("✓ Dashboard edits and stored messages are sanitized")
+    
+    sys.path = [p for p in sys.path if 'dashboard' not in p and p != 'scripts']
+
+def test_dashboard_export():
+    """Test the streamed ZIP export of a card."""
+    import io
+    import tempfile
+    import uuid
+    import zipfile
+    print("\nTesting Dashboard export...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/dashboard')
+    sys.path.insert(0, '.')
+    
+    tmp_dir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{tmp_dir}/card.db'
+    os.environ['MEDIA_PATH'] = f'{tmp_dir}/media'
+    
+    from shared.models import init_db, Message
+    os.makedirs(f'{tmp_dir}/media/2025/01/01')
+    with open(f'{tmp_dir}/media/2025/01/01/photo.jpg', 'wb') as f:
+        f.write(b'\xff\xd8' + os.urandom(200 * 1024))
+    Session, engine = init_db(os.environ['DATABASE_URL'])
+    db = Session()
+    db.add(Message(uuid=str(uuid.uuid4()), name='Ada Lovelace', initials='AL',
+                   content='<p>Happy birthday!</p>', image_path='2025/01/01/photo.jpg',
+                   thumb_path='2025/01/01/thumb_photo.jpg', media_type='image',
+                   status='approved'))
+    db.add(Message(uuid=str(uuid.uuid4()), name='Pending Person', initials='PP',
+                   content='<p>Not yet</p>', status='pending'))
+    db.commit()
+    db.close()
+    
+    from app import create_app
+    app = create_app()
+    
+    with app.test_client() as client:
+        response = client.get('/export')
+        assert response.status_code == 200
+        assert response.is_streamed
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        names = archive.namelist()
+        assert 'messages/0001-ada-lovelace.html' in names
+        assert 'media/2025/01/01/photo.jpg' in names
+        assert archive.getinfo('media/2025/01/01/photo.jpg').compress_type == zipfile.ZIP_STORED
+        assert archive.getinfo('messages.json').compress_type == zipfile.ZIP_DEFLATED
+        exported = json.loads(archive.read('messages.json'))
+        assert [m['name'] for m in exported] == ['Ada Lovelace']
+        assert archive.testzip() is None
+        print(f"✓ Export contains {len(names)} entries")
+    
+    sys.path = [p for p in sys.path if 'dashboard' not in p]
+
+def test_combined():
+    """Test the combined single-process deployment."""
+    print("\nTesting Combined deployment...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/combined')
+    sys.path.insert(0, '.')
+    
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    
+    from app import create_app
+    app = create_app()
+    
+    from werkzeug.test import Client
+    client = Client(app)
+    assert client.get('/health').get_json() == {'status': 'healthy'}
+    assert client.get('/api/messages').status_code == 200
+    response = client.get('/dashboard/')
+    assert response.status_code == 200
+    assert b'href="/dashboard/messages/pending"' in response.data
+    assert client.get('/submit/not-a-token').status_code == 403
+    print("✓ Combined app routes to all three services")
+    
+    sys.path = [p for p in sys.path if 'combined' not in p]
+
+def test_multi_tenant():
+    """Test host and path based card resolution."""
+    import tempfile
+    import uuid
+    print("\nTesting multi-tenant card resolution...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/card')
+    sys.path.insert(0, '.')
+    
+    tmp_dir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{tmp_dir}/cards.db'
+    os.environ['MEDIA_PATH'] = f'{tmp_dir}/media'
+    os.environ['TENANT_MODE'] = 'path'
+    
+    from shared.models import init_db, Card, Message
+    Session, engine = init_db(os.environ['DATABASE_URL'])
+    db = Session()
+    bob = Card(slug='bob', host='bob.example.com')
+    kun = Card(slug='kun', host='kun.example.com')
+    db.add_all([bob, kun])
+    db.flush()
+    for card, name in ((bob, 'For Bob'), (kun, 'For Kun')):
+        db.add(Message(uuid=str(uuid.uuid4()), card_id=card.id, name=name, initials='X',
+                       content='<p>Hi</p>', status='approved', thumb_path='a/thumb.jpg'))
+    db.commit()
+    kun_id = kun.id
+    db.close()
+    os.makedirs(f'{tmp_dir}/media/a')
+    with open(f'{tmp_dir}/media/a/thumb.jpg', 'wb') as f:
+        f.write(b'jpeg')
+    
+    try:
+        from app import create_app
+        app = create_app()
+        with app.test_client() as client:
+            data = client.get('/bob/api/messages').get_json()
+            assert [m['name'] for m in data] == ['For Bob']
+            assert data[0]['thumb_url'] == '/bob/media/a/thumb.jpg'
+            assert [m['name'] for m in client.get('/kun/api/messages').get_json()] == ['For Kun']
+            assert client.get('/nobody/api/messages').status_code == 404
+            assert client.get('/bob/media/a/thumb.jpg').status_code == 200
+            assert client.get('/bob/media/a/other.jpg').status_code == 404
+        print("✓ Path mode scopes messages and media per card")
+    finally:
+        os.environ.pop('TENANT_MODE')
+    
+    from shared.tenancy import TenantMiddleware, CARD_ID_KEY
+    seen = {}
+    def inner(environ, start_response):
+        seen['card_id'] = environ[CARD_ID_KEY]
+        start_response('200 OK', [])
+        return [b'']
+    middleware = TenantMiddleware(inner, Session, mode='host')
+    from werkzeug.test import Client
+    client = Client(middleware)
+    assert client.get('/', headers={'Host': 'kun.example.com'}).status_code == 200
+    assert seen['card_id'] == kun_id
+    assert client.get('/', headers={'Host': 'other.example.com'}).status_code == 404
+    print("✓ Host mode resolves cards by host name")
+    
+    import argparse
+    sys.path.insert(0, 'scripts')
+    from manage_cards import add_card, deactivate_card
+    db = Session()
+    add_card(db, argparse.Namespace(slug='other', host='other.example.com', name=None, adopt_default=False))
+    assert client.get('/', headers={'Host': 'other.example.com'}).status_code == 200
+    deactivate_card(db, argparse.Namespace(slug='kun'))
+    db.close()
+    assert client.get('/', headers={'Host': 'kun.example.com'}).status_code == 200
+    middleware.cache.invalidate()  # as when TENANT_CACHE_TTL runs out
+    assert client.get('/', headers={'Host': 'kun.example.com'}).status_code == 404
+    print("✓ Misses are not cached and deactivated cards expire from the cache")
+    
+    from datetime import datetime
+    from shared.models import MessageAttachment, ArchivedMessage, ArchivedInviteLink, DEFAULT_CARD_ID
+    db = Session()
+    legacy = Message(uuid=str(uuid.uuid4()), name='Old', initials='O', content='<p>Hi</p>', status='approved')
+    db.add(legacy)
+    db.flush()
+    db.add_all([
+        MessageAttachment(message_id=legacy.id, position=0, media_type='image', path='b/photo.jpg'),
+        ArchivedMessage(id=999, uuid=str(uuid.uuid4()), name='Gone', initials='G', content='<p>Bye</p>',
+                        status='rejected', created_at=datetime.utcnow()),
+        ArchivedInviteLink(token='old-token', created_at=datetime.utcnow(), is_active=False),
+    ])
+    db.commit()
+    add_card(db, argparse.Namespace(slug='adopter', host=None, name=None, adopt_default=True))
+    adopter_id = db.query(Card).filter(Card.slug == 'adopter').one().id
+    for model in (Message, MessageAttachment, ArchivedMessage, ArchivedInviteLink):
+        assert {row.card_id for row in db.query(model).filter(model.card_id.in_([DEFAULT_CARD_ID, adopter_id]))} == {adopter_id}
+    db.close()
+    sys.path.remove('scripts')
+    print("✓ --adopt-default moves attachments and archived rows too")
+    
+    sys.path = [p for p in sys.path if 'card' not in p]
+
+def test_card_boot_is_lightweight():
+    """Test that the card service boots without the media/sanitizer libraries."""
+    import subprocess
+    print("\nTesting Card service boot imports...")
+    code = (
+        "import sys; sys.path.insert(0, 'services/card'); sys.path.insert(0, '.');"
+        "from app import create_app; create_app();"
+        "print(','.join(m for m in ('PIL', 'magic', 'bleach') if m in sys.modules))"
+    )
+    env = dict(os.environ, DATABASE_URL='sqlite:///:memory:', MEDIA_PATH='/tmp/test_media')
+    result = subprocess.run([sys.executable, '-c', code], env=env,
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == '', result.stdout
+    print("✓ Card service boots without Pillow, magic or bleach")
+
+def test_sqlite_limiter_storage():
+    """Test that rate limit counters are shared through the SQLite storage."""
+    import tempfile
+    print("\nTesting SQLite limiter storage...")
+    sys.path.insert(0, '.')
+    from limits import parse
+    from limits.storage import storage_from_string
+    from limits.strategies import FixedWindowRateLimiter
+    from shared.utils.limiter_storage import SQLiteLimiterStorage
+    
+    uri = f'sqlite:///{tempfile.mkdtemp()}/ratelimit.db'
+    # Two storages on the same file behave like two gunicorn workers
+    worker_a = FixedWindowRateLimiter(storage_from_string(uri))
+    worker_b = FixedWindowRateLimiter(storage_from_string(uri))
+    assert isinstance(worker_a.storage, SQLiteLimiterStorage)
+    limit = parse('2 per minute')
+    assert worker_a.hit(limit, '10.0.0.1')
+    assert worker_b.hit(limit, '10.0.0.1')
+    assert not worker_a.hit(limit, '10.0.0.1')
+    assert worker_b.hit(limit, '10.0.0.2')
+    assert worker_b.get_window_stats(limit, '10.0.0.1').remaining == 0
+    worker_a.clear(limit, '10.0.0.1')
+    assert worker_b.hit(limit, '10.0.0.1')
+    print("✓ Limits are enforced across workers")
+
+def test_populate_test_db():
+    """Test that the test data generator is deterministic and bulk inserts."""
+    print("\nTesting test data generator...")
+    sys.path.insert(0, 'scripts')
+    from populate_test_db import TestDataGenerator, populate
+    from shared.models import init_db, Message
+    
+    first = list(TestDataGenerator(seed=7).message_rows(50))
+    second = list(TestDataGenerator(seed=7).message_rows(50))
+    assert first == second
+    assert first != list(TestDataGenerator(seed=8).message_rows(50))
+    
+    url = 'sqlite:///:memory:'
+    counts = populate(url, 1200, 30, seed=7, batch_size=500)
+    assert counts['messages'] == 1200 and counts['invite_links'] == 30
+    Session, engine = init_db(url)
+    db = Session()
+    statuses = {m.status for m in db.query(Message).all()}
+    assert statuses == {'approved', 'pending', 'rejected'}
+    # Approved rows are placed on the card, others are not
+    keyed = db.query(Message.status).filter(Message.order_key.isnot(None)).distinct()
+    assert {status for status, in keyed} == {'approved'}
+    db.close()
+    print("✓ Generated data is reproducible")
+
+class _BucketStorage(LocalStorage):
+    """Stand-in for object storage: files live in a directory apart from staging."""
+    
+    def __init__(self, bucket, staging):
+        super().__init__(bucket)
+        self.staging_path = Path(staging)
+    
+    def store(self, rel_path):
+        target = self._path(rel_path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self.staging_path / rel_path, target)
+
+
+def test_reprocess_media():
+    """Test that the reprocess command rebuilds thumbnails and resumes."""
+    import json
+    import shutil
+    import tempfile
+    from PIL import Image
+    print("\nTesting media reprocessing...")
+    sys.path.insert(0, 'scripts')
+    from reprocess_media import reprocess
+    from shared.models import init_db, Message, CardCover
+    
+    tmp_dir = tempfile.mkdtemp()
+    media = os.path.join(tmp_dir, 'media')
+    os.makedirs(f'{media}/2025/01/01')
+    Session, engine = init_db(f'sqlite:///{tmp_dir}/media.db')
+    db = Session()
+    for i in range(5):
+        Image.new('RGB', (400, 300), (i * 40, 0, 0)).save(f'{media}/2025/01/01/img{i}.jpg')
+        db.add(Message(uuid=f'img-{i}', name='Ann', initials='A', content='<p>x</p>',
+                       image_path=f'2025/01/01/img{i}.jpg', media_type='image',
+                       thumb_path=f'2025/01/01/old{i}.jpg' if i == 0 else None))
+    Image.new('RGB', (800, 600), (0, 90, 200)).save(f'{media}/2025/01/01/cover.jpg')
+    db.add(CardCover(image_path='2025/01/01/cover.jpg', is_active=True))
+    db.commit()
+    db.close()
+    open(f'{media}/2025/01/01/old0.jpg', 'wb').close()
+    
+    checkpoint = os.path.join(tmp_dir, 'checkpoint.json')
+    with open(checkpoint, 'w') as f:
+        json.dump({'messages': 2}, f)
+    counts = reprocess(engine, media, workers=2, batch_size=2, checkpoint=checkpoint)
+    assert counts == {'processed': 4, 'updated': 3, 'errors': 0}
+    assert not os.path.exists(checkpoint)
+    
+    # Existing thumbnails are rebuilt in place, only new paths are written
+    counts = reprocess(engine, media, workers=2, batch_size=2, checkpoint=checkpoint)
+    assert counts == {'processed': 5, 'updated': 2, 'errors': 0}
+    db = Session()
+    for message in db.query(Message).all():
+        with Image.open(os.path.join(media, message.thumb_path)) as thumb:
+            assert max(thumb.size) == 200
+        assert (message.media_width, message.media_height) == (400, 300)
+        assert message.placeholder.startswith('L')
+    cover = db.query(CardCover).one()
+    assert (cover.width, cover.height) == (800, 600) and cover.placeholder
+    db.close()
+    # Replaced thumbnails are removed once the database points elsewhere
+    assert not os.path.exists(f'{media}/2025/01/01/old0.jpg')
+    assert reprocess(engine, media, missing_only=True, checkpoint=checkpoint)['processed'] == 0
+    print("✓ Thumbnails and placeholders rebuilt from the checkpoint onwards")
+    
+    # Media in remote storage is fetched to staging and the results stored
+    bucket, staging = os.path.join(tmp_dir, 'bucket'), os.path.join(tmp_dir, 'staging')
+    shutil.move(media, bucket)
+    os.makedirs(staging)
+    storage = _BucketStorage(bucket, staging)
+    db = Session()
+    db.query(Message).update({'thumb_path': None, 'placeholder': None})
+    db.commit()
+    counts = reprocess(engine, staging, missing_only=True, workers=2, batch_size=2,
+                       checkpoint=checkpoint, storage=storage)
+    assert counts == {'processed': 5, 'updated': 5, 'errors': 0}
+    for message in db.query(Message).all():
+        with Image.open(os.path.join(bucket, message.thumb_path)) as thumb:
+            assert max(thumb.size) == 200
+    db.close()
+    assert not [f for _, _, files in os.walk(staging) for f in files]
+    print("✓ Media in object storage is fetched, processed and stored back")
+    
+    sys.path = [p for p in sys.path if p != 'scripts']
+
+def test_backup_restore():
+    """Test online backups with incremental media and restoring them."""
+    import tempfile
+    print("\nTesting backup and restore...")
+    sys.path.insert(0, 'scripts')
+    from backup import backup, restore
+    from shared.models import init_db, Message
+    
+    tmp_dir = tempfile.mkdtemp()
+    media = Path(tmp_dir, 'media')
+    (media / '2025/01/01').mkdir(parents=True)
+    (media / '2025/01/01/a.jpg').write_bytes(b'a' * 100)
+    (media / 'legacy.jpg').write_bytes(b'l')
+    database_url = f'sqlite:///{tmp_dir}/live.db'
+    Session, engine = init_db(database_url)
+    db = Session()
+    db.add(Message(uuid='bk-1', name='Ann', initials='A', content='<p>x</p>', status='approved'))
+    db.commit()
+    
+    backups = os.path.join(tmp_dir, 'backups')
+    first = backup(database_url, str(media), backups, pages=1)
+    assert (first['archives_written'], first['archives']) == (2, 2)
+    assert backup(database_url, str(media), backups)['archives_written'] == 0
+    (media / '2025/01/02').mkdir()
+    (media / '2025/01/02/b.jpg').write_bytes(b'b')
+    db.add(Message(uuid='bk-2', name='Ben', initials='B', content='<p>y</p>', status='approved'))
+    db.commit()
+    db.close()
+    third = backup(database_url, str(media), backups)
+    assert (third['archives_written'], third['archives']) == (1, 3)
+    print("✓ Only new media days are archived")
+    
+    restored_url = f'sqlite:///{tmp_dir}/restored/card.db'
+    restored_media = Path(tmp_dir, 'restored/media')
+    result = restore(backups, restored_url, str(restored_media))
+    assert result['snapshot'] == Path(third['snapshot']).name
+    Session, engine = init_db(restored_url)
+    db = Session()
+    assert {m.uuid for m in db.query(Message)} == {'bk-1', 'bk-2'}
+    db.close()
+    assert (restored_media / '2025/01/01/a.jpg').read_bytes() == b'a' * 100
+    assert (restored_media / '2025/01/02/b.jpg').exists() and (restored_media / 'legacy.jpg').exists()
+    try:
+        restore(backups, restored_url, str(restored_media))
+        assert False, "Restoring over an existing database needs force"
+    except FileExistsError:
+        pass
+    print("✓ Latest snapshot restored")
+    
+    # Changed days get new archives; older snapshots keep theirs
+    (media / '2025/01/01/a.jpg').unlink()
+    (media / '2025/01/02/b.jpg').write_bytes(b'changed')
+    fourth = backup(database_url, str(media), backups)
+    assert (fourth['archives_written'], fourth['archives'], fourth['archives_pruned']) == (1, 2, 0)
+    older_media = Path(tmp_dir, 'older/media')
+    restore(backups, f'sqlite:///{tmp_dir}/older/card.db', str(older_media),
+            snapshot=Path(third['snapshot']).name)
+    assert (older_media / '2025/01/01/a.jpg').read_bytes() == b'a' * 100
+    assert (older_media / '2025/01/02/b.jpg').read_bytes() == b'b'
+    fifth = backup(database_url, None, backups, keep=1)
+    assert (fifth['archives'], fifth['snapshots_pruned']) == (0, 4)
+    assert not list(Path(backups, 'media').iterdir())
+    print("✓ Snapshots restore their own media and pruning drops unreferenced archives")
+    
+    sys.path = [p for p in sys.path if 'scripts' not in p]
+
+def test_retention():
+    """Test archiving, media purging, IP scrubbing and incremental vacuum."""
+    import tempfile
+    from datetime import datetime, timedelta
+    print("\nTesting retention job...")
+    sys.path.insert(0, 'scripts')
+    from retention import apply_retention
+    from shared.models import (init_db, ArchivedInviteLink, ArchivedMessage, InviteLink, Message,
+                               MessageAttachment)
+    from shared.utils import LocalStorage
+    
+    tmp_dir = tempfile.mkdtemp()
+    media = Path(tmp_dir, 'media')
+    (media / '2025/01/01').mkdir(parents=True)
+    for name in ('full.jpg', 'thumb.jpg', 'second.jpg', 'kept.jpg'):
+        (media / '2025/01/01' / name).write_bytes(b'x')
+    Session, engine = init_db(f'sqlite:///{tmp_dir}/retention.db')
+    now = datetime(2025, 6, 1)
+    old = now - timedelta(days=120)
+    db = Session()
+    db.add_all([
+        Message(uuid='r-old', name='Ann', initials='A', content='<p>spam</p>' * 2000, status='rejected',
+                created_at=old, ip_address='10.0.0.1', image_path='2025/01/01/full.jpg',
+                thumb_path='2025/01/01/thumb.jpg', media_type='image'),
+        Message(uuid='r-new', name='Ben', initials='B', content='<p>no</p>', status='rejected',
+                created_at=now - timedelta(days=2), ip_address='10.0.0.2'),
+        Message(uuid='a-old', name='Cat', initials='C', content='<p>yes</p>', status='approved',
+                created_at=old, ip_address='10.0.0.3', image_path='2025/01/01/kept.jpg', media_type='image'),
+        InviteLink(token='expired', created_at=old, expires_at=old),
+        InviteLink(token='inactive', created_at=old, is_active=False),
+        InviteLink(token='live', created_at=old),
+    ])
+    db.flush()
+    rejected_id = db.query(Message.id).filter(Message.uuid == 'r-old').scalar()
+    db.add(MessageAttachment(message_id=rejected_id, position=1, media_type='image',
+                             path='2025/01/01/second.jpg'))
+    db.commit()
+    db.close()
+    
+    storage = LocalStorage(str(media))
+    preview = apply_retention(engine, storage, dry_run=True, now=now)
+    assert (preview['messages'], preview['files'], preview['links'], preview['ips']) == (1, 3, 2, 2)
+    counts = apply_retention(engine, storage, batch_size=1, now=now)
+    assert (counts['messages'], counts['files'], counts['links'], counts['ips']) == (1, 3, 2, 1)
+    assert counts['pages_freed'] > 0
+    
+    db = Session()
+    assert {m.uuid for m in db.query(Message)} == {'r-new', 'a-old'}
+    assert [m.uuid for m in db.query(ArchivedMessage)] == ['r-old']
+    assert db.query(MessageAttachment).count() == 0
+    assert {l.token for l in db.query(InviteLink)} == {'live'}
+    assert {l.token for l in db.query(ArchivedInviteLink)} == {'expired', 'inactive'}
+    assert {m.uuid: m.ip_address for m in db.query(Message)} == {'r-new': '10.0.0.2', 'a-old': None}
+    db.close()
+    assert sorted(p.name for p in (media / '2025/01/01').iterdir()) == ['kept.jpg']
+    assert apply_retention(engine, storage, now=now)['messages'] == 0
+    print("✓ Old rows archived, media purged, IPs cleared and pages released")
+    
+    sys.path = [p for p in sys.path if 'scripts' not in p]
+
+def test_compression():
+    """Test negotiated, cached and streamed response compression."""
+    import gzip
+    from flask import Flask, Response
+    from shared.compression import CompressedBodyCache, init_compression
+    print("\nTesting response compression...")
+    
+    app = Flask('compression-test')
+    cache = init_compression(app, min_size=100)
+    
+    @app.route('/big')
+    def big():
+        return {'messages': ['<p>Happy birthday!</p>'] * 50}
+    
+    @app.route('/small')
+    def small():
+        return 'hi'
+    
+    @app.route('/stream')
+    def stream():
+        return Response((f'line {i}\n' for i in range(1000)), mimetype='text/plain')
+    
+    @app.route('/binary')
+    def binary():
+        return Response(b'\0' * 1000, mimetype='application/octet-stream')
+    
+    with app.test_client() as client:
+        plain = client.get('/big')
+        assert 'Content-Encoding' not in plain.headers and 'Accept-Encoding' in plain.headers['Vary']
+        response = client.get('/big', headers={'Accept-Encoding': 'gzip, deflate'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(response.data) == plain.data
+        assert int(response.headers['Content-Length']) == len(response.data) < len(plain.data)
+        assert 'Content-Encoding' not in client.get('/small', headers={'Accept-Encoding': 'gzip'}).headers
+        assert 'Content-Encoding' not in client.get('/binary', headers={'Accept-Encoding': 'gzip'}).headers
+        assert 'Content-Encoding' not in client.get('/big', headers={'Accept-Encoding': 'gzip;q=0'}).headers
+        streamed = client.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        assert streamed.headers['Content-Encoding'] == 'gzip' and 'Content-Length' not in streamed.headers
+        assert gzip.decompress(streamed.data).decode() == ''.join(f'line {i}\n' for i in range(1000))
+    print("✓ Text responses compressed per Accept-Encoding, streams included")
+    
+    import shared.compression as compression
+    calls = []
+    original = compression.compress
+    compression.compress = lambda data, encoding: calls.append(encoding) or original(data, encoding)
+    try:
+        body = b'{"content": "<p>same</p>"}' * 100
+        assert gzip.decompress(cache.get_or_compress(body, 'gzip')) == body
+        cache.get_or_compress(body, 'gzip')
+        assert len(calls) == 1
+        small_cache = CompressedBodyCache(max_bytes=100)
+        for data in (body, body + b' ', body):
+            small_cache.get_or_compress(data, 'gzip')
+        assert len(calls) == 4
+    finally:
+        compression.compress = original
+    print("✓ Compressed bodies are reused until evicted")
+
+def test_metrics():
+    """Test the Prometheus metrics endpoint."""
+    print("\nTesting metrics endpoint...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/card')
+    
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    
+    from app import create_app
+    assert create_app().test_client().get('/metrics').status_code == 404
+    os.environ['METRICS_TOKEN'] = 'scrape-token'
+    _reset_service_modules()
+    try:
+        from app import create_app
+        app = create_app()
+    finally:
+        del os.environ['METRICS_TOKEN']
+    
+    with app.test_client() as client:
+        assert client.get('/api/messages').status_code == 200
+        assert client.get('/nope').status_code == 404
+        assert client.get('/metrics').status_code == 401
+        assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+        body = client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'}).get_data(as_text=True)
+        assert 'collation_http_request_duration_seconds_count{method="GET",route="/api/messages",service="card",status="200"}' in body
+        assert 'route="unmatched",service="card",status="404"' in body
+        assert 'collation_db_query_duration_seconds_count{service="card"}' in body
+        print("✓ Request and query metrics exposed to the scraper only")
+    
+    from sqlalchemy import create_engine
+    from shared.statement_timing import time_statements
+    engine = create_engine('sqlite://')
+    timings = []
+    def observe(statement, parameters, executemany, seconds):
+        timings.append(statement)
+    time_statements(engine, observe)
+    time_statements(engine, observe)
+    with engine.connect() as conn:
+        try:
+            conn.exec_driver_sql('SELECT * FROM missing')
+        except Exception:
+            pass
+        conn.exec_driver_sql('SELECT 1')
+    assert timings == ['SELECT 1']
+    print("✓ Failed statements leave no timing behind")
+    
+    sys.path = [p for p in sys.path if 'card' not in p]
+
+def test_query_stats():
+    """Test per-request SQL statistics."""
+    import logging
+    print("\nTesting SQL instrumentation...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/card')
+    
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    os.environ['SQL_INSTRUMENTATION'] = 'true'
+    os.environ['SQL_REPEAT_THRESHOLD'] = '2'
+    
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    logging.getLogger('shared.query_stats').addHandler(handler)
+    try:
+        from app import create_app
+        app = create_app()
+        app.debug = True
+        
+        # Issues the same statement twice in one request
+        from shared.models import init_db, Card
+        Session, engine = init_db(os.environ['DATABASE_URL'])
+        def lookup_twice():
+            db = Session()
+            try:
+                for _ in range(2):
+                    db.query(Card).filter(Card.id == 0).first()
+            finally:
+                db.close()
+            return ''
+        app.add_url_rule('/twice', 'twice', lookup_twice)
+        
+        with app.test_client() as client:
+            response = client.get('/api/messages')
+            assert int(response.headers['X-DB-Query-Count']) >= 1
+            assert float(response.headers['X-DB-Query-Time-Ms']) >= 0
+            print(f"✓ {response.headers['X-DB-Query-Count']} queries reported in headers")
+        
+        from shared.query_stats import parameter_shape
+        assert parameter_shape({'a': 1, 'b': 'x'}) == '{a: int, b: str}'
+        assert parameter_shape([(1,), (2,)], executemany=True) == '2 x (int)'
+        
+        app.debug = False
+        with app.test_client() as client:
+            response = client.get('/twice')
+            assert 'X-DB-Query-Count' not in response.headers
+        assert any('Possible N+1' in r.getMessage() for r in records)
+        print("✓ Repeated statements are reported")
+    finally:
+        logging.getLogger('shared.query_stats').removeHandler(handler)
+        del os.environ['SQL_INSTRUMENTATION']
+        del os.environ['SQL_REPEAT_THRESHOLD']
+        sys.path = [p for p in sys.path if 'card' not in p]
+
+def test_profiling():
+    """Test on-demand request profiling."""
+    import tempfile
+    print("\nTesting request profiling...")
+    _reset_service_modules()
+    sys.path.insert(0, 'services/card')
+    
+    profile_dir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+    os.environ['MEDIA_PATH'] = '/tmp/test_media'
+    os.environ['PROFILE_SECRET'] = 's3cret'
+    os.environ['PROFILE_DIR'] = profile_dir
+    os.environ['PROFILE_MAX_FILES'] = '2'
+    try:
+        from app import create_app
+        app = create_app()
+        
+        with app.test_client() as client:
+            response = client.get('/api/messages')
+            assert 'X-Profile-Id' not in response.headers
+            response = client.get('/api/messages', headers={'X-Profile': 'wrong'})
+            assert 'X-Profile-Id' not in response.headers
+            assert os.listdir(profile_dir) == []
+            
+            names = []
+            for _ in range(3):
+                response = client.get('/api/messages', headers={'X-Profile': 's3cret'})
+                assert response.status_code == 200
+                names.append(response.headers['X-Profile-Id'])
+                # The profile is written once the server closes the body
+                response.close()
+        assert names[0].endswith('.folded') and '-card-GET-api_messages-' in names[0]
+        # Only the newest PROFILE_MAX_FILES are kept
+        assert sorted(os.listdir(profile_dir)) == sorted(names[1:])
+        print(f"✓ Profile written: {names[-1]}")
+        
+        from shared.profiling import StackSampler
+        import threading, time
+        sampler = StackSampler(threading.get_ident(), interval=0.001)
+        sampler.start()
+        deadline = time.time() + 0.05
+        while time.time() < deadline:
+            sum(range(1000))
+        sampler.stop()
+        path = os.path.join(profile_dir, 'manual.folded')
+        sampler.write(path)
+        with open(path) as f:
+            stack, count = f.readline().rsplit(' ', 1)
+        assert 'test_profiling' in stack and int(count) > 0
+        print("✓ Folded stacks are flamegraph compatible")
+    finally:
+        for key in ('PROFILE_SECRET', 'PROFILE_DIR', 'PROFILE_MAX_FILES'):
+            del os.environ[key]
+        sys.path = [p for p in sys.path if 'card' not in p]
+
 if __name__ == '__main__':
     print("=" * 60)
     print("Virtual Card - Service Tests")
@@ -73,7 +1407,29 @@ if __name__ == '__main__':
     try:
         test_dashboard()
         test_submit()
+        test_admission_control()
+        test_idempotent_submission()
+        test_message_attachments()
         test_card()
+        test_card_message_projection()
+        test_card_first_paint()
+        test_media_storage()
+        test_message_ordering()
+        test_video_previews()
+        test_sanitizer()
+        test_dashboard_export()
+        test_combined()
+        test_multi_tenant()
+        test_card_boot_is_lightweight()
+        test_sqlite_limiter_storage()
+        test_populate_test_db()
+        test_reprocess_media()
+        test_backup_restore()
+        test_retention()
+        test_compression()
+        test_metrics()
+        test_query_stats()
+        test_profiling()
         
         print("\n" + "=" * 60)
         print("✓ All services passed tests!")